@@ -8,7 +8,9 @@
 import scrapy
 
 
-class YelpItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+class YelpReviewsItem(scrapy.Item):
+    # reviews of one business, written to output/reviews-<external_system_unique_id>.json
+    external_system_unique_id = scrapy.Field()
+    reviews = scrapy.Field()
+    total_reviews = scrapy.Field()
+    total_average_rating = scrapy.Field()
@@ -5,7 +5,18 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: http://doc.scrapy.org/en/latest/topics/item-pipeline.html
 
+import os
 
-class YelpPipeline(object):
-    def process_item(self, item, spider):
-        return item
+from common.pipelines import BatchedOutputPipeline
+
+output_dir_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'spiders', 'output')
+
+
+class YelpPipeline(BatchedOutputPipeline):
+
+    """Writes the YelpReviewsItems of YelpSpider, in batches (see BatchedOutputPipeline)"""
+
+    def outputs(self, item):
+        external_id = item['external_system_unique_id']
+        return (os.path.join(output_dir_path, 'reviews-' + str(external_id) + '.json'), dict(item),
+                "reviews", [dict(review, external_system_unique_id=external_id) for review in item['reviews']])
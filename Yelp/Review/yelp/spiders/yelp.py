@@ -2,15 +2,13 @@
 from __future__ import absolute_import, division, unicode_literals
 
 import scrapy
-import xlrd
 from datetime import datetime
 import time
-import json
 from scrapy.conf import settings
-
-import os
-
-base_dir_path = os.path.dirname(os.path.realpath(__file__))
+from common.xpaths import select, re_all, registry as xpath_registry
+from common.roster import Roster, YELP_URL, parse_shard
+from common.work_queue import WorkQueue, SpiderTasks
+from yelp.items import YelpReviewsItem
 
 
 def recheck_rev_json(data):
@@ -44,18 +42,57 @@ class YelpSpider(scrapy.Spider):
 
     settings.overrides['ROBOTSTXT_OBEY'] = False
 
+    # "i/N" (scrapy crawl yelp_crawler -a shard=i/N) to only crawl the i-th of N shards of the roster
+    shard = None
+    # "1" (-a queue=1) to crawl the offices leased from the work queue (WORK_QUEUE_PATH) instead of the roster
+    # directly: any number of crawls can then share the roster, and offices of a crawl that died are crawled again
+    queue = None
+
+    def __init__(self, *args, **kwargs):
+        super(YelpSpider, self).__init__(*args, **kwargs)
+        # (i, N), a malformed value stops the crawl before it starts
+        self.shard = parse_shard(self.shard)
+        self.queue = self.queue not in (None, '', '0')
+        # SpiderTasks of the work queue, set when the crawl starts
+        self.tasks = None
+
+    def closed(self, reason):
+        if self.tasks is not None:
+            self.tasks.close()
+        # hottest xpath selectors of the crawl
+        for selector_stats in xpath_registry.stats()[:10]:
+            self.logger.info("xpath %(name)s: %(calls)s calls, %(seconds)s s", selector_stats)
+
     def start_requests(self):
-        url_list = []
-        file = xlrd.open_workbook(base_dir_path + "/Research Offices.xlsx")
-        sheet = file.sheet_by_index(0)
-        for k in range(1, sheet.nrows):
-            external_id = int(sheet.row_values(k)[0])
-            url_list.append({'id': external_id, 'url': str(sheet.row_values(k)[9])})
-        for url in url_list:
-            if url['url'] and 'yelp.com' in url['url']:
-                yield scrapy.Request(url=url['url'], callback=self.parse_product,
-                                     dont_filter=True, headers=self.header,
-                                     meta={'external_id': url['id'],'urls':url['url']})
+        # offices are read lazily from the roster (ROSTER_PATH), requested as they are read
+        offices = (office for office in Roster(settings.get('ROSTER_PATH')).offices(YELP_URL, shard=self.shard)
+                   if 'yelp.com' in office['url'])
+        if self.queue:
+            # the roster is queued (offices queued by an earlier crawl are left as they are), then offices are leased
+            # as they are requested. an office is acked once its reviews item is written
+            work_queue = WorkQueue(settings.get('WORK_QUEUE_PATH'),
+                                   visibility_timeout=settings.getfloat('WORK_QUEUE_VISIBILITY_TIMEOUT', 600),
+                                   max_attempts=settings.getint('WORK_QUEUE_MAX_ATTEMPTS', 5))
+            work_queue.put(self.name, offices)
+            self.tasks = SpiderTasks(work_queue, self.name,
+                                     retry_delay=settings.getfloat('WORK_QUEUE_RETRY_DELAY', 60))
+            offices = self.tasks.lease()
+
+        for office in offices:
+            yield scrapy.Request(url=office['url'], callback=self.parse_product, errback=self.office_failed,
+                                 dont_filter=True, headers=self.header,
+                                 meta={'external_id': office['external_id'], 'urls': office['url']})
+
+    def office_failed(self, failure):
+        request = failure.request
+        self.logger.warning('Business page %s failed: %s', request.url, failure.getErrorMessage())
+        if self.tasks is not None:
+            self.tasks.failed(request.meta['external_id'], failure.getErrorMessage())
+
+    def items_written(self, items):
+        # called by the item pipeline once items are on disk
+        if self.tasks is not None:
+            self.tasks.written(items)
 
     def parse_product(self, response):
 
@@ -67,23 +104,23 @@ class YelpSpider(scrapy.Spider):
         total_rating = 0
         review_list = []
         external_id = response.meta['external_id']
-        review_contents_list = response.xpath('//div[@class="review-list"]/ul'
-                                              '/li')[1:]
+        page = response.selector.root
+        review_contents_list = select("yelp_reviews.reviews", page)[1:]
 
         url_lists = []
         # for showcase_photo in response.xpath("//div[@class='showcase-photos']/div"):
-        for showcase_photo in response.xpath(".//ul[@class='photo-box-grid']"):
+        for showcase_photo in select("yelp_reviews.photo_grids", page):
             # print("dfgdfgdfgdfg",showcase_photo.xpath("//li").xpath(".//div[@class='photo-box']"))
             try:
 
-                for photo_bx in showcase_photo.xpath(".//div[@class='photo-box']/div"):
+                for photo_bx in select("yelp_reviews.photo_boxes", showcase_photo):
                     print(photo_bx,"photo_bxphoto_bxphoto_bxphoto_bx")
                     desc = ""
-                    url = photo_bx.xpath(".//img/@src").extract()[0]
+                    url = select("yelp.img_src", photo_bx)[0]
                     if '/bphoto/' in str(url) or '/biz_photos/' in str(url):
 
-                        if  photo_bx.xpath(".//span[@class='offscreen']/text()").extract():
-                            desc =  photo_bx.xpath(".//div[@class='photo-box-overlay_caption']/text()").extract()[0]
+                        if select("yelp_reviews.photo_offscreen", photo_bx):
+                            desc = select("yelp.photo_caption", photo_bx)[0]
 
                         url_lists.append({'description':desc,'url':url})
                     else:
@@ -96,8 +133,7 @@ class YelpSpider(scrapy.Spider):
 
 
         for review_contents in review_contents_list:
-            reviewer_name = review_contents.xpath('.//div[contains(@class, "review--with-sidebar")]'
-                                                  '//li[@class="user-name"]/a/text()')[0].extract()
+            reviewer_name = select("yelp_reviews.reviewer_name", review_contents)[0]
 
             # url = review_contents.xpath('.//div[@class="review-sidebar"]'
             #                                  '//img[@class="photo-box-img"]/@src')[0].extract()
@@ -114,15 +150,12 @@ class YelpSpider(scrapy.Spider):
             #
             # }
 
-            stars = int(float(review_contents.xpath('.//div[@class="review-content"]'
-                                                    '//div[contains(@class, "i-stars")]'
-                                                    '/@title').re('(\d+\.\d+)')[0]))
-            timestamp = review_contents.xpath('.//div[@class="review-content"]'
-                                              '//span[@class="rating-qualifier"]/text()')[0].extract().strip()
+            stars = int(float(re_all('(\d+\.\d+)', select("yelp_reviews.stars_title", review_contents))[0]))
+            timestamp = select("yelp_reviews.rating_date", review_contents)[0].strip()
             timestamp = datetime.strptime(timestamp, '%m/%d/%Y')
             timestamp = int(time.mktime(timestamp.timetuple()) + timestamp.microsecond / 1000000.0)
 
-            content = review_contents.xpath('.//div[@class="review-content"]/p/text()').extract()
+            content = select("yelp_reviews.content", review_contents)
             content = '. '.join(content)
 
             reviews = {
@@ -150,8 +183,5 @@ class YelpSpider(scrapy.Spider):
             "total_average_rating": total_average_rating,
         }
 
-        filename = base_dir_path + '/output/' + 'reviews-' + str(external_id) + '.json'
-        with open(filename, 'w+') as output:
-            result = recheck_rev_json(result)
-            json.dump(result, output, indent=4, sort_keys=True)
-        yield
+        # written by YelpPipeline
+        yield YelpReviewsItem(recheck_rev_json(result))
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import json
+import time
+import asyncio
+import weakref
+import threading
+
+import aiohttp
+import requests
+
+from common import rate_limit
+
+
+class AsyncResponse(object):
+
+    """Fully read response returned by AsyncHTTPTransport.
+    Mirrors the parts of requests.Response the scrapers use
+    (status_code, reason, headers, content, text, json()) so the same
+    handling code works for both the blocking and the asyncio fetch paths.
+    """
+
+    def __init__(self, url, status_code, reason, headers, content, encoding=None):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8", "replace")
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class AsyncHTTPTransport(object):
+
+    """asyncio counterpart of extract_data.HTTPTransport.
+    Keeps one cookie-less aiohttp.ClientSession per event loop; its connector
+    pools keep-alive connections per host. Arguments of get() follow
+    requests (headers, proxies, auth, timeout) and aiohttp failures are
+    re-raised as the matching requests exceptions, so callers handle errors
+    the same way on both paths. Requests are paced by the same rate limiter, and go
+    through the same proxy pools.
+
+    Attributes:
+        limit (int): maximum number of simultaneous connections per event loop
+        limit_per_host (int): maximum number of simultaneous connections to one host
+        rate_limiter (RateLimiter): paces the requests (common.rate_limit.rate_limiter by default)
+    """
+
+    LIMIT = 100
+    LIMIT_PER_HOST = 20
+
+    def __init__(self, limit=LIMIT, limit_per_host=LIMIT_PER_HOST, rate_limiter=None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.rate_limiter = rate_limiter or rate_limit.rate_limiter
+        self.requests_sent = 0
+        self._sessions = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def _session(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            session = self._sessions.get(loop)
+            if session is None or session.closed:
+                connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host)
+                session = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar())
+                self._sessions[loop] = session
+
+        return session
+
+    def _proxy_arguments(self, url, proxies, auth):
+        if not proxies:
+            return {}
+
+        proxy = proxies.get(url.split(":", 1)[0]) or proxies.get("http")
+        arguments = {"proxy": proxy}
+        if auth is not None:
+            arguments["proxy_auth"] = aiohttp.BasicAuth(auth.username, auth.password)
+
+        return arguments
+
+    async def get(self, url, headers=None, proxies=None, auth=None, timeout=None, proxy_pool=None):
+        """Fetch url and read the whole body (through a proxy of proxy_pool if there is one)
+        Returns:
+            AsyncResponse
+        Raises:
+            requests.exceptions.Timeout, ChunkedEncodingError or ConnectionError
+        """
+        proxy = proxy_pool.choose() if proxy_pool is not None else None
+        if proxy is None:
+            arguments = self._proxy_arguments(url, proxies, auth)
+            await self.rate_limiter.wait_async(url, arguments.get("proxy"))
+            return await self._get(url, headers, arguments, timeout)
+
+        try:
+            await self.rate_limiter.wait_async(url, proxy.name)
+            time_start = time.time()
+            r = await self._get(url, headers, {"proxy": proxy.url}, timeout)
+        except Exception as e:
+            proxy_pool.record(proxy, error=e)
+            raise
+        except asyncio.CancelledError:
+            # no outcome, the proxy is only released
+            proxy_pool.record(proxy)
+            raise
+        proxy_pool.record(proxy, status=r.status_code, latency=time.time() - time_start)
+        return r
+
+    async def _get(self, url, headers, arguments, timeout):
+        session = self._session()
+        if timeout is not None:
+            arguments["timeout"] = aiohttp.ClientTimeout(total=timeout)
+
+        with self._lock:
+            self.requests_sent += 1
+        try:
+            async with session.get(url, headers=headers, **arguments) as r:
+                content = await r.read()
+                return AsyncResponse(url, r.status, r.reason, r.headers, content, r.charset)
+        except asyncio.TimeoutError as e:
+            raise requests.exceptions.Timeout(str(e))
+        except aiohttp.ClientPayloadError as e:
+            raise requests.exceptions.ChunkedEncodingError(str(e))
+        except aiohttp.ClientError as e:
+            raise requests.exceptions.ConnectionError(str(e))
+
+    async def close(self):
+        """Close the session of the running event loop"""
+        with self._lock:
+            session = self._sessions.pop(asyncio.get_running_loop(), None)
+
+        if session is not None:
+            await session.close()
+
+    def stats(self):
+        return {
+            "sessions": len(self._sessions),
+            "limit": self.limit,
+            "limit_per_host": self.limit_per_host,
+            "requests": self.requests_sent
+        }
+
+
+# asyncio transport shared by all scrapers of this process
+async_transport = AsyncHTTPTransport()
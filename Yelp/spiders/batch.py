@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import time
+import uuid
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+
+class HostLimiter(object):
+
+    """Counts the batch rows talking to each host, at most per_host at the same time"""
+
+    def __init__(self, per_host):
+        self.per_host = per_host
+        self._running = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _host(url):
+        return urlsplit(url).netloc.lower()
+
+    def acquire(self, url):
+        """Takes a slot of the host of url
+        Returns:
+            False if the host has no slot left
+        """
+        host = self._host(url)
+        with self._lock:
+            running = self._running.get(host, 0)
+            if running >= self.per_host:
+                return False
+            self._running[host] = running + 1
+            return True
+
+    def release(self, url):
+        host = self._host(url)
+        with self._lock:
+            running = self._running.get(host, 0) - 1
+            if running > 0:
+                self._running[host] = running
+            else:
+                self._running.pop(host, None)
+
+
+class BatchRunner(object):
+
+    """Runs batch rows on a bounded pool of worker threads.
+    Rows are handed out as workers free up and results are yielded in completion
+    order, so a slow row only keeps its own worker busy. At most `workers` rows are
+    in flight at once (global limit) and at most `per_host` of them fetch from the
+    same host: a row whose host is at its limit is held back (up to `workers` of them)
+    without taking a worker, and rows of other hosts read after it go first.
+
+    Attributes:
+        rows_read (int): rows read from the input so far
+        rows_exhausted (bool): whether every row of the input has been read
+        rows_done (int): rows scraped successfully
+        rows_failed (int): rows whose scrape raised an exception
+    """
+
+    def __init__(self, scrape_row, workers=8, per_host=4):
+        """
+        Args:
+            scrape_row (callable): function called with a row dict, returns the scraped result
+            workers (int): size of the worker pool
+            per_host (int): maximum number of rows fetching from one host at once
+        """
+        self.scrape_row = scrape_row
+        self.workers = max(int(workers), 1)
+        self.host_limiter = HostLimiter(max(int(per_host), 1))
+        self.rows_read = 0
+        self.rows_exhausted = False
+        self.rows_done = 0
+        self.rows_failed = 0
+        self.time_start = None
+        self.time_end = None
+        self._cancelled = threading.Event()
+
+    def run(self, rows):
+        """Scrape rows in parallel
+        Args:
+            rows (iterable of dicts): batch rows, each one with at least an "url" key. It is closed (if it
+                has a close method) once the rows started are over, also when this generator is closed early:
+                rows read but never started may be given back (see common.work_queue.LeasedTasks)
+        Yields:
+            (row, result, error) tuples as soon as each row finishes;
+            error is the raised exception (and result None) if the row failed
+        """
+        self.time_start = time.time()
+        try:
+            # closing this generator closes _run, which waits for the rows running
+            yield from self._run(iter(rows))
+        finally:
+            close = getattr(rows, "close", None)
+            if close is not None:
+                close()
+            self.time_end = time.time()
+
+    def _run(self, rows):
+        pending = {}
+        # rows read whose host was at its limit, in the order they came
+        held = deque()
+        exhausted = False
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            def submit(row):
+                if len(pending) < self.workers and self.host_limiter.acquire(row["url"]):
+                    pending[executor.submit(self.scrape_row, row)] = row
+                    return True
+                return False
+
+            while True:
+                held = deque(row for row in held if not submit(row))
+
+                # keep the pool full without reading the whole input up front. cancelling stops the
+                # reading: every row read is run and yielded (rows leased from a work queue are acked or nacked)
+                while not exhausted and len(pending) < self.workers and len(held) < self.workers:
+                    if self._cancelled.is_set():
+                        break
+                    row = next(rows, None)
+                    if row is None:
+                        exhausted = self.rows_exhausted = True
+                        break
+                    self.rows_read += 1
+                    if not submit(row):
+                        held.append(row)
+
+                if not pending:
+                    break
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    row = pending.pop(future)
+                    self.host_limiter.release(row["url"])
+                    error = future.exception()
+                    if error is None:
+                        self.rows_done += 1
+                        yield row, future.result(), None
+                    else:
+                        self.rows_failed += 1
+                        yield row, None, error
+
+    def cancel(self):
+        """Stop reading new rows. Rows already read (running or held back) are finished and still yielded"""
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def rows_per_second(self):
+        if self.time_start is None:
+            return 0.0
+
+        elapsed = (self.time_end or time.time()) - self.time_start
+        if elapsed <= 0:
+            return 0.0
+
+        return round((self.rows_done + self.rows_failed) / elapsed, 2)
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "per_host": self.host_limiter.per_host,
+            "rows_done": self.rows_done,
+            "rows_failed": self.rows_failed,
+            "rows_per_second": self.rows_per_second()
+        }
+
+
+class BatchJob(object):
+
+    """A batch queued by BatchJobManager and run in the background.
+    Progress (rows read/done/failed, rows per second, ETA) is read from its BatchRunner
+    while it runs.
+
+    Attributes:
+        job_id (string): identifier returned to the client
+        status (string): one of queued, running, finished, cancelled, failed
+        rows_estimate (int): number of rows told by count_rows when the job started
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    FINISHED = "finished"
+    CANCELLED = "cancelled"
+    FAILED = "failed"
+
+    def __init__(self, runner, rows_factory, on_row=None, on_finish=None, description=None, count_rows=None):
+        """
+        Args:
+            runner (BatchRunner): runner scraping the rows
+            rows_factory (callable): returns an iterable over the batch rows, read once
+            on_row (callable): called with (row, result, error) for every finished row
+            on_finish (callable): called once the rows are done (also when cancelled or failed)
+            description (dict): request details reported back with the progress
+            count_rows (callable): returns an estimate of the number of rows (or None) without reading them,
+                so the job has an ETA from the start
+        """
+        self.job_id = uuid.uuid4().hex
+        self.runner = runner
+        self.rows_factory = rows_factory
+        self.on_row = on_row
+        self.on_finish = on_finish
+        self.description = description or {}
+        self.count_rows = count_rows
+        self.status = self.QUEUED
+        self.rows_estimate = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.future = None
+
+    def run(self):
+        if self.runner.cancelled:
+            self.status = self.CANCELLED
+            return
+
+        self.status = self.RUNNING
+        self.started = time.time()
+        try:
+            if self.count_rows is not None:
+                self.rows_estimate = self.count_rows()
+            for row, result, error in self.runner.run(self.rows_factory()):
+                if self.on_row is not None:
+                    self.on_row(row, result, error)
+        except Exception as e:
+            self.status = self.FAILED
+            self.error = str(e)
+        else:
+            self.status = self.CANCELLED if self.runner.cancelled else self.FINISHED
+        finally:
+            if self.on_finish is not None:
+                self.on_finish()
+            self.finished = time.time()
+
+    @property
+    def rows_read(self):
+        return self.runner.rows_read
+
+    @property
+    def rows_total(self):
+        """Number of rows to scrape: exact once every row has been read, estimated until then"""
+        return self.runner.rows_read if self.runner.rows_exhausted else self.rows_estimate
+
+    @property
+    def rows_total_estimated(self):
+        return not self.runner.rows_exhausted and self.rows_estimate is not None
+
+    def cancel(self):
+        self.runner.cancel()
+        if self.future is not None and self.future.cancel():
+            self.status = self.CANCELLED
+            self.finished = time.time()
+
+    def eta_seconds(self):
+        rows_total = self.rows_total
+        if self.status != self.RUNNING or not rows_total:
+            return None
+
+        rows_per_second = self.runner.rows_per_second()
+        if not rows_per_second:
+            return None
+
+        # an estimate may fall short of the rows read already
+        rows_left = max(rows_total, self.rows_read) - self.runner.rows_done - self.runner.rows_failed
+        return round(max(rows_left, 0) / rows_per_second, 1)
+
+    def progress(self):
+        progress = dict(self.description)
+        progress.update({
+            "id": self.job_id,
+            "status": self.status,
+            "rows_read": self.rows_read,
+            "rows_total": self.rows_total,
+            "rows_total_estimated": self.rows_total_estimated,
+            "rows_done": self.runner.rows_done,
+            "rows_failed": self.runner.rows_failed,
+            "rows_per_second": self.runner.rows_per_second(),
+            "eta_seconds": self.eta_seconds(),
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error
+        })
+        return progress
+
+
+class BatchJobManager(object):
+
+    """Queues BatchJobs on a background executor and keeps them by id.
+    Jobs live in the memory of the process that accepted them. Jobs that are over (finished,
+    cancelled or failed) are forgotten finished_ttl seconds after they ended, and only the
+    max_finished latest of them are kept.
+    """
+
+    def __init__(self, max_jobs=2, finished_ttl=24 * 60 * 60, max_finished=100):
+        self.max_jobs = max_jobs
+        self.finished_ttl = finished_ttl
+        self.max_finished = max_finished
+        self._executor = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _evict(self):
+        # called with the lock held
+        finished = sorted((job.finished, job_id) for job_id, job in self._jobs.items() if job.finished is not None)
+        expired = time.time() - self.finished_ttl
+        for index, (job_finished, job_id) in enumerate(finished):
+            if job_finished < expired or index < len(finished) - self.max_finished:
+                del self._jobs[job_id]
+
+    def submit(self, job):
+        with self._lock:
+            self._evict()
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_jobs)
+            self._jobs[job.job_id] = job
+            job.future = self._executor.submit(job.run)
+
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._evict()
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is not None:
+            job.cancel()
+
+        return job
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class BatchCheckpoint(object):
+
+    """Manifest of the rows of one batch, used to resume it after a crash or a deploy.
+    Each scraped row appends a line (row index, external id, status, sha1 of the
+    output file, timestamp) to a json lines file, so the manifest survives the
+    process dying at any point. When the batch is run again, rows whose output
+    file is still present, unchanged and younger than max_age are not scraped again.
+    Batches may share a manifest (same name, any process): lines are appended under a
+    shared lock of <path>.lock, and the manifest is compacted on open under its exclusive lock.
+
+    Attributes:
+        path (string): manifest file
+        max_age (int): seconds a saved output stays fresh. 0 disables skipping
+        rows_skipped (int): rows served from their saved output during this run
+    """
+
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self, path, max_age):
+        self.path = path
+        self.max_age = max_age
+        self.rows_skipped = 0
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    def _load(self):
+        entries = {}
+        if not os.path.exists(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            return entries
+
+        # no line is appended while the manifest is read and compacted to one line per external id
+        with _ManifestLock(self.path + ".lock"):
+            with open(self.path) as manifest:
+                for line in manifest:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # last line of a run that died while writing it
+                        continue
+                    entries[entry["external_id"]] = entry
+
+            descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+            try:
+                with os.fdopen(descriptor, 'w') as manifest:
+                    for entry in entries.values():
+                        manifest.write(json.dumps(entry) + "\n")
+                os.replace(temp_path, self.path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+
+        return entries
+
+    def _file_hash(self, output_path):
+        sha1 = hashlib.sha1()
+        with open(output_path, 'rb') as output:
+            for chunk in iter(lambda: output.read(65536), b''):
+                sha1.update(chunk)
+
+        return sha1.hexdigest()
+
+    def _append(self, entry):
+        with self._lock:
+            self._entries[entry["external_id"]] = entry
+            with _ManifestLock(self.path + ".lock", shared=True), open(self.path, 'a') as manifest:
+                manifest.write(json.dumps(entry) + "\n")
+
+    def is_fresh(self, batch_row, output_path):
+        """Returns True if the row was scraped less than max_age seconds ago
+        and its output file is still there, as it was written
+        """
+        if not self.max_age:
+            return False
+
+        entry = self._entries.get(batch_row["external_id"])
+        if not entry or entry["status"] != self.DONE:
+            return False
+        if time.time() - entry["timestamp"] > self.max_age:
+            return False
+        if not os.path.exists(output_path):
+            return False
+
+        return self._file_hash(output_path) == entry["sha1"]
+
+    def record_done(self, batch_row, output_path):
+        self._append({
+            "row": batch_row["row"],
+            "external_id": batch_row["external_id"],
+            "status": self.DONE,
+            "sha1": self._file_hash(output_path),
+            "timestamp": time.time()
+        })
+
+    def record_failed(self, batch_row):
+        self._append({
+            "row": batch_row["row"],
+            "external_id": batch_row["external_id"],
+            "status": self.FAILED,
+            "sha1": None,
+            "timestamp": time.time()
+        })
+
+    def record_skipped(self):
+        with self._lock:
+            self.rows_skipped += 1
+
+
+class _ManifestLock(object):
+
+    """flock of a manifest's lock file: shared by the batches appending to the manifest,
+    exclusive while it is compacted. No lock where fcntl is missing"""
+
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
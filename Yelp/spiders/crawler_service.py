@@ -5,18 +5,74 @@ import os
 import datetime
 import json
 import re
-import xlrd
+import time
+import functools
+import threading
 from urllib.request import HTTPError
+from requests.exceptions import RequestException
 
-from flask import jsonify, request, current_app
+from flask import request, current_app, Response, stream_with_context, abort, url_for
 
 from spiders import spider
+from spiders.batch import BatchRunner, BatchJob, BatchJobManager
+from spiders.checkpoint import BatchCheckpoint
+from spiders.retry_policy import default_retry_policy, CircuitOpenError, RetryBudget
+from spiders.http_cache import http_cache
+from spiders.result_cache import result_cache
+from spiders.extract_data import http_transport, page_fetches, async_page_fetches, page_streams
+from spiders.async_fetch import async_transport
 from spiders.yelp.extract_yelp_data import YelpScraper
 from config.get_config import Config
+from common.xpaths import registry as xpath_registry
+from common.jsonlib import JSONSerializer, loads
+from common import columnar
+from common.roster import Roster, YELP_URL, parse_shard
+from common.work_queue import WorkQueue
+from common.rate_limit import rate_limiter
+from common.proxy_pool import proxy_pool
 
 base_dir_path = os.path.dirname(os.path.realpath(__file__))
 ENV = os.getenv('ENV') or 'development'
 cfg = Config(ENV)
+http_transport.configure(pool_connections=cfg.HTTP_POOL_CONNECTIONS, pool_maxsize=cfg.HTTP_POOL_MAXSIZE)
+default_retry_policy.configure(max_attempts=cfg.RETRY_MAX_ATTEMPTS,
+                               base_delay=cfg.RETRY_BASE_DELAY,
+                               max_delay=cfg.RETRY_MAX_DELAY,
+                               max_elapsed=cfg.RETRY_MAX_ELAPSED,
+                               failure_threshold=cfg.CIRCUIT_FAILURE_THRESHOLD,
+                               reset_timeout=cfg.CIRCUIT_RESET_TIMEOUT)
+if cfg.RATE_LIMIT_ENABLED:
+    rate_limiter.configure(limits=cfg.RATE_LIMITS, default=cfg.RATE_LIMIT_DEFAULT, path=cfg.RATE_LIMIT_DB)
+proxy_pool.configure(proxies=list(cfg.PROXIES) + ([cfg.Proxy] if cfg.Proxy else []),
+                     quarantine_seconds=cfg.PROXY_QUARANTINE_SECONDS,
+                     failure_threshold=cfg.PROXY_FAILURE_THRESHOLD)
+if cfg.HTTP_CACHE_ENABLED:
+    http_cache.configure(directory=cfg.HTTP_CACHE_DIR, ttl=cfg.HTTP_CACHE_TTL, max_bytes=cfg.HTTP_CACHE_MAX_BYTES)
+if cfg.RESULT_CACHE_ENABLED:
+    result_cache.configure(max_entries=cfg.RESULT_CACHE_SIZE, ttl=cfg.RESULT_CACHE_TTL, path=cfg.RESULT_CACHE_DB,
+                           max_rows=cfg.RESULT_CACHE_DB_ROWS)
+else:
+    result_cache.configure(max_entries=0)
+
+# api responses and batch output files. compact unless pretty output is configured
+# (or, for responses, asked for with a "pretty" request parameter)
+compact_json = JSONSerializer(backend=cfg.JSON_BACKEND)
+pretty_json = JSONSerializer(pretty=True, backend=cfg.JSON_BACKEND)
+output_json = pretty_json if cfg.JSON_PRETTY else compact_json
+
+# columnar copy of the businesses scraped by batches: <COLUMNAR_EXPORT_DIR>/site=<site>/export_date=<date>/,
+# one file per COLUMNAR_EXPORT_BATCH_ROWS rows (or COLUMNAR_EXPORT_BATCH_SECONDS) of a batch
+business_dataset = None
+if cfg.COLUMNAR_EXPORT_ENABLED and columnar.available():
+    business_dataset = columnar.ColumnarDataset(cfg.COLUMNAR_EXPORT_DIR, partition_by=("site", "export_date"))
+
+# background batch jobs queued through /batches
+batch_jobs = BatchJobManager(max_jobs=cfg.BATCH_MAX_JOBS, finished_ttl=cfg.BATCH_JOB_TTL,
+                             max_finished=cfg.BATCH_JOBS_KEPT)
+
+# roster rows queued through /queue, leased by the batches of every worker process (see batch_rows_factory)
+work_queue = WorkQueue(cfg.WORK_QUEUE_DB, visibility_timeout=cfg.WORK_QUEUE_VISIBILITY_TIMEOUT,
+                       max_attempts=cfg.WORK_QUEUE_MAX_ATTEMPTS)
 
 # dictionary containing supported sites as keys
 # and their respective scrapers as values
@@ -25,6 +81,15 @@ SUPPORTED_SITES = {
 }
 
 
+def json_response(value):
+    serializer = pretty_json if cfg.JSON_PRETTY or 'pretty' in request.args else compact_json
+    return Response(serializer.dumpb(value), mimetype='application/json')
+
+
+# errors of the crawled site (after retries), answered with a GatewayError
+SITE_ERRORS = (HTTPError, CircuitOpenError, RequestException)
+
+
 class InvalidUsage(Exception):
     status_code = 400
 
@@ -167,11 +232,32 @@ def validate_data_params(arguments, ALL_DATA_TYPES):
                 with the <data_i> values among the following keywords: \n" + str(data_permitted_values))
 
 
+def create_scraper(site, url, bot=None, category=None, url2=None, retry_budget=None):
+    """Builds the scraper for the requested site, going through the proxy pool if proxies are configured"""
+    scraper_arguments = {
+        "url": url,
+        "bot": bot,
+        "category": category,
+        "url2": url2,
+        "retry_budget": retry_budget,
+        "single_pass": cfg.SINGLE_PASS_EXTRACTION,
+        "stream_pages": cfg.STREAM_PAGES,
+        "stream_max_bytes": cfg.STREAM_MAX_BYTES,
+        "proxy_pool": proxy_pool,
+        "proxy_direct_attempts": cfg.PROXY_DIRECT_ATTEMPTS
+    }
+
+    # create scraper class for requested site
+    return SUPPORTED_SITES[site](**scraper_arguments)
+
+
 # general resource for getting data.
 # needs "url" and "site" parameters. optional parameter: "data"
 # can be used without "data" parameter, in which case it will return all data
 # or with arguments like "data=<data_type1>&data=<data_type2>..." in which case it will return the specified data
 # the <data_type> values must be among the keys of DATA_TYPES imported dictionary
+# results are served from result_cache while fresh (X-Cache response header tells from where),
+# "refresh=1" scrapes the page again and replaces the cached result
 @spider.route('/get_data', methods=['GET'])
 def get_data():
     # this is used to convert an ImmutableMultiDictionary into a regular dictionary. will be left with only one "data" key
@@ -198,29 +284,8 @@ def get_data():
     else:
         bot = None
 
-    if cfg.Proxy:
-        proxies = {
-            'host': cfg.Proxy["host"],
-            'port': cfg.Proxy["port"],
-            'apikey': cfg.Proxy["apikey"]
-        }
-
-        # create scraper class for requested site
-        site_scraper = SUPPORTED_SITES[site](
-            url=url,
-            bot=bot,
-            category=category,
-            url2=url2,
-            proxies=proxies
-        )
-    else:
-        # create scraper class for requested site
-        site_scraper = SUPPORTED_SITES[site](
-            url=url,
-            bot=bot,
-            category=category,
-            url2=url2
-        )
+    # create scraper class for requested site
+    site_scraper = create_scraper(site, url, bot=bot, category=category, url2=url2)
 
     # for some special url, we need rebuild it
     site_scraper.rebuild_business_url()
@@ -236,122 +301,516 @@ def get_data():
     validate_data_params(request_arguments, site_scraper.ALL_DATA_TYPES)
 
     # return all data if there are no "data" parameters
-    if 'data' not in request_arguments:
+    info_type_list = request_arguments.get('data')
+
+    # results are cached by url and requested data, "refresh" forces a new scrape
+    if 'refresh' not in request_arguments:
+        ret, cache_tier = result_cache.get(site, url, bot, info_type_list)
+        if ret is not None:
+            response = json_response(ret)
+            response.headers["X-Cache"] = "HIT-" + cache_tier.upper()
+            return response
+
+    try:
+        ret = site_scraper.business_info(info_type_list)
+    except SITE_ERRORS:
+        raise GatewayError("Error communicating with site crawled.")
+
+    # don't cache failures (timeouts, pages that aren't businesses), they may be temporary
+    if ret is not site_scraper.ERROR_RESPONSE:
+        result_cache.set(site, url, ret, bot, info_type_list)
+
+    response = json_response(ret)
+    response.headers["X-Cache"] = "MISS"
+    return response
+
+
+# drops the cached /get_data results of "url" (all requested data combinations),
+# or every cached result if no url is given
+@spider.route('/get_data/cache', methods=['DELETE'])
+def invalidate_get_data_cache():
+    request_arguments = dict(request.args)
+    url = request_arguments['url'][0] if 'url' in request_arguments else None
+    result_cache.invalidate(url)
+
+    return json_response({"invalidated": url or "all"})
+
+
+# rows of the research offices roster (cfg.ROSTER_PATH) that have a business url, read lazily.
+# shard (i, N) keeps the rows of the i-th of N shards only
+def read_batch_rows(shard=None):
+    return Roster(cfg.ROSTER_PATH).offices(YELP_URL, shard=shard)
+
+
+# callable returning the rows of a batch: every row of the roster, or with the "shard" parameter ("i/N"),
+# the rows of the i-th of N shards. rows go to shards by a hash of their external id, so N nodes
+# given shards 0/N to N-1/N split the roster with no overlap, the same way on every run.
+# with the "queue" parameter, rows are leased one at a time from the work queue of the site instead,
+# until none is left to lease (BatchRowScraper acks or nacks them)
+def batch_rows_factory(request_arguments):
+    if 'queue' in request_arguments:
+        return functools.partial(work_queue.tasks, request_arguments['site'][0])
+
+    shard = None
+    if 'shard' in request_arguments:
         try:
-            ret = site_scraper.business_info()
+            shard = parse_shard(request_arguments['shard'][0])
+        except ValueError as e:
+            raise InvalidUsage(str(e))
+
+    return functools.partial(read_batch_rows, shard)
+
+
+# callable estimating the number of rows of a batch without reading them, so batch jobs have an ETA from the start:
+# the tasks of the site available in the work queue, or the rows of the roster (Roster.count, an upper bound),
+# split evenly between the shards
+def batch_rows_counter(request_arguments):
+    if 'queue' in request_arguments:
+        return functools.partial(work_queue.available, request_arguments['site'][0])
+
+    # the shard was checked by batch_rows_factory
+    shard = parse_shard(request_arguments['shard'][0]) if 'shard' in request_arguments else None
+    return functools.partial(count_batch_rows, shard)
+
+
+def count_batch_rows(shard=None):
+    count = Roster(cfg.ROSTER_PATH).count()
+    if count is None or shard is None:
+        return count
 
-        except HTTPError as ex:
-            raise GatewayError("Error communicating with site crawled.")
+    return -(-count // shard[1])
 
-        return jsonify(ret)
 
-    # return only requested data
+def business_output_path(external_id):
+    return os.path.dirname(os.path.abspath(__file__)) + "/output/business-{}.json".format(external_id)
+
+
+# manifest of a batch, used to skip rows already scraped when the batch is run again.
+# optional parameters: "checkpoint" to name the manifest (defaults to the site, and shard if any:
+# nodes sharing the output directory keep a manifest each)
+# and "max_age" in seconds a saved row stays fresh (0 scrapes every row again)
+def open_batch_checkpoint(site, request_arguments):
+    shard = parse_shard(request_arguments['shard'][0]) if 'shard' in request_arguments else None
+    if 'checkpoint' in request_arguments and request_arguments['checkpoint'][0]:
+        name = request_arguments['checkpoint'][0]
+    elif shard is not None:
+        name = "{}-shard-{}-of-{}".format(site, shard[0], shard[1])
+    else:
+        name = site
+    if 'max_age' in request_arguments:
+        try:
+            max_age = int(request_arguments['max_age'][0])
+        except ValueError:
+            raise InvalidUsage("Invalid usage: max_age must be a number of seconds")
+    else:
+        max_age = cfg.BATCH_CHECKPOINT_MAX_AGE
+
+    manifest_path = os.path.dirname(os.path.abspath(__file__)) + "/output/checkpoints/{}.jsonl".format(
+        re.sub(r'[^\w.-]', '_', name))
+    return BatchCheckpoint(manifest_path, max_age)
+
+
+def scrape_batch_row(site, batch_row, request_arguments, checkpoint=None, retry_budget=None, on_scraped=None):
+    """Scrapes one batch row and saves it to output/business-<external id>.json
+    If the checkpoint has a fresh output for the row, that output is returned instead.
+    Rows actually scraped are also passed to on_scraped, if given
+    Returns:
+        the saved business dictionary
+    """
+    output_file_path = business_output_path(batch_row["external_id"])
+    if checkpoint is not None and checkpoint.is_fresh(batch_row, output_file_path):
+        checkpoint.record_skipped()
+        with open(output_file_path, 'rb') as outfile:
+            return loads(outfile.read())
+
     try:
-        ret = site_scraper.business_info(request_arguments['data'])
-    except HTTPError:
+        ret = scrape_and_save_batch_row(site, batch_row, request_arguments, output_file_path, retry_budget)
+    except Exception:
+        if checkpoint is not None:
+            checkpoint.record_failed(batch_row)
+        raise
+
+    if checkpoint is not None:
+        checkpoint.record_done(batch_row, output_file_path)
+    if on_scraped is not None:
+        on_scraped(ret)
+
+    return ret
+
+
+def scrape_and_save_batch_row(site, batch_row, request_arguments, output_file_path, retry_budget=None):
+    url = batch_row["url"]
+    site_scraper = create_scraper(site, url, retry_budget=retry_budget)
+
+    # for some special url, we need rebuild it
+    site_scraper.rebuild_business_url()
+    # validate parameter values
+    # url
+    is_valid_url = site_scraper.check_url_format()
+    if hasattr(site_scraper, "INVALID_URL_MESSAGE"):
+        check_input(url, is_valid_url, site_scraper.INVALID_URL_MESSAGE)
+    else:
+        check_input(url, is_valid_url)
+
+    # data
+    validate_data_params(request_arguments, site_scraper.ALL_DATA_TYPES)
+
+    try:
+        ret = site_scraper.business_info()
+        ret["external_system_unique_id"] = batch_row["external_id"]
+    except SITE_ERRORS:
         raise GatewayError("Error communicating with site crawled.")
 
-    return jsonify(ret)
+    with open(output_file_path, 'wb') as outfile:
+        ret = recheck_json(ret)
+        output_json.dump(ret, outfile)
+
+    return ret
+
+
+class BatchRowScraper(object):
+
+    """Scrapes the rows of one batch. Rows share the checkpoint of the batch
+    and its retry budget, so a failing site can't make the batch retry without end.
+    The rows it scrapes are exported to business_dataset COLUMNAR_EXPORT_BATCH_ROWS at a time
+    (or once the oldest of them waited COLUMNAR_EXPORT_BATCH_SECONDS), the last ones when the batch ends (export)
+    """
 
+    def __init__(self, site, request_arguments):
+        self.site = site
+        self.request_arguments = request_arguments
+        # rows leased from work_queue are acked once saved, nacked when they fail
+        self.work_queue = work_queue if 'queue' in request_arguments else None
+        self.checkpoint = open_batch_checkpoint(site, request_arguments)
+        self.retry_budget = RetryBudget(ratio=cfg.BATCH_RETRY_RATIO, min_retries=cfg.BATCH_MIN_RETRIES)
+        # rows scraped since the last export. rows reused from the checkpoint were exported by the batch that scraped them
+        self.scraped_rows = []
+        self.oldest_scraped = None
+        self.rows_exported = 0
+        self._export_lock = threading.Lock()
 
+    def __call__(self, batch_row):
+        if self.work_queue is None:
+            return scrape_batch_row(self.site, batch_row, self.request_arguments, self.checkpoint, self.retry_budget,
+                                    self.scraped)
+
+        try:
+            ret = scrape_batch_row(self.site, batch_row, self.request_arguments, self.checkpoint, self.retry_budget,
+                                   self.scraped)
+        except Exception as e:
+            self.work_queue.nack(batch_row, getattr(e, "message", e), delay=cfg.WORK_QUEUE_RETRY_DELAY)
+            raise
+        self.work_queue.ack(batch_row)
+        return ret
+
+    def scraped(self, ret):
+        """Keeps a scraped row for business_dataset, exporting the rows kept once there are enough of them"""
+        if business_dataset is None:
+            return
+
+        with self._export_lock:
+            if not self.scraped_rows:
+                self.oldest_scraped = time.time()
+            self.scraped_rows.append(ret)
+            due = (len(self.scraped_rows) >= cfg.COLUMNAR_EXPORT_BATCH_ROWS or
+                   time.time() - self.oldest_scraped >= cfg.COLUMNAR_EXPORT_BATCH_SECONDS)
+        if due:
+            self.export()
+
+    def export(self):
+        """Appends the rows scraped since the last export to business_dataset, as one file.
+        Failures are logged: the json files of the rows are saved already
+        """
+        with self._export_lock:
+            rows, self.scraped_rows = self.scraped_rows, []
+        if not rows:
+            return
+
+        try:
+            business_dataset.append(rows, {"site": self.site, "export_date": datetime.date.today().isoformat()})
+            with self._export_lock:
+                self.rows_exported += len(rows)
+        except Exception as e:
+            cfg.logger.error("columnar export of {} rows failed: {}".format(len(rows), e))
+
+    def stats(self):
+        return {"rows_skipped": self.checkpoint.rows_skipped, "rows_exported": self.rows_exported,
+                "retries": self.retry_budget.stats()}
+
+
+def create_batch_runner(row_scraper, request_arguments):
+    if 'workers' in request_arguments and request_arguments['workers'][0]:
+        workers = int(request_arguments['workers'][0])
+    else:
+        workers = cfg.BATCH_WORKERS
+    if 'per_host' in request_arguments:
+        per_host = int(request_arguments['per_host'][0])
+    else:
+        per_host = cfg.BATCH_PER_HOST_LIMIT
+
+    return BatchRunner(row_scraper,
+                       workers=min(workers, cfg.BATCH_MAX_WORKERS),
+                       per_host=per_host)
+
+
+# scrape the rows one after the other, reporting failed rows instead of raising
+def run_batch_rows_sequentially(row_scraper, read_rows):
+    for batch_row in read_rows():
+        try:
+            yield batch_row, row_scraper(batch_row), None
+        except Exception as e:
+            yield batch_row, None, e
+
+
+# logs through the config logger, as rows of background batch jobs finish outside of any request
+def log_batch_row_failure(batch_row, error):
+    cfg.logger.error("batch row {} ({}) failed: {}".format(
+        batch_row["row"], batch_row["url"], getattr(error, "message", error)))
+
+
+# run every row of the sheet on a pool of worker threads
+def run_batch_parallel(row_scraper, request_arguments, read_rows):
+    runner = create_batch_runner(row_scraper, request_arguments)
+    results = []
+    try:
+        for batch_row, ret, error in runner.run(read_rows()):
+            if error is not None:
+                log_batch_row_failure(batch_row, error)
+                continue
+            results.append((batch_row["row"], ret))
+    finally:
+        row_scraper.export()
+
+    batch_stats = runner.stats()
+    batch_stats.update(row_scraper.stats())
+    current_app.logger.info("batch finished: " + json.dumps(batch_stats))
+
+    # keep the sheet order in the response, whatever order rows finished in
+    results.sort(key=lambda result: result[0])
+    response = json_response([ret for row, ret in results])
+    response.headers['X-Batch-Rows-Done'] = str(batch_stats["rows_done"])
+    response.headers['X-Batch-Rows-Failed'] = str(batch_stats["rows_failed"])
+    response.headers['X-Batch-Rows-Per-Second'] = str(batch_stats["rows_per_second"])
+    response.headers['X-Batch-Rows-Skipped'] = str(batch_stats["rows_skipped"])
+    return response
+
+
+# stream one json line per business as soon as it is scraped (newline delimited json).
+# nothing is kept in memory once a line is sent; failed rows are sent as error lines
+def run_batch_stream(row_scraper, request_arguments, read_rows):
+    if 'workers' in request_arguments:
+        runner = create_batch_runner(row_scraper, request_arguments)
+        results = runner.run(read_rows())
+    else:
+        runner = None
+        results = run_batch_rows_sequentially(row_scraper, read_rows)
+
+    def generate():
+        try:
+            for batch_row, ret, error in results:
+                if error is not None:
+                    log_batch_row_failure(batch_row, error)
+                    ret = {
+                        "external_system_unique_id": batch_row["external_id"],
+                        "url": batch_row["url"],
+                        "error": getattr(error, "message", str(error))
+                    }
+                # one line per business, whatever the configured output format
+                yield compact_json.dumps(ret) + "\n"
+        finally:
+            # also when the client went away (the response closes this generator):
+            # rows still running are finished, then the rows not exported yet are
+            results.close()
+            row_scraper.export()
+
+        if runner is not None:
+            batch_stats = runner.stats()
+            batch_stats.update(row_scraper.stats())
+            current_app.logger.info("batch finished: " + json.dumps(batch_stats))
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+# scrape every row of the research offices sheet and save each business to output/business-<external id>.json
+# (and the businesses scraped, as one file, to the columnar dataset: see business_dataset)
+# needs "site" parameter. optional parameters:
+# "workers" to scrape rows in parallel on that many threads (empty value uses the configured default)
+# "per_host" to cap how many of those rows fetch from the same host at once
+# "stream" to get one json line per business as it is done instead of a single json list
+# "checkpoint" and "max_age" to control which rows saved by a previous run are reused
+# "shard" ("i/N") to only scrape the i-th of N shards of the roster (see batch_rows_factory)
+# "queue" to scrape the rows leased from the work queue (filled through /queue) instead of the roster
 @spider.route('/run_batch', methods=['GET'])
 def run_batch():
     # this is used to convert an ImmutableMultiDictionary into a regular dictionary. will be left with only one "data" key
     request_arguments = dict(request.args)
     site = request_arguments['site'][0]
-    import os
     json_result_list = []
-    file = xlrd.open_workbook(base_dir_path + "/Research Offices.xlsx")
-    sheet = file.sheet_by_index(0)
-
-    for row in range(1, sheet.nrows):
-        print(len(sheet.row_values(row)[9]), sheet.row_values(row)[9])
-        if str(sheet.row_values(row)[9]):
-            if cfg.Proxy:
-                proxies = {
-                    'host': cfg.Proxy["host"],
-                    'port': cfg.Proxy["port"],
-                    'apikey': cfg.Proxy["apikey"]
-                }
-
-                # create scraper class for requested site
-                site_scraper = SUPPORTED_SITES[site](
-                    url=str(sheet.row_values(row)[9]),
-                    bot=None,
-                    category=None,
-                    url2=None,
-                    proxies=proxies
-                )
-            else:
-                # create scraper class for requested site
-                site_scraper = SUPPORTED_SITES[site](
-                    url=str(sheet.row_values(row)[9]),
-                    bot=None,
-                    category=None,
-                    url2=None,
-                )
-
-            # for some special url, we need rebuild it
-            site_scraper.rebuild_business_url()
-            # validate parameter values
-            # url
-            is_valid_url = site_scraper.check_url_format()
-            if hasattr(site_scraper, "INVALID_URL_MESSAGE"):
-                check_input(str(sheet.row_values(row)[9]), is_valid_url, site_scraper.INVALID_URL_MESSAGE)
-            else:
-                check_input(str(sheet.row_values(row)[9]), is_valid_url)
-
-            # data
-            validate_data_params(request_arguments, site_scraper.ALL_DATA_TYPES)
-
-            # return all data if there are no "data" parameters
-            if 'data' not in request_arguments:
-                try:
-                    ret = site_scraper.business_info()
-                    ret["external_system_unique_id"] = int(sheet.row_values(row)[0])
-                except HTTPError as ex:
-                    raise GatewayError("Error communicating with site crawled.")
-
-                import json
-                # print("*************** SAVE FILE ******************       ")
-                output_file_path = os.path.dirname(os.path.abspath(__file__)) + "/output/business-{}.json".format(
-                    int(sheet.row_values(row)[0]))
-                # print("FILE PATH       ",output_file_path)
-                with open(output_file_path, 'w') as outfile:
-                    ret = recheck_json(ret)
-                    json.dump(ret, outfile, indent=4)
-                    outfile.close()
-
-                json_result_list.append(ret)
-
-    return jsonify(json_result_list)
+
+    # batch rows are only scraped when all data is requested (no "data" parameters)
+    if 'data' in request_arguments:
+        return json_response(json_result_list)
+
+    read_rows = batch_rows_factory(request_arguments)
+    row_scraper = BatchRowScraper(site, request_arguments)
+
+    if 'stream' in request_arguments:
+        return run_batch_stream(row_scraper, request_arguments, read_rows)
+
+    if 'workers' in request_arguments:
+        return run_batch_parallel(row_scraper, request_arguments, read_rows)
+
+    try:
+        for batch_row in read_rows():
+            json_result_list.append(row_scraper(batch_row))
+    finally:
+        row_scraper.export()
+
+    return json_response(json_result_list)
+
+
+# queue a batch of the research offices sheet and return its id right away.
+# needs "site" parameter. optional parameters: "workers", "per_host", "checkpoint", "max_age", "shard" and "queue"
+# (same as /run_batch)
+# rows are saved to output/business-<external id>.json as they finish. with "queue", any number of batches,
+# in any number of worker processes, drain the work queue together and rows of a batch that died are leased again
+@spider.route('/batches', methods=['POST'])
+def create_batch():
+    request_arguments = dict(request.args)
+    if 'site' not in request_arguments:
+        raise InvalidUsage("Invalid usage: missing parameter: site")
+
+    site = request_arguments['site'][0]
+    if site not in SUPPORTED_SITES.keys():
+        raise InvalidUsage("Unsupported site: " + site)
+
+    def on_row(batch_row, ret, error):
+        if error is not None:
+            log_batch_row_failure(batch_row, error)
+
+    read_rows = batch_rows_factory(request_arguments)
+    row_scraper = BatchRowScraper(site, request_arguments)
+    job = batch_jobs.submit(BatchJob(create_batch_runner(row_scraper, request_arguments),
+                                     read_rows,
+                                     on_row=on_row,
+                                     on_finish=row_scraper.export,
+                                     description={"site": site, "shard": request_arguments.get('shard', [None])[0],
+                                                  "queue": 'queue' in request_arguments},
+                                     count_rows=batch_rows_counter(request_arguments)))
+
+    response = json_response(job.progress())
+    response.status_code = 202
+    response.headers['Location'] = url_for('.get_batch', job_id=job.job_id)
+    return response
+
+
+# progress of a queued batch: rows read, done, failed, rows per second and ETA. until every row has been read,
+# rows_total (and the ETA) are estimated from the size of the roster or of the work queue (rows_total_estimated)
+# batches that are over are kept BATCH_JOB_TTL seconds
+@spider.route('/batches/<job_id>', methods=['GET'])
+def get_batch(job_id):
+    job = batch_jobs.get(job_id)
+    if job is None:
+        abort(404)
+
+    return json_response(job.progress())
+
+
+# cancel a batch. rows already being scraped are finished, no new row is started
+@spider.route('/batches/<job_id>', methods=['DELETE'])
+def cancel_batch(job_id):
+    job = batch_jobs.cancel(job_id)
+    if job is None:
+        abort(404)
+
+    return json_response(job.progress())
+
+
+def queue_site(request_arguments):
+    if 'site' not in request_arguments:
+        raise InvalidUsage("Invalid usage: missing parameter: site")
+
+    site = request_arguments['site'][0]
+    if site not in SUPPORTED_SITES.keys():
+        raise InvalidUsage("Unsupported site: " + site)
+
+    return site
+
+
+# queue the rows of the research offices roster that have a business url, as tasks of the work queue
+# leased by the "queue" batches. needs "site" parameter, optional "shard" ("i/N") to only queue a shard.
+# rows queued already (done or not) are left as they are, so every node may queue the same roster
+@spider.route('/queue', methods=['POST'])
+def fill_queue():
+    request_arguments = dict(request.args)
+    site = queue_site(request_arguments)
+    added = work_queue.put(site, batch_rows_factory(request_arguments)())
+
+    return json_response({"site": site, "added": added, "tasks": work_queue.counts(site)})
+
+
+# number of tasks of the site in the work queue: ready, leased, done and failed
+@spider.route('/queue', methods=['GET'])
+def get_queue():
+    site = queue_site(dict(request.args))
+
+    return json_response({"site": site, "tasks": work_queue.counts(site)})
+
+
+# delete the tasks of the site (optional "status" to only delete done or failed ones), so their rows
+# can be queued again
+@spider.route('/queue', methods=['DELETE'])
+def clear_queue():
+    request_arguments = dict(request.args)
+    site = queue_site(request_arguments)
+    status = request_arguments['status'][0] if 'status' in request_arguments else None
+
+    return json_response({"site": site, "deleted": work_queue.clear(site, status), "tasks": work_queue.counts(site)})
+
+
+# counters of the shared fetch layer (connection reuse, pool sizes, rate limits, proxies, caches) and of the xpath selectors
+@spider.route('/stats', methods=['GET'])
+def stats():
+    return json_response({
+        "transport": http_transport.stats(),
+        "async_transport": async_transport.stats(),
+        "page_fetches": page_fetches.stats(),
+        "page_streams": page_streams.stats(),
+        "async_page_fetches": async_page_fetches.stats(),
+        "circuit_breakers": default_retry_policy.breakers.states(),
+        "rate_limits": rate_limiter.stats(),
+        "proxies": proxy_pool.stats(),
+        "http_cache": http_cache.stats(),
+        "result_cache": result_cache.stats(),
+        "xpaths": xpath_registry.stats()
+    })
 
 
 @spider.errorhandler(InvalidUsage)
 def handle_invalid_usage(error):
     # TODO: not leave this as json output? error format should be consistent
-    response = jsonify(error.to_dict())
+    response = json_response(error.to_dict())
     response.status_code = error.status_code
     return response
 
 
 @spider.errorhandler(GatewayError)
 def handle_invalid_usage(error):
-    response = jsonify(error.to_dict())
+    response = json_response(error.to_dict())
     response.status_code = error.status_code
     return response
 
 
 @spider.errorhandler(404)
 def handle_not_found(error):
-    response = jsonify({"error": "Not found"})
+    response = json_response({"error": "Not found"})
     response.status_code = 404
     return response
 
 
 @spider.errorhandler(500)
 def handle_internal_error(error):
-    response = jsonify({"error": "Internal server error"})
+    response = json_response({"error": "Internal server error"})
     response.status_code = 500
     return response
 
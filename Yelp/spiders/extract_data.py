@@ -4,19 +4,272 @@
 
 import urllib.request
 import requests
-from requests.auth import HTTPProxyAuth
 import re
 import sys
+import codecs
 import time
 import random
-from urllib.request import urlopen
-from socket import timeout
-from http.client import IncompleteRead
+import asyncio
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
 from lxml import html, etree
 from itertools import chain
+from collections import OrderedDict
 from html.parser import HTMLParser
 
-from random import randint
+from spiders.async_fetch import async_transport
+from spiders.retry_policy import default_retry_policy, SUCCESS, RETRY, FATAL
+from spiders.http_cache import http_cache
+from spiders.result_cache import canonical_url
+from spiders.singleflight import SingleFlight, AsyncSingleFlight
+from common import rate_limit
+
+
+class HTTPTransport(object):
+
+    """Process-wide pool of keep-alive HTTP sessions shared by every scraper.
+    One requests.Session is kept per (scheme, host, proxy) so repeated fetches
+    to the same site reuse open TCP/TLS connections instead of paying a new
+    handshake on every request. Sessions ignore cookies so each fetch stays as
+    stateless as the one-shot requests it replaces. Every request waits for its
+    token from the rate limiter of its host and proxy first.
+    Requests given a proxy_pool go through its healthiest proxy, and tell it how they went.
+
+    Attributes:
+        pool_connections (int): number of per-host connection pools cached by each session
+        pool_maxsize (int): maximum number of idle keep-alive connections kept per host
+        max_retries (int): connection-level retries done by urllib3 before giving up
+        rate_limiter (RateLimiter): paces the requests (the process-wide common.rate_limit.rate_limiter
+            unless one is passed to the constructor)
+    """
+
+    POOL_CONNECTIONS = 10
+    POOL_MAXSIZE = 20
+    # retries are done (and counted) by RetryPolicy, not inside urllib3
+    MAX_RETRIES = 0
+
+    def __init__(self, pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=MAX_RETRIES,
+                 rate_limiter=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.max_retries = max_retries
+        self.rate_limiter = rate_limiter or rate_limit.rate_limiter
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def configure(self, pool_connections=None, pool_maxsize=None, max_retries=None):
+        """Change pool settings. Open sessions are closed so the new sizes apply to every host."""
+        with self._lock:
+            if pool_connections is not None:
+                self.pool_connections = int(pool_connections)
+            if pool_maxsize is not None:
+                self.pool_maxsize = int(pool_maxsize)
+            if max_retries is not None:
+                self.max_retries = int(max_retries)
+            sessions = list(self._sessions.values())
+            self._sessions = {}
+
+        for session in sessions:
+            session.close()
+
+    def _session_key(self, url, proxies=None):
+        parts = urlsplit(url)
+        proxy = None
+        if proxies:
+            proxy = proxies.get(parts.scheme) or proxies.get("http")
+
+        return parts.scheme, parts.netloc.lower(), proxy
+
+    def _new_session(self):
+        session = requests.Session()
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        for prefix in ('http://', 'https://'):
+            session.mount(prefix, requests.adapters.HTTPAdapter(pool_connections=self.pool_connections,
+                                                                pool_maxsize=self.pool_maxsize,
+                                                                max_retries=self.max_retries))
+        return session
+
+    def session_for(self, url, proxies=None):
+        key = self._session_key(url, proxies)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._new_session()
+                self._sessions[key] = session
+
+        return session
+
+    def get(self, url, proxy_pool=None, **kwargs):
+        """Same interface as requests.get, sent through the pooled session for the url's host
+        (through a proxy of proxy_pool if there is one)"""
+        proxy = proxy_pool.choose() if proxy_pool is not None else None
+        if proxy is None:
+            self.rate_limiter.wait(url, self._session_key(url, kwargs.get("proxies"))[2])
+            return self.session_for(url, kwargs.get("proxies")).get(url, **kwargs)
+
+        kwargs["proxies"] = proxy.proxies
+        try:
+            self.rate_limiter.wait(url, proxy.name)
+            time_start = time.time()
+            r = self.session_for(url, kwargs["proxies"]).get(url, **kwargs)
+        except Exception as e:
+            proxy_pool.record(proxy, error=e)
+            raise
+        proxy_pool.record(proxy, status=r.status_code, latency=time.time() - time_start)
+        return r
+
+    def _connection_pools(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+
+        for session in sessions:
+            for adapter in set(session.adapters.values()):
+                managers = [adapter.poolmanager] + list(adapter.proxy_manager.values())
+                for manager in managers:
+                    for key in manager.pools.keys():
+                        pool = manager.pools.get(key)
+                        if pool is not None:
+                            yield pool
+
+    def stats(self):
+        """Connection reuse counters summed over every pooled host
+        Returns:
+            dictionary with number of sessions, requests sent, connections opened
+            and requests served on an already open (reused) connection
+        """
+        requests_sent = connections_opened = 0
+        for pool in self._connection_pools():
+            requests_sent += pool.num_requests
+            connections_opened += pool.num_connections
+
+        return {
+            "sessions": len(self._sessions),
+            "pool_connections": self.pool_connections,
+            "pool_maxsize": self.pool_maxsize,
+            "requests": requests_sent,
+            "connections_opened": connections_opened,
+            "connections_reused": max(requests_sent - connections_opened, 0)
+        }
+
+
+# transport shared by all scrapers of this process
+http_transport = HTTPTransport()
+
+# concurrent fetches of the same business page share one download and one parsed tree
+page_fetches = SingleFlight()
+async_page_fetches = AsyncSingleFlight()
+
+# status of a fetched business page
+PAGE_OK = "ok"
+PAGE_TIMEOUT = "timeout"
+PAGE_NOT_FOUND = "not_found"
+
+# what a data type extractor can depend on (see depends_on).
+# every resource comes from the business page: an extractor depending on any of them
+# gets the page fetched (and parsed: checking it is a business page needs the tree)
+RAW_PAGE = "raw_page"
+TREE = "tree"
+PAGE_JSON = "page_json"
+HOURS = "business_hours"
+# what not_a_business reads. not an extractor dependency: every fetched page is checked,
+# but a streamed page must be read far enough for the check (see Scraper.STREAM_COMPLETE)
+PAGE_CHECK = "page_check"
+
+
+class PageStreamStats(object):
+
+    """Counters of the streamed business page fetches (Scraper stream_pages mode)
+
+    Attributes:
+        streamed (int): pages read through the incremental parser
+        stopped_early (int): pages whose download stopped once the requested fields were received
+        capped (int): pages cut at the byte cap
+        bytes_read (int): body bytes received over all streamed pages
+    """
+
+    def __init__(self):
+        self.streamed = 0
+        self.stopped_early = 0
+        self.capped = 0
+        self.bytes_read = 0
+        self._lock = threading.Lock()
+
+    def record(self, bytes_read, stopped_early=False, capped=False):
+        with self._lock:
+            self.streamed += 1
+            self.bytes_read += bytes_read
+            self.stopped_early += int(stopped_early)
+            self.capped += int(capped)
+
+    def stats(self):
+        return {"streamed": self.streamed,
+                "stopped_early": self.stopped_early,
+                "capped": self.capped,
+                "bytes_read": self.bytes_read}
+
+
+page_streams = PageStreamStats()
+
+
+def depends_on(*resources):
+    """Declares what a data type extractor reads, so business_info fetches and builds only that.
+    Extractors declared with no resource are run without fetching the page at all.
+    Undeclared extractors are assumed to read the page tree.
+    """
+    def declare(extractor):
+        extractor.depends_on = frozenset(resources)
+        return extractor
+
+    return declare
+
+
+@depends_on()
+def _no_data(self):
+    return None
+
+
+class ExtractionPlan(object):
+
+    """What business_info does for one set of requested data types of one scraper class:
+    the extractor of each data type, resolved once, and the resources they need.
+
+    Attributes:
+        extractors (list): (data type, function called with the scraper) pairs, in requested order
+        resources (frozenset): resources the extractors depend on
+        needs_page (bool): False if no extractor reads the business page
+        needs_tree (bool): False if the extractors, and the check that the page is a business page,
+            can do with the raw page (see Scraper.TREE_FREE_RESOURCES)
+        return_load_time (bool): whether "loaded_in_seconds" was requested
+    """
+
+    def __init__(self, scraper, info_type_list):
+        self.return_load_time = "loaded_in_seconds" in info_type_list
+        self.extractors = []
+        resources = set()
+        for info in info_type_list:
+            if info == "loaded_in_seconds":
+                continue
+            extractor = scraper.ALL_DATA_TYPES[info]
+            if isinstance(extractor, str):
+                extractor = getattr(type(scraper), extractor)
+            self.extractors.append((info, extractor))
+            resources.update(getattr(extractor, "depends_on", (TREE,)))
+
+        self.resources = frozenset(resources)
+        self.needs_page = bool(self.resources)
+        self.needs_tree = self.needs_page and bool(
+            (self.resources | {PAGE_CHECK}) - {RAW_PAGE} - scraper.TREE_FREE_RESOURCES)
+        # derived resources are built in the order the scraper declares their loaders
+        self.loaders = [loader for resource, loader in scraper.RESOURCE_LOADERS
+                        if resource in self.resources]
+
+
+# compiled ExtractionPlans, by (scraper class, set of requested data types), least recently used first.
+# requests may ask for any subset of the data types: only the last EXTRACTION_PLANS_SIZE plans are kept
+EXTRACTION_PLANS_SIZE = 256
+_extraction_plans = OrderedDict()
+_extraction_plans_lock = threading.Lock()
 
 
 class Scraper():
@@ -28,16 +281,27 @@ class Scraper():
 
     Each subclass must implement:
     - define DATA_TYPES and DATA_TYPES_SPECIAL structures (see subclass docs)
-    - implement each method found in the values of the structures above
+    - implement each method found in the values of the structures above,
+      declaring with depends_on what each one reads (nothing, the page, its tree or derived resources)
+    - define RESOURCE_LOADERS for the derived resources its extractors depend on
     - implement checktree_html_format()
 
     Attributes:
         business_page_url (string): URL of the page of the business being scraped
         tree_html (lxml tree object): html tree of page source. This variable is initialized
         whenever a request is made for a piece of data in DATA_TYPES. So it can be used for methods
-        extracting these types of data.
-        MAX_RETRIES (int): number of retries before giving up fetching business page soruce (if errors encountered
-            - usually IncompleteRead exceptions)
+        extracting these types of data. It stays None if the requested data types can do with
+        the page text (page_raw_text, see TREE_FREE_RESOURCES)
+        retry_policy (RetryPolicy): how fetches are retried (backoff, attempts per request, circuit breakers)
+        retry_budget (RetryBudget): retry budget of the batch this scraper belongs to, if any
+        http_cache (HTTPCache): on-disk cache consulted by the page and json api fetches
+        transport (HTTPTransport): pooled keep-alive transport every fetch goes through
+            (the process-wide http_transport unless one is passed to the constructor)
+        async_transport (AsyncHTTPTransport): transport used by the asyncio fetch path (business_info_async)
+        stream_pages (bool): whether the business page is parsed while it downloads, the download
+            stopping as soon as everything the requested data types read has been received
+            (see STREAM_COMPLETE). Only the blocking fetch path streams
+        stream_max_bytes (int): streamed pages are cut after this many bytes
     """
     BROWSER_AGENT_STRING_LIST = {"Firefox": ["Mozilla/5.0 (Windows NT 6.1; WOW64; rv:40.0) Gecko/20100101 Firefox/40.1",
                                              "Mozilla/5.0 (Windows NT 6.3; rv:36.0) Gecko/20100101 Firefox/36.0",
@@ -51,6 +315,17 @@ class Scraper():
                                              "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_6_8) AppleWebKit/537.13+ (KHTML, like Gecko) Version/5.1.7 Safari/534.57.2"]
                                  }
 
+    # resources (and PAGE_CHECK) the scraper can build from the raw page text: a business page
+    # requested only for those is not parsed into a tree (tree_html stays None)
+    TREE_FREE_RESOURCES = frozenset()
+
+    # streamed fetches: resource -> (tag, attribute, value) of the element which, once the parser
+    # has closed it, means everything the resource reads has been received (attribute None: any
+    # element with that tag). Resources not listed here need the whole page
+    STREAM_COMPLETE = {}
+    STREAM_CHUNK_SIZE = 16 * 1024
+    STREAM_MAX_BYTES = 8 * 1024 * 1024
+
     def select_browser_agents_randomly(self, agent_type=None):
         if agent_type and agent_type in self.BROWSER_AGENT_STRING_LIST:
             return random.choice(self.BROWSER_AGENT_STRING_LIST[agent_type])
@@ -62,8 +337,8 @@ class Scraper():
     def select_platform_agents_randomly(self):
         return random.choice(self.PLATFORM_AGENT_STRING_LIST)
 
-    # number of retries for fetching business page source before giving up
-    MAX_RETRIES = 100
+    # seconds to wait for the site before a fetch is considered timed out
+    REQUEST_TIMEOUT = 20
 
     # List containing all data types returned by the crawler (that will appear in responses of requests to service in crawler_service.py)
     # In practice, all returned data types for all crawlers should be defined here
@@ -108,9 +383,13 @@ class Scraper():
     # "loaded_in_seconds" needs to always have a value of None (no need to implement extraction)
     # TODO: date should be implemented here
     BASE_DATA_TYPES = {
-        data_type : lambda x: None for data_type in BASE_DATA_TYPES_LIST # using argument for lambda because it will be used with "self"
+        data_type : _no_data for data_type in BASE_DATA_TYPES_LIST # _no_data takes an argument because it will be used with "self"
     }
 
+    # (resource, method name) pairs building the resources derived from the page tree
+    # that extractors may depend on, in the order they have to be built
+    RESOURCE_LOADERS = ()
+
     # response in case of error
     ERROR_RESPONSE = {
         "url": None,
@@ -137,36 +416,44 @@ class Scraper():
 
     def load_page_from_url_with_number_of_retries(self,
                                                   url,
-                                                  max_retries=MAX_RETRIES,
+                                                  max_retries=None,
                                                   extra_exclude_condition=None,
                                                   stream=False):
-        for index in range(1, max_retries):
-            s = requests.Session()
-            a = requests.adapters.HTTPAdapter(max_retries=self.MAX_RETRIES)
-            b = requests.adapters.HTTPAdapter(max_retries=self.MAX_RETRIES)
-            s.mount('http://', a)
-            s.mount('https://', b)
+        retries = self.retry_policy.begin(url, self.retry_budget, max_attempts=max_retries,
+                                          retry_bans=bool(self.proxy_pool))
+        while True:
+            retries.check_circuit()
             print("retries url : %s" % url)
-            if self.proxy_config:
+            if self.proxy_pool:
                 header = {"X-Crawlera-UA": self.select_platform_agents_randomly()}
-                r = s.get(url, headers=header, proxies=self.proxies, auth=self.proxy_auth, stream=stream)
+                arguments = {"headers": header, "proxy_pool": self.proxy_pool}
             else:
                 header = {"User-Agent": self.select_browser_agents_randomly()}
-                r = s.get(url, headers=header, stream=stream)
-            print("retries request status : %s" % r.status_code)
-            if not stream:
-                contents = r.text
-                if (not extra_exclude_condition
-                    or extra_exclude_condition not in contents) \
-                        and r.status_code == 200:
-                    return contents
-            else:
-                if r.status_code == 200:
-                    return r
-            print('xml crawler retry times: %s' % index)
-            time.sleep(randint(6,12))
+                arguments = {"headers": header}
 
-        return None
+            try:
+                r = self.transport.get(url, stream=stream, timeout=self.REQUEST_TIMEOUT, **arguments)
+            except Exception as e:
+                if retries.record(error=e) != RETRY or retries.next_delay() is None:
+                    raise
+            else:
+                print("retries request status : %s" % r.status_code)
+                outcome = retries.record(response=r)
+                if outcome == SUCCESS:
+                    if stream:
+                        return r
+                    contents = r.text
+                    # pages containing extra_exclude_condition (e.g. a block page) are retried
+                    if not extra_exclude_condition or extra_exclude_condition not in contents:
+                        return contents
+                elif outcome == FATAL:
+                    return None
+
+                if retries.next_delay() is None:
+                    return None
+
+            print('xml crawler retry times: %s' % retries.attempt)
+            time.sleep(retries.delay)
 
     def _exclude_javascript_from_description(self, description):
         description = re.subn(r'<(script).*?</\1>(?s)', '', description)[0]
@@ -184,6 +471,23 @@ class Scraper():
         self.business_page_url = kwargs['url']
         self.bot_type = kwargs['bot']
         self.is_timeout = False
+        self.transport = kwargs.get('transport') or http_transport
+        self.async_transport = kwargs.get('async_transport') or async_transport
+        self.retry_policy = kwargs.get('retry_policy') or default_retry_policy
+        self.retry_budget = kwargs.get('retry_budget')
+        self.http_cache = kwargs.get('http_cache') or http_cache
+        self.page_fetches = kwargs.get('page_fetches') or page_fetches
+        self.async_page_fetches = kwargs.get('async_page_fetches') or async_page_fetches
+        self.stream_pages = kwargs.get('stream_pages', False)
+        self.stream_max_bytes = kwargs.get('stream_max_bytes') or self.STREAM_MAX_BYTES
+        self.page_streams = kwargs.get('page_streams') or page_streams
+        # plan of the running business_info call, tells page fetches whether to build a tree
+        # and streamed fetches where they can stop
+        self.extraction_plan = None
+        self.page_raw_text = None
+        self.tree_html = None
+        # per instance copy, so concurrent scrapers don't overwrite each other's failure_type
+        self.ERROR_RESPONSE = dict(self.ERROR_RESPONSE)
         # Set generic fields
         # directly (don't need to be computed by the scrapers)
 
@@ -191,13 +495,9 @@ class Scraper():
         # so that BASE_DATA_TYPES values can be overwritten by DATA_TYPES values
         # if needed. (more specifically overwrite functions for extracting certain data
         # (especially sellers-related fields))
-        self.proxy_config = None
-        if kwargs.get('proxies'):
-            self.proxy_config = kwargs['proxies']
-            proxy_host = self.proxy_config["host"]
-            proxy_port = self.proxy_config["port"]
-            self.proxy_auth = HTTPProxyAuth(self.proxy_config["apikey"], "")
-            self.proxies = {"http": "http://{}:{}/".format(proxy_host, proxy_port)}
+        # proxies page fetches go through (common.proxy_pool.ProxyPool), after proxy_direct_attempts direct ones
+        self.proxy_pool = kwargs.get('proxy_pool')
+        self.proxy_direct_attempts = kwargs.get('proxy_direct_attempts', 0)
 
         self.headers = {
             'user-agent': 'Mozilla/5.0 (Linux; Android 5.1.1; YQ601 Build/LMY47V) AppleWebKit/537.36 (KHTML, like Gecko) Version/4.0 Chrome/39.0.0.0 Mobile Safari/537.36'
@@ -235,71 +535,141 @@ class Scraper():
             and the scraped data as values
         """
 
-        #TODO: does this make sure page source is not extracted if not necessary?
-        #      if so, should all functions returning null (in every case) be in DATA_TYPES_SPECIAL?
+        plan = self._extraction_plan(info_type_list)
+        self.extraction_plan = plan
 
-        # if no specific data types were requested, assume all data types were requested
-        if not info_type_list:
-            info_type_list = self.ALL_DATA_TYPES.keys()
+        # build page xml tree, unless no requested data needs it. also measure time it took
+        # and assume it's page load time (the rest is neglijable)
+        time_start = time.time()
+        if plan.needs_page:
+            if self.bot_type == "mobile":
+                self._get_json_from_api()
+            else:
+                self._extract_page_tree()
+        time_end = time.time()
 
+        return self._build_business_info(plan, time_end - time_start)
 
-        # copy of info list to send to _extract_business_data
-        info_type_list_copy = list(info_type_list)
+    async def business_info_async(self, info_type_list=None):
+        """asyncio version of business_info: the page is fetched (and retried) without
+        blocking the event loop, then the same DATA_TYPES extractors are run on it
+        Args:
+            info_type_list (list of strings) list containing the types of data requested
+        Returns:
+            dictionary containing the requested data types as keys
+            and the scraped data as values
+        """
+        plan = self._extraction_plan(info_type_list)
+        self.extraction_plan = plan
 
-        # build page xml tree. also measure time it took and assume it's page load time (the rest is neglijable)
         time_start = time.time()
-        #TODO: only do this if something in DATA_TYPES was requested
-        if self.bot_type == "mobile":
-            self._get_json_from_api()
-        else:
-            self._extract_page_tree()
+        if plan.needs_page:
+            if self.bot_type == "mobile":
+                await self._get_json_from_api_async()
+            else:
+                await self._extract_page_tree_async()
         time_end = time.time()
-        # don't pass load time as info to be extracted by _extract_business_data
-        return_load_time = "loaded_in_seconds" in info_type_list_copy
-        if return_load_time:
-            info_type_list_copy.remove("loaded_in_seconds")
 
-        ret_dict = self._extract_business_data(info_type_list_copy)
+        return self._build_business_info(plan, time_end - time_start)
+
+    def _extraction_plan(self, info_type_list):
+        # if no specific data types were requested, assume all data types were requested.
+        # data types this scraper doesn't know are left out, and the order they were requested in
+        # doesn't make another plan (the data types are extracted in ALL_DATA_TYPES order)
+        requested = None
+        if info_type_list:
+            requested = frozenset(info for info in info_type_list if info in self.ALL_DATA_TYPES)
+        key = (type(self), requested)
+        with _extraction_plans_lock:
+            plan = _extraction_plans.get(key)
+            if plan is not None:
+                _extraction_plans.move_to_end(key)
+                return plan
+
+        plan = ExtractionPlan(self, [info for info in self.ALL_DATA_TYPES if requested is None or info in requested])
+        with _extraction_plans_lock:
+            plan = _extraction_plans.setdefault(key, plan)
+            while len(_extraction_plans) > EXTRACTION_PLANS_SIZE:
+                _extraction_plans.popitem(last=False)
+
+        return plan
+
+    def _build_business_info(self, plan, load_time):
+        ret_dict = self._extract_business_data(plan)
         # add load time to dictionary -- if it's in the list
         # TODO:
         #      - format for loaded_in_seconds?
         #      - what happens if there are requests to js info too? count that load time as well?
-        if return_load_time:
-            ret_dict["loaded_in_seconds"] = round(time_end - time_start, 2)
+        if plan.return_load_time:
+            ret_dict["loaded_in_seconds"] = round(load_time, 2)
 
         return ret_dict
 
     # method that returns json from api
     def _get_json_from_api(self):
-        for i in range(self.MAX_RETRIES):
-            try:
-                r = requests.get(self.business_page_url, headers=self.headers)
-                if r.status_code == 200:
-                    self.business_json = r.json()
-                else:
-                    continue
-                #sleep(randint(0, 1))
-                return
-            except Exception as e:
-                print(e)
-                continue
+        self.business_json = self._get_json_with_custom_api(self.business_page_url)
+
+    async def _get_json_from_api_async(self):
+        self.business_json = await self._get_json_with_custom_api_async(self.business_page_url)
 
     def _get_json_with_custom_api(self, url=None):
-        for i in range(self.MAX_RETRIES):
+        retries = self.retry_policy.begin(url, self.retry_budget)
+        while True:
+            retries.check_circuit()
+            r = error = None
             try:
-                r = requests.get(url, headers=self.headers)
-                if r.status_code == 200:
-                    return r.json()
-                else:
-                    continue
-                #sleep(randint(0, 1))
+                r = self.http_cache.get(self.transport, url, headers=self.headers, timeout=self.REQUEST_TIMEOUT)
+            except Exception as e:
+                error = e
+
+            done, json_data = self._json_attempt_result(retries, r, error)
+            if done:
+                return json_data
+            time.sleep(retries.delay)
+
+    async def _get_json_with_custom_api_async(self, url=None):
+        retries = self.retry_policy.begin(url, self.retry_budget)
+        while True:
+            retries.check_circuit()
+            r = error = None
+            try:
+                r = await self.http_cache.get_async(self.async_transport, url, headers=self.headers,
+                                                    timeout=self.REQUEST_TIMEOUT)
             except Exception as e:
+                error = e
+
+            done, json_data = self._json_attempt_result(retries, r, error)
+            if done:
+                return json_data
+            await asyncio.sleep(retries.delay)
+
+    def _json_attempt_result(self, retries, r, error):
+        """Handles one attempt of a json api fetch
+        Returns:
+            (done, json) tuple. json is None if the api could not be read
+        """
+        if error is not None:
+            print(error)
+
+        outcome = retries.record(response=r, error=error)
+        if outcome == SUCCESS:
+            try:
+                return True, r.json()
+            except ValueError as e:
+                # truncated or non json body, worth another try
                 print(e)
-                continue
+        elif outcome == FATAL:
+            return True, None
+
+        if retries.next_delay() is None:
+            return True, None
+
+        return False, None
 
     # method that returns xml tree of page, to extract the desired elemets from
     def _extract_page_tree(self, elemUrl=None):
-        """Builds and sets as instance variable the xml tree of the business page
+        """Builds and sets as instance variable the xml tree of the business page.
+        Scrapers fetching the same page at the same time share one download and one tree
         Returns:
             lxml tree object
         """
@@ -308,89 +678,261 @@ class Scraper():
         else:
             request_url = self.business_page_url
 
-        request = urllib.request.Request(request_url)
+        self._apply_page(self.page_fetches.do(self._page_fetch_key(request_url),
+                                              lambda: self._fetch_page(request_url)))
+
+    async def _extract_page_tree_async(self, elemUrl=None):
+        """asyncio version of _extract_page_tree: same retries and proxy fallback,
+        with the waits between attempts done by asyncio.sleep
+        """
+        if elemUrl:
+            request_url = elemUrl
+        else:
+            request_url = self.business_page_url
+
+        self._apply_page(await self.async_page_fetches.do(self._page_fetch_key(request_url),
+                                                          lambda: self._fetch_page_async(request_url)))
+
+    def _page_fetch_key(self, request_url):
+        # the bot type selects the user agent, hence possibly another page.
+        # a streamed page only holds what the plan it was streamed for needs,
+        # and pages fetched for tree free plans have no tree
+        return (canonical_url(request_url), self.bot_type, self._stream_until(request_url),
+                self._builds_tree(request_url))
+
+    def _builds_tree(self, request_url):
+        return (self.extraction_plan is None or request_url != self.business_page_url
+                or self.extraction_plan.needs_tree)
+
+    def _stream_until(self, request_url):
+        """Resources a streamed fetch of request_url has to receive before it stops,
+        None if request_url is not to be streamed
+        """
+        if not self.stream_pages or self.extraction_plan is None or request_url != self.business_page_url:
+            return None
+
+        return self.extraction_plan.resources | {PAGE_CHECK}
+
+    def _fetch_page(self, request_url):
+        """Fetches request_url with retries
+        Returns:
+            (page status, page text, lxml tree) tuple, see _page_attempt_result
+        """
+        stream_until = self._stream_until(request_url)
+        builds_tree = self._builds_tree(request_url)
+        retries = self.retry_policy.begin(request_url, self.retry_budget, retry_bans=bool(self.proxy_pool))
+        while True:
+            retries.check_circuit()
+            r = error = None
+            try:
+                if stream_until is None:
+                    r = self.http_cache.get(self.transport, request_url,
+                                            **self._page_request_arguments(retries))
+                else:
+                    r = self._stream_page(request_url, stream_until, **self._page_request_arguments(retries))
+            except Exception as e:
+                error = e
+
+            page = self._page_attempt_result(request_url, retries, r, error, builds_tree)
+            if page is not None:
+                return page
+            print('business crawler retry times: %s' % retries.attempt)
+            time.sleep(retries.delay)
+
+    async def _fetch_page_async(self, request_url):
+        builds_tree = self._builds_tree(request_url)
+        retries = self.retry_policy.begin(request_url, self.retry_budget, retry_bans=bool(self.proxy_pool))
+        while True:
+            retries.check_circuit()
+            r = error = None
+            try:
+                r = await self.http_cache.get_async(self.async_transport, request_url,
+                                                    **self._page_request_arguments(retries))
+            except Exception as e:
+                error = e
+
+            page = self._page_attempt_result(request_url, retries, r, error, builds_tree)
+            if page is not None:
+                return page
+            print('business crawler retry times: %s' % retries.attempt)
+            await asyncio.sleep(retries.delay)
+
+    def _page_attempt_result(self, request_url, retries, r, error, builds_tree=True):
+        """Handles one attempt of a business page fetch: parses the page on success,
+        tells pages that don't exist apart and raises errors that won't go away by retrying.
+        The result holds no state of this scraper, so it can be shared by coalesced fetches
+        Returns:
+            (PAGE_OK, page text, lxml tree), (PAGE_TIMEOUT, None, None) or (PAGE_NOT_FOUND, None, None),
+            None if the page should be fetched again after retries.delay.
+            The tree is None if builds_tree is False (unless the page was streamed)
+        """
+        outcome = retries.record(response=r, error=error)
+        if outcome == SUCCESS:
+            streamed = getattr(r, "streamed_page", None)
+            if streamed is not None:
+                return (PAGE_OK,) + streamed
+            contents = self._clean_null(self._decode_page(r))
+            return PAGE_OK, contents, self._parse_page(contents) if builds_tree else None
+
+        if outcome == RETRY and retries.next_delay() is not None:
+            return None
+
+        # not retried, or out of retries
+        if isinstance(error, requests.exceptions.Timeout):
+            return PAGE_TIMEOUT, None, None
+        if error is not None:
+            raise error
+
+        if not self._check_page_status(request_url, r):
+            return PAGE_NOT_FOUND, None, None
+        return PAGE_OK, None, None
+
+    def _parse_page(self, contents):
+        return html.fromstring(contents)
+
+    def _stream_page(self, request_url, stream_until, **kwargs):
+        """GET request_url, parsing the body while it arrives (_read_stream) if the request succeeded.
+        A fresh cached page is used whole instead
+        Returns:
+            the response, the (page text, lxml tree) read set as its streamed_page
+        """
+        cached = self.http_cache.lookup(request_url, kwargs.get("headers"))
+        if cached is not None:
+            return cached
+
+        r = self.transport.get(request_url, stream=True, **kwargs)
+        try:
+            if r.status_code < 400:
+                r.streamed_page = self._read_stream(r, stream_until)
+            else:
+                # error pages are small, and _check_page_status reads them
+                r.content
+        finally:
+            # stopping early drops the connection rather than reading the rest of the body
+            r.close()
+
+        return r
+
+    def _read_stream(self, r, stream_until):
+        """Feeds the body of r to an incremental parser chunk by chunk, until the parser has closed
+        the STREAM_COMPLETE element of every resource in stream_until, or stream_max_bytes were read
+        Returns:
+            (page text, lxml tree) of what was read
+        """
+        pending = {resource: self.STREAM_COMPLETE.get(resource) for resource in stream_until}
+        # a resource without a completing element needs the whole page: nothing to watch
+        can_stop = None not in pending.values()
+        tags = tuple(set(tag for tag, attribute, value in pending.values())) if can_stop else ()
+        parser = self._stream_parser(tags)
+        decoder = codecs.getincrementaldecoder("utf8")()
+        chunks = []
+        texts = []
+        bytes_read = 0
+        stopped_early = capped = False
+        for chunk in r.iter_content(self.STREAM_CHUNK_SIZE):
+            chunks.append(chunk)
+            bytes_read += len(chunk)
+            try:
+                text = decoder.decode(chunk)
+            except UnicodeError as e:
+                # if page was not utf8, start over with the encoding announced by the site
+                print("Warning creating html tree from page content: ", str(e))
+                decoder = self._fallback_decoder(r)
+                parser = self._stream_parser(tags)
+                texts = []
+                text = decoder.decode(b"".join(chunks))
+            text = text.replace('\00', '')
+            texts.append(text)
+            parser.feed(text)
+
+            if can_stop:
+                for event, element in parser.read_events():
+                    for resource, (tag, attribute, value) in list(pending.items()):
+                        if element.tag == tag and (attribute is None or element.get(attribute) == value):
+                            del pending[resource]
+                if not pending:
+                    stopped_early = True
+                    break
+            if bytes_read >= self.stream_max_bytes:
+                print("WARNING: page %s cut at %d bytes" % (r.url, bytes_read))
+                capped = True
+                break
+
+        if not (stopped_early or capped):
+            text = decoder.decode(b"", True).replace('\00', '')
+            texts.append(text)
+            parser.feed(text)
+
+        self.page_streams.record(bytes_read, stopped_early, capped)
+        return "".join(texts), parser.close()
+
+    def _stream_parser(self, tags):
+        """Incremental parser building the same tree as _parse_page,
+        reporting the end of the elements with one of tags
+        """
+        parser = etree.HTMLPullParser(events=("end",), tag=tags) if tags else etree.HTMLPullParser(events=())
+        parser.set_element_class_lookup(html.HtmlElementClassLookup())
+        return parser
+
+    def _fallback_decoder(self, r):
+        try:
+            return codecs.getincrementaldecoder(r.encoding or "utf8")("replace")
+        except LookupError:
+            return codecs.getincrementaldecoder("utf8")("replace")
+
+    def _apply_page(self, page):
+        status, contents, tree = page
+        if status == PAGE_OK and contents is not None:
+            self.page_raw_text = contents
+            self.tree_html = tree
+        elif status == PAGE_TIMEOUT:
+            self._set_timeout()
+        elif status == PAGE_NOT_FOUND:
+            self.ERROR_RESPONSE["failure_type"] = "HTTP 404 - Page Not Found"
+
+    def _page_request_arguments(self, retries):
+        # attempts after the first proxy_direct_attempts, or after a ban, go through the proxy pool
+        if self.proxy_pool and (retries.attempt >= self.proxy_direct_attempts or retries.banned):
+            return self._proxy_request_arguments()
+
+        return self._direct_request_arguments()
+
+    def _direct_request_arguments(self):
         # set user agent to avoid blocking
-        agent = ''
         if self.bot_type == "google":
             agent = 'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)'
         else:
             agent = 'Mozilla/5.0 (X11; Linux x86_64; rv:24.0) Gecko/20140319 Firefox/24.0 Iceweasel/24.4.0'
 
-        request.add_header('User-Agent', agent)
+        return {"headers": {'User-Agent': agent}, "timeout": self.REQUEST_TIMEOUT}
 
-        for i in range(self.MAX_RETRIES):
-            # will using proxy request if first 3 retries failed
-            if i > 3 and self.proxy_config:
-                header = {"X-Crawlera-UA": self.select_platform_agents_randomly()}
-                try:
-                    r = requests.get(
-                        request_url,
-                        headers=header,
-                        proxies=self.proxies,
-                        auth=self.proxy_auth,
-                        timeout=20)
-                    if r.status_code == 200:
-                        contents = r.text.encode("utf-8")
-                        contents = self._clean_null(contents)
-                        self.page_raw_text = contents
-                        self.tree_html = html.fromstring(contents)
-                        return
-                    else:
-                        raise Exception
-                except Exception:
-                    print('business crawler retry times: %s' % i)
-                    time.sleep(randint(5, 7))
-                    continue
+    def _proxy_request_arguments(self):
+        return {"headers": {"X-Crawlera-UA": self.select_platform_agents_randomly()},
+                "proxy_pool": self.proxy_pool,
+                "timeout": self.REQUEST_TIMEOUT}
 
-            else:
-                try:
-                    contents = urllib.request.urlopen(request, timeout=20).read()
-                # handle urls with special characters
-                except UnicodeEncodeError as e:
-                    request = urllib.request.Request(request_url.encode("utf-8"))
-                    request.add_header('User-Agent', agent)
-                    contents = urllib.request.urlopen(request).read()
-
-                except IncompleteRead:
-                    continue
-                except timeout:
-                    self.is_timeout = True
-                    self.ERROR_RESPONSE["failure_type"] = "Timeout"
-                    return
-                except urllib.request.HTTPError as err:
-                    if err.code == 404:
-                        self.ERROR_RESPONSE["failure_type"] = "HTTP 404 - Page Not Found"
-                        return
-                    else:
-                        raise
-                try:
-                    # replace NULL characters
-                    contents = self._clean_null(contents.decode("utf8"))
-                    self.page_raw_text = contents
-                    self.tree_html = html.fromstring(contents)
-                except UnicodeError as e:
-                    # if string was not utf8, don't deocde it
-                    print("Warning creating html tree from page content: ", e.message)
-
-                    # replace NULL characters
-                    contents = self._clean_null(contents)
-                    self.page_raw_text = contents
-                    self.tree_html = html.fromstring(contents)
-                # if we got it we can exit the loop and stop retrying
-                return
-
-                # try getting it again, without catching exception.
-                # if it had worked by now, it would have returned.
-                # if it still doesn't work, it will throw exception.
-                # TODO: catch in crawler_service so it returns an "Error communicating with server" as well
-
-                # contents = urlopen(request).read()
-                # replace NULL characters
-                # contents = self._clean_null(contents)
-                # self.page_raw_text = contents
-                # self.tree_html = html.fromstring(contents)
+    def _set_timeout(self):
+        self.is_timeout = True
+        self.ERROR_RESPONSE["failure_type"] = "Timeout"
 
+    def _check_page_status(self, request_url, r):
+        """Returns True if the response holds the business page, False if it does not exist.
+        Other HTTP errors are raised as urllib's HTTPError, which crawler_service turns into a GatewayError
+        """
+        if r.status_code == 404:
+            return False
+        elif r.status_code >= 400:
+            raise urllib.request.HTTPError(request_url, r.status_code, r.reason, r.headers, None)
 
+        return True
+
+    def _decode_page(self, r):
+        try:
+            return r.content.decode("utf8")
+        except UnicodeError as e:
+            # if page was not utf8, fall back to the encoding announced by the site
+            print("Warning creating html tree from page content: ", str(e))
+            return r.text
 
     def _clean_null(self, text):
         '''Remove NULL characters from text if any.
@@ -413,12 +955,12 @@ class Scraper():
     # Return dictionary containing type of info as keys and extracted info as values.
     # This method is intended to act as a unitary way of getting all data needed,
     # looking to avoid generating the html tree for each kind of data (if there is more than 1 requested).
-    def _extract_business_data(self, info_type_list):
+    def _extract_business_data(self, plan):
         """Extracts data for current business:
         either from page source given its xml tree
         or using other requests defined in each specific function
         Args:
-            info_type_list: list of strings containing the requested data
+            plan (ExtractionPlan): requested data types, with their extractors
         Returns:
             dictionary containing the requested data types as keys
             and the scraped data as values
@@ -427,22 +969,21 @@ class Scraper():
         results_dict = {}
 
         # if it's not a valid business page, abort
-        if self.is_timeout or self.not_a_business():
-            return self.ERROR_RESPONSE
+        if plan.needs_page:
+            if self.is_timeout or self.not_a_business():
+                return self.ERROR_RESPONSE
 
-        for info in info_type_list:
+            for loader in plan.loaders:
+                getattr(self, loader)()
+
+        for info, extractor in plan.extractors:
             try:
-                if isinstance(self.ALL_DATA_TYPES[info], (str, str)):
-                    _method_to_call = getattr(self, self.ALL_DATA_TYPES[info])
-                    results = _method_to_call()
-                else:  # callable, dict
-                    _method_to_call = self.ALL_DATA_TYPES[info]
-                    results = _method_to_call(self)
+                results = extractor(self)
             except IndexError as e:
-                sys.stderr.write("ERROR: No " + info + " for " + self.business_page_url.encode("utf-8") + ":\n" + str(e) + "\n")
+                sys.stderr.write("ERROR: No " + info + " for " + self.business_page_url + ":\n" + str(e) + "\n")
                 results = None
             except Exception as e:
-                sys.stderr.write("ERROR: Unknown error extracting " + info + " for " + self.business_page_url.encode("utf-8") + ":\n" + str(e) + "\n")
+                sys.stderr.write("ERROR: Unknown error extracting " + info + " for " + self.business_page_url + ":\n" + str(e) + "\n")
                 results = None
 
             results_dict[info] = results
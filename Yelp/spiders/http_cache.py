@@ -0,0 +1,332 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import os
+import json
+import time
+import zlib
+import fcntl
+import hashlib
+import tempfile
+import threading
+
+
+class CachedResponse(object):
+
+    """Response served from HTTPCache, with the parts of requests.Response the scrapers use"""
+
+    def __init__(self, url, status_code, reason, headers, content, encoding=None):
+        self.url = url
+        self.status_code = status_code
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding
+        self.from_cache = True
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8", "replace")
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class HTTPCache(object):
+
+    """On-disk cache of successful GET responses, shared by every worker process.
+
+    Layout under directory:
+        index/<sha256 of url and user agent>.json   status, validators (ETag, Last-Modified), body hash, time stored
+        bodies/<ab>/<sha256 of body>  zlib compressed body, shared by every url with the same content
+
+    Entries are kept per url and user agent (User-Agent or X-Crawlera-UA header), as sites serve
+    desktop, mobile and bot agents different pages.
+    Entries younger than ttl are served without touching the network. Older entries with a
+    validator are revalidated with If-None-Match/If-Modified-Since; a 304 refreshes them.
+    Callers never get a 304.
+    When the bodies exceed max_bytes the least recently used entries are evicted.
+    Files are written to a temporary name and renamed, so readers in other processes never
+    see partial entries; eviction is serialized across processes with a lock file.
+
+    Attributes:
+        directory (string): cache root, None disables the cache
+        ttl (int): seconds an entry is served without revalidation
+        max_bytes (int): size cap of the stored (compressed) bodies
+    """
+
+    EVICT_EVERY = 100
+
+    def __init__(self, directory=None, ttl=4 * 60 * 60, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._stores = 0
+        self._lock = threading.Lock()
+
+    def configure(self, directory=None, ttl=None, max_bytes=None):
+        self.directory = directory
+        if ttl is not None:
+            self.ttl = int(ttl)
+        if max_bytes is not None:
+            self.max_bytes = int(max_bytes)
+
+    ##########################################
+    ############### FETCH
+    ##########################################
+
+    def get(self, transport, url, **kwargs):
+        """GET url through transport, answering from the cache when possible.
+        Takes the arguments of transport.get
+        """
+        if not self.directory or kwargs.get("stream"):
+            return transport.get(url, **kwargs)
+
+        key = self._key(url, kwargs.get("headers"))
+        entry = self._load_entry(key)
+        response = self._fresh_response(url, key, entry)
+        if response is not None:
+            return response
+
+        entry = self._revalidated_entry(entry)
+        response = self._store_response(url, key, entry,
+                                        transport.get(url, **self._conditional_arguments(entry, kwargs)))
+        if response is None:
+            # the body was evicted by another process during the revalidation: fetched again, unconditionally
+            response = self._store_response(url, key, None, transport.get(url, **kwargs))
+
+        return response
+
+    async def get_async(self, transport, url, **kwargs):
+        """asyncio version of get, for AsyncHTTPTransport"""
+        if not self.directory:
+            return await transport.get(url, **kwargs)
+
+        key = self._key(url, kwargs.get("headers"))
+        entry = self._load_entry(key)
+        response = self._fresh_response(url, key, entry)
+        if response is not None:
+            return response
+
+        entry = self._revalidated_entry(entry)
+        response = self._store_response(url, key, entry,
+                                        await transport.get(url, **self._conditional_arguments(entry, kwargs)))
+        if response is None:
+            response = self._store_response(url, key, None, await transport.get(url, **kwargs))
+
+        return response
+
+    def lookup(self, url, headers=None):
+        """Fresh cached response of url (fetched with headers), None if there is none. Never goes to
+        the network (for streamed fetches, whose partial bodies are not cached)
+        """
+        if not self.directory:
+            return None
+
+        key = self._key(url, headers)
+        return self._fresh_response(url, key, self._load_entry(key))
+
+    @staticmethod
+    def _key(url, headers):
+        # the page served depends on the user agent (desktop, mobile, bot): one entry per agent
+        agents = dict((name.lower(), value) for name, value in (headers or {}).items()
+                      if name.lower() in ("user-agent", "x-crawlera-ua"))
+        if not agents:
+            return url
+
+        return "\n".join([url] + ["{}: {}".format(name, agents[name]) for name in sorted(agents)])
+
+    def _fresh_response(self, url, key, entry):
+        if entry is None or not self._is_fresh(entry):
+            return None
+
+        response = self._entry_response(url, key, entry)
+        if response is not None:
+            self._count("hits")
+
+        return response
+
+    def _is_fresh(self, entry):
+        return time.time() - entry["stored_at"] < self.ttl
+
+    def _revalidated_entry(self, entry):
+        # a stale entry is only revalidated while its body is stored, to answer the 304 with
+        if entry is None or not os.path.exists(self._body_path(entry["body"])):
+            return None
+
+        return entry
+
+    def _conditional_arguments(self, entry, arguments):
+        arguments = dict(arguments)
+        headers = dict(arguments.get("headers") or {})
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        arguments["headers"] = headers
+
+        return arguments
+
+    def _store_response(self, url, key, entry, response):
+        """Stores a fetched response, answers a 304 from entry
+        Returns:
+            the response for the caller, None if a 304 can't be answered (entry's body was evicted)
+        """
+        if response.status_code == 304 and entry is not None:
+            cached = self._entry_response(url, key, entry)
+            if cached is None:
+                return None
+
+            entry["stored_at"] = time.time()
+            self._write_entry(key, entry)
+            self._count("revalidated")
+            return cached
+
+        self._count("misses")
+        if response.status_code == 200:
+            self._store(url, key, response)
+
+        return response
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    ##########################################
+    ############### STORAGE
+    ##########################################
+
+    def _index_path(self, key):
+        return os.path.join(self.directory, "index", hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    def _body_path(self, body_hash):
+        return os.path.join(self.directory, "bodies", body_hash[:2], body_hash)
+
+    def _atomic_write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _load_entry(self, key):
+        try:
+            with open(self._index_path(key)) as index_file:
+                return json.load(index_file)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write_entry(self, key, entry):
+        self._atomic_write(self._index_path(key), json.dumps(entry).encode("utf-8"))
+
+    def _entry_response(self, url, key, entry):
+        try:
+            with open(self._body_path(entry["body"]), 'rb') as body_file:
+                content = zlib.decompress(body_file.read())
+            # mark the entry as recently used, for eviction
+            os.utime(self._index_path(key), None)
+        except (IOError, OSError, zlib.error):
+            # evicted by another process meanwhile
+            return None
+
+        return CachedResponse(url, entry["status"], "OK", entry["headers"], content, entry.get("encoding"))
+
+    def _store(self, url, key, response):
+        content = response.content
+        body_hash = hashlib.sha256(content).hexdigest()
+        body_path = self._body_path(body_hash)
+        if not os.path.exists(body_path):
+            self._atomic_write(body_path, zlib.compress(content, 6))
+
+        headers = response.headers or {}
+        self._write_entry(key, {
+            "url": url,
+            "status": response.status_code,
+            "headers": {"Content-Type": headers.get("Content-Type")},
+            "encoding": response.encoding,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "body": body_hash,
+            "stored_at": time.time()
+        })
+
+        with self._lock:
+            self._stores += 1
+            evict = self._stores % self.EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until the stored bodies fit in max_bytes"""
+        if not self.directory:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, ".evict.lock"), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._evict()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _evict(self):
+        index_dir = os.path.join(self.directory, "index")
+        if not os.path.isdir(index_dir):
+            return
+
+        entries = []
+        references = {}
+        for index_entry in os.scandir(index_dir):
+            try:
+                with open(index_entry.path) as index_file:
+                    body_hash = json.load(index_file)["body"]
+                last_used = index_entry.stat().st_mtime
+            except (IOError, OSError, ValueError, KeyError):
+                continue
+            entries.append((last_used, index_entry.path, body_hash))
+            references[body_hash] = references.get(body_hash, 0) + 1
+
+        sizes = {}
+        for body_hash in references:
+            try:
+                sizes[body_hash] = os.path.getsize(self._body_path(body_hash))
+            except OSError:
+                sizes[body_hash] = 0
+        total = sum(sizes.values())
+
+        for last_used, index_path, body_hash in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(index_path)
+            except OSError:
+                pass
+            references[body_hash] -= 1
+            if references[body_hash] == 0:
+                try:
+                    os.remove(self._body_path(body_hash))
+                except OSError:
+                    pass
+                total -= sizes[body_hash]
+
+    def stats(self):
+        return {
+            "enabled": bool(self.directory),
+            "hits": self.hits,
+            "revalidated": self.revalidated,
+            "misses": self.misses
+        }
+
+
+# response cache shared by all scrapers of this process (disabled until configured with a directory)
+http_cache = HTTPCache()
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from common.jsonlib import loads, serializer
+
+
+def canonical_url(url):
+    """Normalizes a business url so that equivalent spellings share cache entries:
+    lower case scheme and host, sorted query parameters, no fragment nor trailing slash
+    """
+    parts = urlsplit(url.strip())
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, query, ""))
+
+
+class MemoryResultCache(object):
+
+    """In-process LRU of scraped results, entries expire after ttl seconds"""
+
+    def __init__(self, max_entries=1000, ttl=60 * 60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.time() - entry[0] >= self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[2]
+
+    def set(self, key, url, value, stored_at=None):
+        with self._lock:
+            self._entries[key] = (stored_at or time.time(), url, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, url=None):
+        with self._lock:
+            if url is None:
+                self._entries.clear()
+                return
+            for key in [key for key, entry in self._entries.items() if entry[1] == url]:
+                del self._entries[key]
+
+
+class SQLiteResultCache(object):
+
+    """Result cache shared by every worker process through one SQLite file.
+    Every prune_every stores, expired rows are deleted and the oldest ones beyond max_rows (if set)"""
+
+    def __init__(self, path, ttl=60 * 60, max_rows=None, prune_every=100):
+        self.path = path
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.prune_every = prune_every
+        self._stores = 0
+        self._stores_lock = threading.Lock()
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS results "
+                               "(key TEXT PRIMARY KEY, url TEXT, value TEXT, stored_at REAL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS results_url ON results (url)")
+            connection.execute("CREATE INDEX IF NOT EXISTS results_stored_at ON results (stored_at)")
+
+    def _connection(self):
+        # sqlite connections can't be shared between threads: one per thread
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+
+        return connection
+
+    def get(self, key):
+        row = self._connection().execute("SELECT value, stored_at FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None or time.time() - row[1] >= self.ttl:
+            return None, None
+
+        return loads(row[0]), row[1]
+
+    def set(self, key, url, value):
+        with self._connection() as connection:
+            connection.execute("INSERT OR REPLACE INTO results (key, url, value, stored_at) VALUES (?, ?, ?, ?)",
+                               (key, url, serializer.dumps(value), time.time()))
+
+        with self._stores_lock:
+            self._stores += 1
+            due = self._stores % self.prune_every == 0
+        if due:
+            self.prune()
+
+    def prune(self):
+        """Deletes the expired rows, and the oldest rows beyond max_rows"""
+        with self._connection() as connection:
+            connection.execute("DELETE FROM results WHERE stored_at < ?", (time.time() - self.ttl,))
+            if self.max_rows is not None:
+                connection.execute("DELETE FROM results WHERE key IN "
+                                   "(SELECT key FROM results ORDER BY stored_at DESC LIMIT -1 OFFSET ?)",
+                                   (self.max_rows,))
+
+    def invalidate(self, url=None):
+        with self._connection() as connection:
+            if url is None:
+                connection.execute("DELETE FROM results")
+            else:
+                connection.execute("DELETE FROM results WHERE url = ?", (url,))
+            # expired rows go away with any invalidation
+            connection.execute("DELETE FROM results WHERE stored_at < ?", (time.time() - self.ttl,))
+
+
+class ResultCache(object):
+
+    """Two tier cache of business_info results, keyed by site, canonical url, bot
+    and the requested data fields. Lookups try the in-process LRU first, then the
+    shared SQLite tier (promoting what they find there to memory).
+
+    Attributes:
+        memory (MemoryResultCache): first tier
+        shared (SQLiteResultCache): second tier, None for a memory only cache
+    """
+
+    MEMORY = "memory"
+    SHARED = "shared"
+
+    def __init__(self, memory=None, shared=None):
+        self.memory = memory or MemoryResultCache()
+        self.shared = shared
+        self.memory_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.memory.max_entries > 0 or self.shared is not None
+
+    def configure(self, max_entries=None, ttl=None, path=None, max_rows=None):
+        ttl = int(ttl) if ttl is not None else self.memory.ttl
+        max_entries = int(max_entries) if max_entries is not None else self.memory.max_entries
+        self.memory = MemoryResultCache(max_entries, ttl)
+        self.shared = SQLiteResultCache(path, ttl, max_rows) if path else None
+
+    def key(self, site, url, bot=None, info_type_list=None):
+        fields = ",".join(sorted(set(info_type_list))) if info_type_list else "*"
+        return "|".join([site, canonical_url(url), bot or "", fields])
+
+    def get(self, site, url, bot=None, info_type_list=None):
+        """
+        Returns:
+            (result, tier) tuple: tier is MEMORY or SHARED, result is None on a miss
+        """
+        key = self.key(site, url, bot, info_type_list)
+        result = self.memory.get(key)
+        if result is not None:
+            self._count("memory_hits")
+            return result, self.MEMORY
+
+        if self.shared is not None:
+            result, stored_at = self.shared.get(key)
+            if result is not None:
+                self.memory.set(key, canonical_url(url), result, stored_at)
+                self._count("shared_hits")
+                return result, self.SHARED
+
+        self._count("misses")
+        return None, None
+
+    def set(self, site, url, result, bot=None, info_type_list=None):
+        key = self.key(site, url, bot, info_type_list)
+        self.memory.set(key, canonical_url(url), result)
+        if self.shared is not None:
+            self.shared.set(key, canonical_url(url), result)
+
+    def invalidate(self, url=None):
+        """Drops every cached result of url (every field set), or everything if url is None"""
+        url = canonical_url(url) if url else None
+        self.memory.invalidate(url)
+        if self.shared is not None:
+            self.shared.invalidate(url)
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "memory_hits": self.memory_hits,
+            "shared_hits": self.shared_hits,
+            "misses": self.misses
+        }
+
+
+# results cache of /get_data (memory only until configured with a database path)
+result_cache = ResultCache()
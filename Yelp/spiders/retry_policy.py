@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import time
+import random
+import threading
+from urllib.parse import urlsplit
+
+import requests
+
+# outcome of one fetch attempt, as classified by RetryPolicy
+SUCCESS = "success"
+RETRY = "retry"
+FATAL = "fatal"
+
+
+class CircuitOpenError(Exception):
+
+    """Raised instead of fetching when the circuit of the host is open"""
+
+    def __init__(self, host, retry_after):
+        Exception.__init__(self)
+        self.host = host
+        self.retry_after = retry_after
+        self.message = "Circuit open for {}, retry in {} seconds".format(host, int(retry_after))
+
+    def __str__(self):
+        return self.message
+
+
+class CircuitBreaker(object):
+
+    """Fails fast while a host is unhealthy.
+    After failure_threshold consecutive failed requests the circuit opens and every fetch to the
+    host is refused for reset_timeout seconds. Then a single trial fetch is let through
+    (half open): its success closes the circuit, its failure opens it again, and an outcome
+    telling nothing of the host's health (a 404) lets another trial through.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+
+            if self.state == self.OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_running = False
+
+            if self.state == self.HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+
+            return False
+
+    def retry_after(self):
+        if self.opened_at is None:
+            return 0
+
+        return max(self.reset_timeout - (time.time() - self.opened_at), 0)
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_running = False
+
+    def record_neutral(self):
+        with self._lock:
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.time()
+            self._trial_running = False
+
+
+class CircuitBreakers(object):
+
+    """Process-wide circuit breakers, one per host"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def for_host(self, host):
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+                self._breakers[host] = breaker
+
+        return breaker
+
+    def states(self):
+        with self._lock:
+            breakers = list(self._breakers.items())
+
+        return dict((host, {"state": breaker.state, "failures": breaker.failures}) for host, breaker in breakers)
+
+
+class RetryBudget(object):
+
+    """Caps the retries of a whole batch to a share of the requests it made,
+    so a batch against a failing site stops retrying instead of multiplying its load.
+    A retry is allowed while retries < min_retries + ratio * requests.
+    """
+
+    def __init__(self, ratio=0.2, min_retries=10):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.requests = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def withdraw(self):
+        """Returns True (and counts the retry) if the budget allows one more retry"""
+        with self._lock:
+            if self.retries >= self.min_retries + self.ratio * self.requests:
+                return False
+            self.retries += 1
+            return True
+
+    def stats(self):
+        return {"requests": self.requests, "retries": self.retries}
+
+
+class RetryPolicy(object):
+
+    """Retry policy shared by every fetch path of the scrapers.
+    Classifies each attempt, waits between retries with exponential backoff and full jitter,
+    and keeps retries within a per request budget (max_attempts, max_elapsed seconds) and
+    an optional per batch RetryBudget. Only throttling, server errors and network errors are
+    retried; 404 and other client errors are final. Bans are retried too by requests that can
+    change proxy for the next attempt (begin with retry_bans).
+    Circuit breakers count retried attempts and bans (403, 429) as failures of the host, and
+    successes only as successes: other final outcomes (404, errors that are not the network's)
+    say nothing of the host's health.
+
+    Attributes:
+        max_attempts (int): attempts per request, the first one included
+        base_delay (float): backoff of the first retry, doubled for each following one
+        max_delay (float): ceiling of a single backoff
+        max_elapsed (float): seconds after which a request stops retrying
+        breakers (CircuitBreakers): circuit breakers of the hosts fetched
+    """
+
+    RETRY_STATUS_CODES = frozenset([408, 429, 500, 502, 503, 504])
+    # responses telling the host refuses the requests: failures for the circuit breaker, retried or not
+    BAN_STATUS_CODES = frozenset([403, 429])
+    RETRY_ERRORS = (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError,
+                    requests.exceptions.ContentDecodingError)
+
+    def __init__(self, max_attempts=8, base_delay=1.0, max_delay=30.0, max_elapsed=180, breakers=None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_elapsed = max_elapsed
+        self.breakers = breakers or CircuitBreakers()
+
+    def configure(self, max_attempts=None, base_delay=None, max_delay=None, max_elapsed=None,
+                  failure_threshold=None, reset_timeout=None):
+        if max_attempts is not None:
+            self.max_attempts = int(max_attempts)
+        if base_delay is not None:
+            self.base_delay = float(base_delay)
+        if max_delay is not None:
+            self.max_delay = float(max_delay)
+        if max_elapsed is not None:
+            self.max_elapsed = float(max_elapsed)
+        if failure_threshold is not None or reset_timeout is not None:
+            self.breakers = CircuitBreakers(failure_threshold or self.breakers.failure_threshold,
+                                            reset_timeout or self.breakers.reset_timeout)
+
+    def classify(self, response=None, error=None):
+        if error is not None:
+            return RETRY if isinstance(error, self.RETRY_ERRORS) else FATAL
+
+        if response.status_code < 400:
+            return SUCCESS
+        if response.status_code in self.RETRY_STATUS_CODES:
+            return RETRY
+
+        return FATAL
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def begin(self, url, budget=None, max_attempts=None, retry_bans=False):
+        """Starts tracking the attempts of one request
+        Args:
+            url (string): url fetched, its host selects the circuit breaker
+            budget (RetryBudget): retry budget of the batch the request belongs to, if any
+            max_attempts (int): overrides the policy's max_attempts for this request
+            retry_bans (bool): retry bans (BAN_STATUS_CODES), for requests whose next attempt
+                goes through another proxy
+        Returns:
+            RetryRequest
+        """
+        return RetryRequest(self, url, budget, max_attempts or self.max_attempts, retry_bans)
+
+
+class RetryRequest(object):
+
+    """Attempts of one request under a RetryPolicy. Typical fetch loop:
+
+        retries = policy.begin(url, budget)
+        while True:
+            retries.check_circuit()
+            outcome = retries.record(response=..., error=...)
+            if outcome != RETRY or retries.next_delay() is None:
+                break
+            time.sleep(retries.delay)
+
+    Attributes:
+        attempt (int): index of the current attempt, starting at 0
+        delay (float): seconds to wait before the next attempt
+        banned (bool): whether an attempt was banned
+    """
+
+    def __init__(self, policy, url, budget, max_attempts, retry_bans=False):
+        self.policy = policy
+        self.host = urlsplit(url).netloc.lower()
+        self.breaker = policy.breakers.for_host(self.host)
+        self.budget = budget
+        self.max_attempts = max_attempts
+        self.retry_bans = retry_bans
+        self.banned = False
+        self.attempt = 0
+        self.delay = 0
+        self.last_response = None
+        self.last_error = None
+        self._failure_reported = False
+        self._time_start = time.time()
+        # retries are allowed on top of the requests made, so a request counts once, not per attempt
+        if budget is not None:
+            budget.record_request()
+
+    def check_circuit(self):
+        """Raises CircuitOpenError if the host is not to be fetched right now"""
+        if not self.breaker.allow():
+            raise CircuitOpenError(self.host, self.breaker.retry_after())
+
+    def record(self, response=None, error=None):
+        """Classifies the attempt and reports it to the circuit breaker of the host
+        Returns:
+            SUCCESS, RETRY or FATAL
+        """
+        self.last_response = response
+        self.last_error = error
+        outcome = self.policy.classify(response, error)
+        banned = response is not None and response.status_code in self.policy.BAN_STATUS_CODES
+        if banned:
+            self.banned = True
+            if self.retry_bans:
+                outcome = RETRY
+        if outcome == RETRY or banned:
+            # a request counts once towards opening the circuit, so a single broken page can't open it
+            # (trial fetches of a half open circuit are always reported)
+            if not self._failure_reported or self.breaker.state != CircuitBreaker.CLOSED:
+                self.breaker.record_failure()
+                self._failure_reported = True
+        elif outcome == SUCCESS:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_neutral()
+
+        return outcome
+
+    def next_delay(self):
+        """Moves to the next attempt if the budgets allow it
+        Returns:
+            seconds to wait before it (also kept in self.delay), or None to give up
+        """
+        if self.attempt + 1 >= self.max_attempts:
+            return None
+
+        delay = self.policy.backoff(self.attempt)
+        if time.time() + delay - self._time_start > self.policy.max_elapsed:
+            return None
+        if self.budget is not None and not self.budget.withdraw():
+            return None
+
+        self.attempt += 1
+        self.delay = delay
+        return delay
+
+
+# policy used by scrapers unless one is passed to their constructor
+default_retry_policy = RetryPolicy()
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import asyncio
+import threading
+import weakref
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+
+    """Coalesces concurrent calls for the same key: the first caller (leader) runs the
+    function, callers arriving while it runs (followers) wait for it and get its result,
+    or its exception raised again. Once the leader is done the next call runs again,
+    nothing is cached.
+
+    Attributes:
+        leaders (int): calls that ran the function
+        followers (int): calls that got the result of a leader instead
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.followers = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, function):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+            else:
+                self.followers += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        return {"leaders": self.leaders, "followers": self.followers, "in_flight": len(self._calls)}
+
+
+class AsyncSingleFlight(object):
+
+    """asyncio version of SingleFlight, coalescing the calls made on the same event loop.
+    The function runs as a task of its own that every caller waits for: a caller cancelled
+    (client gone, timeout), the leader included, stops waiting without cancelling it for the others
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.followers = 0
+        self._calls = weakref.WeakKeyDictionary()
+
+    async def do(self, key, coroutine_function):
+        loop = asyncio.get_running_loop()
+        calls = self._calls.setdefault(loop, {})
+        task = calls.get(key)
+        if task is None:
+            self.leaders += 1
+            task = asyncio.ensure_future(coroutine_function())
+            calls[key] = task
+            task.add_done_callback(lambda done: self._finished(calls, key, done))
+        else:
+            self.followers += 1
+
+        return await asyncio.shield(task)
+
+    @staticmethod
+    def _finished(calls, key, task):
+        if calls.get(key) is task:
+            del calls[key]
+        if not task.cancelled():
+            # retrieved here, so a task whose callers were all cancelled doesn't log "exception never retrieved"
+            task.exception()
+
+    def stats(self):
+        return {"leaders": self.leaders, "followers": self.followers,
+                "in_flight": sum(len(calls) for calls in list(self._calls.values()))}
@@ -1,12 +1,167 @@
 #!/usr/bin/python
 
 import re
-import json
 import datetime
+import threading
 import requests
 
-from lxml import html
-from spiders.extract_data import Scraper
+from html import unescape
+from lxml import html, etree
+from spiders.extract_data import Scraper, depends_on, TREE, PAGE_JSON, HOURS, PAGE_CHECK
+from common.xpaths import select
+from common.jsonlib import loads
+
+
+def _texts(element):
+    # text nodes directly under element, as "element/text()" returns them
+    texts = [element.text] if element.text is not None else []
+    texts.extend(child.tail for child in element if child.tail is not None)
+    return texts
+
+
+# plain lxml parsers (one per thread: lxml serializes the use of a parser) for the single pass mode.
+# lxml.html trees look up a python element class for every element reached from python,
+# which costs more than the walk itself
+_plain_parsers = threading.local()
+
+
+def _plain_html_parser():
+    parser = getattr(_plain_parsers, "parser", None)
+    if parser is None:
+        parser = etree.HTMLParser()
+        _plain_parsers.parser = parser
+
+    return parser
+
+
+class YelpPageScan(object):
+
+    """Everything YelpScraper reads from the page tree, collected in a single walk over it
+    for the single pass extraction mode. Each attribute holds what the selector it replaces
+    returns, so both modes produce the same data.
+
+    Attributes:
+        og_types (list): content of the og:type meta tags ("yelp.og_type")
+        biz_ids (list): content of the yelp-biz-id meta tags ("yelp.biz_id")
+        ld_json (list): text of the ld+json scripts ("yelp.ld_json")
+        phones (list): text of the biz-phone spans ("yelp.phone")
+        websites (list): link text in the biz-website spans ("yelp.website")
+        hours_rows (list): (day texts, td cells) of every hours table row
+        showcase_photos (list): (captions, image urls) of every showcase photo
+    """
+
+    HOURS_TABLE_CLASS = "table table-simple hours-table"
+
+    def __init__(self, tree):
+        self.og_types = []
+        self.biz_ids = []
+        self.ld_json = []
+        self.phones = []
+        self.websites = []
+        self.hours_rows = []
+        self.showcase_photos = []
+
+        # lxml filters the tags while walking, only candidates reach python.
+        # the whole document is walked, as the "//" selectors do
+        for element in tree.getroottree().iter("meta", "script", "span", "table", "div"):
+            tag = element.tag
+            if tag == "span":
+                span_class = element.get("class")
+                if span_class is None:
+                    continue
+                if span_class == "biz-phone":
+                    self.phones.extend(_texts(element))
+                if "biz-website" in span_class:
+                    for link in element.iterdescendants("a"):
+                        self.websites.extend(_texts(link))
+            elif tag == "div":
+                if element.get("class") == "showcase-photos":
+                    self._add_showcase_photos(element)
+            elif tag == "meta":
+                content = element.get("content")
+                if content is None:
+                    continue
+                if element.get("property") == "og:type":
+                    self.og_types.append(content)
+                if element.get("name") == "yelp-biz-id":
+                    self.biz_ids.append(content)
+            elif tag == "script":
+                if element.get("type") == "application/ld+json":
+                    self.ld_json.extend(_texts(element))
+            elif element.get("class") == self.HOURS_TABLE_CLASS:
+                self._add_hours_rows(element)
+
+    def _add_hours_rows(self, table):
+        for body in table:
+            if body.tag != "tbody":
+                continue
+            for row in body:
+                if row.tag != "tr":
+                    continue
+                days = []
+                for cell in row:
+                    if cell.tag == "th":
+                        days.extend(_texts(cell))
+                self.hours_rows.append((days, [cell for cell in row if cell.tag == "td"]))
+
+    def _add_showcase_photos(self, showcase):
+        for photo in showcase:
+            if photo.tag != "div":
+                continue
+            captions = []
+            for box in photo.iterdescendants("div"):
+                if box.get("class") == "photo-box-overlay_caption":
+                    captions.extend(_texts(box))
+            urls = [image.get("src") for image in photo.iterdescendants("img") if image.get("src") is not None]
+            self.showcase_photos.append((captions, urls))
+
+
+# the tokens of a raw page YelpRawPageScan looks at. comments and script bodies are matched whole,
+# so tags inside them are skipped as the html parser skips them
+_RAW_PAGE_TOKENS = re.compile(r"<!--.*?-->|<script(\s[^>]*)?>(.*?)</script|<meta(\s[^>]*)?>", re.I | re.S)
+_TAG_ATTRIBUTES = re.compile(r"""([^\s"'<>/=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+)))?""")
+
+
+def _tag_attributes(text):
+    # as the html parser reads them: lowercase names, first of duplicates, entities decoded
+    attributes = {}
+    for match in _TAG_ATTRIBUTES.finditer(text or ""):
+        name, double_quoted, single_quoted, unquoted = match.groups()
+        value = double_quoted if double_quoted is not None else (
+            single_quoted if single_quoted is not None else unquoted)
+        attributes.setdefault(name.lower(), unescape(value) if value is not None else None)
+
+    return attributes
+
+
+class YelpRawPageScan(object):
+
+    """The og:type meta tags and ld+json scripts of a page, scanned from its text without
+    building a tree: all that YelpScraper needs for TREE_FREE_RESOURCES. Attributes hold the
+    same data as the YelpPageScan attributes of the same names.
+
+    Attributes:
+        og_types (list): content of the og:type meta tags ("yelp.og_type")
+        ld_json (list): text of the ld+json scripts ("yelp.ld_json")
+    """
+
+    def __init__(self, text):
+        self.og_types = []
+        self.ld_json = []
+
+        for match in _RAW_PAGE_TOKENS.finditer(text):
+            script_attributes, script_text, meta_attributes = match.groups()
+            if meta_attributes is not None:
+                # most meta tags are something else, don't parse their attributes
+                if "og:type" not in meta_attributes:
+                    continue
+                attributes = _tag_attributes(meta_attributes)
+                if attributes.get("property") == "og:type" and attributes.get("content") is not None:
+                    self.og_types.append(attributes["content"])
+            elif script_text and script_attributes and "ld+json" in script_attributes:
+                # an empty script has no text node
+                if _tag_attributes(script_attributes).get("type") == "application/ld+json":
+                    self.ld_json.append(script_text)
 
 
 class YelpScraper(Scraper):
@@ -16,11 +171,16 @@ class YelpScraper(Scraper):
 
     INVALID_URL_MESSAGE = "Expected URL format is ^https://(www|en).yelp.com/biz/([a-zA-Z0-9-]+-)?[a-zA-Z0-9]+$"
 
+    # read the page tree in one walk (YelpPageScan) instead of one xpath per field
+    SINGLE_PASS = False
+
     def __init__(self, **kwargs):  # **kwargs are presumably (url, bot)
         Scraper.__init__(self, **kwargs)
 
         self.page_json = None
         self.business_hours = None
+        self.single_pass = kwargs.get('single_pass', self.SINGLE_PASS)
+        self.page_scan = None
 
     def rebuild_business_url(self):
         return self.business_page_url
@@ -45,7 +205,7 @@ class YelpScraper(Scraper):
             False otherwise
         """
         try:
-            itemtype = self.tree_html.xpath('//meta[@property="og:type"]/@content')[0].strip()
+            itemtype = self._select("yelp.og_type")[0].strip()
 
             if itemtype != "yelpyelp:business":
                 raise Exception()
@@ -53,8 +213,6 @@ class YelpScraper(Scraper):
         except Exception:
             return True
 
-        self._extract_page_json()
-
         return False
 
     ##########################################
@@ -66,6 +224,65 @@ class YelpScraper(Scraper):
                         string)  # remove all occurance streamed comments (/*COMMENT */) from string
         return string
 
+    # YelpPageScan attribute replacing each selector in single pass mode
+    SCANNED_SELECTORS = {
+        "yelp.og_type": "og_types",
+        "yelp.biz_id": "biz_ids",
+        "yelp.ld_json": "ld_json",
+        "yelp.phone": "phones",
+        "yelp.website": "websites",
+    }
+
+    def _parse_page(self, contents):
+        if self.single_pass:
+            return html.fromstring(contents, parser=_plain_html_parser())
+
+        return Scraper._parse_page(self, contents)
+
+    def _stream_parser(self, tags):
+        parser = Scraper._stream_parser(self, tags)
+        if self.single_pass:
+            # plain elements, as _plain_html_parser builds
+            parser.set_element_class_lookup(None)
+
+        return parser
+
+    def _page_fetch_key(self, request_url):
+        # trees of both modes are built by different parsers
+        return Scraper._page_fetch_key(self, request_url) + (self.single_pass,)
+
+    def _page_scan(self):
+        if self.page_scan is None:
+            if self.tree_html is None:
+                self.page_scan = YelpRawPageScan(self.page_raw_text)
+            else:
+                self.page_scan = YelpPageScan(self.tree_html)
+
+        return self.page_scan
+
+    def _select(self, name):
+        # without a tree the plan only reads TREE_FREE_RESOURCES, scanned from the raw page
+        if self.single_pass or self.tree_html is None:
+            return getattr(self._page_scan(), self.SCANNED_SELECTORS[name])
+
+        return select(name, self.tree_html)
+
+    def _hours_rows(self):
+        """(day texts, td cells) of every row of the hours table"""
+        if self.single_pass:
+            return self._page_scan().hours_rows
+
+        return [(select("yelp.hours_row_day", row), select("yelp.hours_row_cells", row))
+                for row in select("yelp.hours_rows", self.tree_html)]
+
+    def _showcase_photos(self):
+        """(captions, image urls) of every showcase photo"""
+        if self.single_pass:
+            return self._page_scan().showcase_photos
+
+        return [(select("yelp.photo_caption", photo), select("yelp.img_src", photo))
+                for photo in select("yelp.showcase_photos", self.tree_html)]
+
     def _extract_page_json(self):
         if self.page_json:
             return
@@ -74,25 +291,16 @@ class YelpScraper(Scraper):
         categories = []
 
         try:
-            page_jsons_list = self.tree_html.xpath("//script[@type='application/ld+json']/text()")
+            page_jsons_list = self._select("yelp.ld_json")
 
             for raw_json in page_jsons_list:
-                json_info = json.loads(raw_json)
+                json_info = loads(raw_json)
 
                 if json_info.get("@type") == "LocalBusiness":
                     page_json = json_info
                 elif "itemListElement" in json_info:
                     categories.append(json_info["itemListElement"][-1]["item"]["name"])
 
-            working_hours_by_day = self.tree_html.xpath("//table[@class='table table-simple hours-table']/tbody/tr")
-            business_hours = {'Mon': None, 'Tue': None, 'Wed': None, 'Thu': None, 'Fri': None, 'Sat': None, 'Sun': None}
-
-            for working_hours in working_hours_by_day:
-                business_hours[working_hours.xpath('./th/text()')[0].strip()] = working_hours.xpath('./td')[
-                    0].text_content().strip().split(" - ")
-
-            self.business_hours = business_hours
-
         except Exception as e:
             print("Parsing error in page json :" + str(e))
 
@@ -102,65 +310,111 @@ class YelpScraper(Scraper):
             if categories:
                 self.page_json["businessCategories"] = categories
 
+    def _extract_business_hours(self):
+        try:
+            business_hours = {'Mon': None, 'Tue': None, 'Wed': None, 'Thu': None, 'Fri': None, 'Sat': None, 'Sun': None}
+
+            for days, cells in self._hours_rows():
+                business_hours[days[0].strip()] = select("yelp.text_content", cells[0]).strip().split(" - ")
+
+            self.business_hours = business_hours
+
+        except Exception as e:
+            print("Parsing error in business hours :" + str(e))
+
+    # derived resources extractors depend on, built only when a requested data type needs them
+    RESOURCE_LOADERS = (
+        (PAGE_JSON, "_extract_page_json"),
+        (HOURS, "_extract_business_hours"),
+    )
+
+    # the page check (og:type) and the ld+json blocks are read from the raw page if nothing else needs a tree
+    TREE_FREE_RESOURCES = frozenset([PAGE_CHECK, PAGE_JSON])
+
+    # where a streamed page has been read far enough (the og:type meta tag, the hours table).
+    # not PAGE_JSON: ld+json blocks may be anywhere in the page (yelp puts some in the <body>),
+    # and there is no telling which one is the last, so it needs the whole page
+    STREAM_COMPLETE = {
+        PAGE_CHECK: ("meta", "property", "og:type"),
+        HOURS: ("table", "class", "table table-simple hours-table"),
+    }
+
     ##########################################
     ############### FIELD FUNCTIONS
     ##########################################
+    @depends_on(PAGE_JSON)
     def _business_name(self):
         return self.page_json.get("name")
 
+    @depends_on()
     def _business_description(self):
         return None
 
+    @depends_on()
     def _price(self):
         return None
 
+    @depends_on()
     def _before_price_label(self):
         return None
 
+    @depends_on()
     def _after_price_label(self):
         return None
 
+    @depends_on(TREE)
     def _phone(self):
-        business_phone = self.tree_html.xpath("//span[@class='biz-phone']/text()")
+        business_phone = self._select("yelp.phone")
         return business_phone[0].strip() if business_phone else None,
 
+    @depends_on(TREE)
     def _website(self):
-        website = self.tree_html.xpath("//span[contains(@class, 'biz-website')]//a/text()")
+        website = self._select("yelp.website")
 
         return website[0].strip() if website else None
 
+    @depends_on()
     def _google_place_id(self):
         return None
 
+    @depends_on(TREE)
     def _yelp_id(self):
-        yelp_biz_id = self.tree_html.xpath("//meta[@name='yelp-biz-id']/@content")
+        yelp_biz_id = self._select("yelp.biz_id")
 
         return yelp_biz_id[0].strip() if yelp_biz_id else None
 
+    @depends_on()
     def _lat(self):
         return None
 
+    @depends_on()
     def _lng(self):
         return None
 
+    @depends_on(PAGE_JSON)
     def _address(self):
         return self.page_json.get("address", {}).get("streetAddress")
 
+    @depends_on(PAGE_JSON)
     def _city(self):
         return self.page_json.get("address", {}).get("addressLocality")
 
+    @depends_on(PAGE_JSON)
     def _state(self):
         return self.page_json.get("address", {}).get("addressRegion")
 
+    @depends_on(PAGE_JSON)
     def _zip(self):
         return self.page_json.get("address", {}).get("postalCode")
 
+    @depends_on(HOURS)
     def _monday_open_time(self):
         if self.business_hours and self.business_hours.get("Mon"):
             return self.business_hours["Mon"][0]
 
         return None
 
+    @depends_on(HOURS)
     def _monday_close_time(self):
         if self.business_hours and self.business_hours.get("Mon"):
             return self.business_hours["Mon"][1] if len(self.business_hours["Mon"]) > 1 else self.business_hours["Mon"][
@@ -168,12 +422,14 @@ class YelpScraper(Scraper):
 
         return None
 
+    @depends_on(HOURS)
     def _tuesday_open_time(self):
         if self.business_hours and self.business_hours.get("Tue"):
             return self.business_hours["Tue"][0]
 
         return None
 
+    @depends_on(HOURS)
     def _tuesday_close_time(self):
         if self.business_hours and self.business_hours.get("Tue"):
             return self.business_hours["Tue"][1] if len(self.business_hours["Tue"]) > 1 else self.business_hours["Tue"][
@@ -181,12 +437,14 @@ class YelpScraper(Scraper):
 
         return None
 
+    @depends_on(HOURS)
     def _wednesday_open_time(self):
         if self.business_hours and self.business_hours.get("Wed"):
             return self.business_hours["Wed"][0]
 
         return None
 
+    @depends_on(HOURS)
     def _wednesday_close_time(self):
         if self.business_hours and self.business_hours.get("Wed"):
             return self.business_hours["Wed"][1] if len(self.business_hours["Wed"]) > 1 else self.business_hours["Wed"][
@@ -194,12 +452,14 @@ class YelpScraper(Scraper):
 
         return None
 
+    @depends_on(HOURS)
     def _thursday_open_time(self):
         if self.business_hours and self.business_hours.get("Thu"):
             return self.business_hours["Thu"][0]
 
         return None
 
+    @depends_on(HOURS)
     def _thursday_close_time(self):
         if self.business_hours and self.business_hours.get("Thu"):
             return self.business_hours["Thu"][1] if len(self.business_hours["Thu"]) > 1 else self.business_hours["Thu"][
@@ -207,12 +467,14 @@ class YelpScraper(Scraper):
 
         return None
 
+    @depends_on(HOURS)
     def _friday_open_time(self):
         if self.business_hours and self.business_hours.get("Fri"):
             return self.business_hours["Fri"][0]
 
         return None
 
+    @depends_on(HOURS)
     def _friday_close_time(self):
         if self.business_hours and self.business_hours.get("Fri"):
             return self.business_hours["Fri"][1] if len(self.business_hours["Fri"]) > 1 else self.business_hours["Fri"][
@@ -220,12 +482,14 @@ class YelpScraper(Scraper):
 
         return None
 
+    @depends_on(HOURS)
     def _saturday_open_time(self):
         if self.business_hours and self.business_hours.get("Sat"):
             return self.business_hours["Sat"][0]
 
         return None
 
+    @depends_on(HOURS)
     def _saturday_close_time(self):
         if self.business_hours and self.business_hours.get("Sat"):
             return self.business_hours["Sat"][1] if len(self.business_hours["Sat"]) > 1 else self.business_hours["Sat"][
@@ -233,12 +497,14 @@ class YelpScraper(Scraper):
 
         return None
 
+    @depends_on(HOURS)
     def _sunday_open_time(self):
         if self.business_hours and self.business_hours.get("Sun"):
             return self.business_hours["Sun"][0]
 
         return None
 
+    @depends_on(HOURS)
     def _sunday_close_time(self):
         if self.business_hours and self.business_hours.get("Sun"):
             return self.business_hours["Sun"][1] if len(self.business_hours["Sun"]) > 1 else self.business_hours["Sun"][
@@ -246,17 +512,19 @@ class YelpScraper(Scraper):
 
         return None
 
+    @depends_on(PAGE_JSON)
     def _categories(self):
         return self.page_json.get("businessCategories")
 
     # return image url and description and None if it is empty
+    @depends_on(TREE)
     def _photos(self):
         photos_list = []
 
-        for showcase_photo in self.tree_html.xpath("//div[@class='showcase-photos']/div"):
-            if showcase_photo.xpath(".//div[@class='photo-box-overlay_caption']/text()"):
-                url = showcase_photo.xpath(".//img/@src")[0],
-                description = showcase_photo.xpath(".//div[@class='photo-box-overlay_caption']/text()")[0]
+        for caption, image_urls in self._showcase_photos():
+            if caption:
+                url = image_urls[0],
+                description = caption[0]
 
                 if '/bphoto/' in str(url):
                     print("ISIDE IFFFFFFFF       ",url)
@@ -279,6 +547,7 @@ class YelpScraper(Scraper):
         else:
             return None
     #return review details
+    @depends_on(PAGE_JSON)
     def _reviews(self):
         reviews = {'rating': {'totalReviews': self.page_json.get("aggregateRating", {}).get("reviewCount", 0),
                               'averageRating': self.page_json.get("aggregateRating", {}).get("ratingValue", 0),
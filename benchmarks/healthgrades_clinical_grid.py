@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+"""CPU time of HealthgradesSpider reading the clinical quality grids of a parsed hospital page:
+one xpath query per field of every rating row (as the spider did before ClinicalQualityGrids)
+vs reading each grid once into row/column arrays.
+Page fetching and html parsing are left out.
+
+    python benchmarks/healthgrades_clinical_grid.py [--pages 50] [--categories 30] [--rows 6]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+from lxml import etree
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+
+from benchmarks.synthetic_pages import healthgrades_hospital_page
+from healthgrades.clinical_quality import ClinicalQualityGrids, cell
+
+OVERLAYS = etree.XPath('//div[@class="clinical-quality-overlay hg3-overlay"]')
+
+# the per row selectors the spider used
+MORTALITIES = etree.XPath('.//div[@class="clinical-overlay-grid-container"]/div[@class="hg3-clinical-quality-grid"][1]'
+                          '/div[contains(@class, "clpseable")]')
+COMPLICATIONS = etree.XPath('.//div[@class="clinical-overlay-grid-container"]/div[2]/div[contains(@class, "clpseable")]')
+TITLE = etree.XPath('.//h6[@class="title"]/text()')
+BASED_RATING = etree.XPath('.//p[@class="based-rating"]//text()')
+ACTUAL = etree.XPath('.//div[@class="row inner js-clpse hidden actual-num"]/div[@class="tb-col number"]/text()')
+PREDICTED = etree.XPath('.//div[@class="row inner js-clpse hidden predicted-num"]/div[@class="tb-col number"]/text()')
+QUESTION = etree.XPath('.//div[@class="explanation"]/h3[@class="headline"]/text()')
+ANSWER = etree.XPath('.//div[@class="explanation"]/div[@class="summary"]/p[1]/text()')
+
+
+def _first(values):
+    return values[0] if values else None
+
+
+def xpath_rows(overlay):
+    def rows(selector):
+        return [(_first(TITLE(row)), ''.join(BASED_RATING(row)), ACTUAL(row), PREDICTED(row),
+                 _first(QUESTION(row)), _first(ANSWER(row))) for row in selector(overlay)]
+    return rows(MORTALITIES), rows(COMPLICATIONS)
+
+
+def grid_rows(overlay):
+    grids = ClinicalQualityGrids(overlay)
+
+    def rows(grid_rows):
+        return [(row.title, row.description, row.actual, row.predicted, row.question, row.answer)
+                for row in grid_rows]
+    return rows(grids.mortalities), rows(grids.complications)
+
+
+def extract(tree, read_rows):
+    # the lists the spider builds (Clinical_Quality_Ratings) from the rows
+    ratings = []
+    for overlay in OVERLAYS(tree):
+        mortalities, complications = read_rows(overlay)
+        ratings.append([(title, description, cell(actual, 0), cell(actual, 1), cell(predicted, 0), cell(predicted, 1),
+                         question, answer)
+                        for title, description, actual, predicted, question, answer in mortalities + complications])
+    return ratings
+
+
+def measure(trees, read_rows):
+    time_start = time.process_time()
+    for tree in trees:
+        extract(tree, read_rows)
+    return time.process_time() - time_start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=50, help="pages read per method")
+    parser.add_argument("--categories", type=int, default=30, help="clinical quality categories per page")
+    parser.add_argument("--rows", type=int, default=6, help="ratings per grid")
+    args = parser.parse_args()
+
+    page = healthgrades_hospital_page(categories=args.categories, rows=args.rows)
+    # the tree scrapy gives the spider (plain lxml elements), a fresh one per read
+    trees = [etree.fromstring(page, etree.HTMLParser()) for _ in range(args.pages)]
+    grid_trees = [etree.fromstring(page, etree.HTMLParser()) for _ in range(args.pages)]
+
+    print("page: %d bytes, %d elements, same output with both methods: %s"
+          % (len(page), sum(1 for _ in trees[0].iter()), extract(trees[0], xpath_rows) == extract(trees[0], grid_rows)))
+
+    # warm up, then measure
+    measure(trees[:5], xpath_rows)
+    measure(grid_trees[:5], grid_rows)
+    per_field = measure(trees, xpath_rows)
+    grid = measure(grid_trees, grid_rows)
+
+    print("xpath per field: %8.1f us/page" % (per_field / args.pages * 1e6))
+    print("grid reader:     %8.1f us/page" % (grid / args.pages * 1e6))
+    print("saving:          %8.1f %%" % ((1 - grid / per_field) * 100))
+
+
+if __name__ == '__main__':
+    main()
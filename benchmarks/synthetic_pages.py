@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+"""Synthetic pages shaped like the ones the scrapers parse, for the benchmarks.
+Sizes are in the range of real pages (a few hundred KB, thousands of elements)
+but the content is generated, so the benchmarks run offline and repeatably.
+"""
+
+import json
+import random
+
+DAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def _words(rng, count):
+    return " ".join(rng.choice(["good", "doctor", "staff", "visit", "wait", "clinic", "friendly", "time"])
+                    for _ in range(count))
+
+
+def yelp_business_page(reviews=60, seed=0):
+    """Yelp business page: ld+json blocks, meta tags, phone, website, hours table,
+    showcase photos and a review list (the bulk of the elements)"""
+    rng = random.Random(seed)
+    business_json = {
+        "@context": "https://schema.org",
+        "@type": "LocalBusiness",
+        "name": "Premier Medical Associates",
+        "address": {"streetAddress": "123 Main St", "addressLocality": "Bushnell",
+                    "addressRegion": "FL", "postalCode": "33513"},
+        "aggregateRating": {"ratingValue": 4.5, "reviewCount": reviews},
+        "review": [{"author": "Reviewer %d" % i,
+                    "datePublished": "2019-01-%02d" % (i % 28 + 1),
+                    "reviewRating": {"ratingValue": i % 5 + 1},
+                    "description": _words(rng, 40)} for i in range(reviews)]
+    }
+    breadcrumbs = {"itemListElement": [{"item": {"name": "Health & Medical"}}, {"item": {"name": "Doctors"}}]}
+
+    parts = ['<!DOCTYPE html><html><head><title>Premier Medical Associates - Bushnell, FL</title>',
+             '<meta property="og:type" content="yelpyelp:business">',
+             '<meta name="yelp-biz-id" content="x7YwB3kGq9fE1aZ">']
+    for i in range(30):
+        parts.append('<meta name="meta-%d" content="%s"><link rel="preload" href="/static/%d.js">' % (i, _words(rng, 3), i))
+    for i in range(8):
+        parts.append('<script>window.yelp_%d = {"config": %d};</script>' % (i, i))
+    parts.append('<script type="application/ld+json">%s</script>' % json.dumps(business_json))
+    parts.append('<script type="application/ld+json">%s</script>' % json.dumps(breadcrumbs))
+    parts.append('</head><body><div class="main-header"><ul class="nav">')
+    for i in range(40):
+        parts.append('<li class="nav-item"><a href="/c/%d"><span>%s</span></a></li>' % (i, _words(rng, 2)))
+    parts.append('</ul></div><div class="biz-page-header"><h1 class="biz-page-title">Premier Medical Associates</h1>')
+    parts.append('<div class="mapbox-text"><ul><li><span class="biz-phone"> (352) 555-0143 </span></li>'
+                 '<li><span class="biz-website js-biz-website">Business website <a href="/biz_redir?url=x">'
+                 'premiermedical.com</a></span></li></ul></div></div>')
+    parts.append('<div class="showcase-photos">')
+    for i in range(3):
+        parts.append('<div class="js-photo photo"><div class="photo-box"><img src="https://s3-media.fl.yelpcdn.com/bphoto/%d/ls.jpg">'
+                     '<div class="photo-box-overlay_caption">Photo %d</div></div></div>' % (i, i))
+    parts.append('</div><table class="table table-simple hours-table"><tbody>')
+    for day in DAYS:
+        parts.append('<tr><th scope="row">%s</th><td><span class="nowrap">8:00 am</span> - <span class="nowrap">5:00 pm</span></td>'
+                     '<td class="extra"></td></tr>' % day)
+    parts.append('</tbody></table><div class="review-list"><ul>')
+    for i in range(reviews):
+        parts.append('<li><div class="review review--with-sidebar"><div class="review-sidebar"><ul>'
+                     '<li class="user-name"><a href="/user/%d">Reviewer %d</a></li><li class="friend-count"><b>%d</b> friends</li>'
+                     '</ul></div><div class="review-content"><div class="i-stars i-stars--regular-%d" title="%d.0 star rating">'
+                     '<img class="offscreen" src="/s.png"></div><span class="rating-qualifier">1/%d/2019</span>'
+                     '<p lang="en">%s</p><div class="review-footer"><a class="ybtn"><span>Useful</span></a>'
+                     '<a class="ybtn"><span>Funny</span></a><a class="ybtn"><span>Cool</span></a></div></div></div></li>'
+                     % (i, i, i, i % 5 + 1, i % 5 + 1, i % 28 + 1, _words(rng, 40)))
+    parts.append('</ul></div><div class="footer">')
+    for i in range(60):
+        parts.append('<div class="footer-col"><a href="/f/%d"><span>%s</span></a></div>' % (i, _words(rng, 2)))
+    parts.append('</div></body></html>')
+
+    return "".join(parts)
+
+
+def healthgrades_hospital_page(categories=30, rows=6, seed=0):
+    """Healthgrades hospital page: a clinical quality overlay per category, each with a grid
+    of mortality ratings and a grid of complication ratings (the bulk of the elements)"""
+    rng = random.Random(seed)
+
+    def grid(title, count):
+        grid_parts = ['<div class="hg3-clinical-quality-grid"><h4>%s</h4>' % title]
+        for i in range(count):
+            grid_parts.append(
+                '<div class="clpseable row-%d"><div class="row header"><h6 class="title">%s %d</h6>'
+                '<span class="icon icon-%d"></span></div><p class="based-rating">Based on <b>%d</b> %s</p>'
+                '<div class="row inner js-clpse hidden actual-num"><div class="tb-col label">Actual</div>'
+                '<div class="tb-col number">%.1f%%</div><div class="tb-col number">%.1f%%</div></div>'
+                '<div class="row inner js-clpse hidden predicted-num"><div class="tb-col label">Predicted</div>'
+                '<div class="tb-col number">%.1f%%</div><div class="tb-col number">%.1f%%</div></div>'
+                '<div class="explanation"><h3 class="headline">What does %s mean?</h3>'
+                '<div class="summary"><p>%s</p><p>%s</p></div></div></div>'
+                % (i, title, i, i % 3, rng.randint(50, 900), _words(rng, 6), rng.uniform(0, 9), rng.uniform(0, 9),
+                   rng.uniform(0, 9), rng.uniform(0, 9), title, _words(rng, 30), _words(rng, 20)))
+        grid_parts.append('</div>')
+        return "".join(grid_parts)
+
+    parts = ['<!DOCTYPE html><html><head><title>Hospital - Kissimmee, FL</title></head><body>',
+             '<div class="summary-hero-address"><h1>Kissimmee General Hospital</h1></div>',
+             '<div class="columns medium main-graph-radial-data" data-outer-percent="87"></div>']
+    for i in range(categories):
+        parts.append('<div class="clinical-quality-overlay hg3-overlay"><div class="overlay-header">'
+                     '<h2>Clinical Quality: Category %d</h2><p>%s</p></div><div class="clinical-overlay-grid-container">'
+                     % (i, _words(rng, 12)))
+        parts.append(grid("Mortality", rows))
+        parts.append(grid("Complication", rows))
+        parts.append('</div></div>')
+    parts.append('</body></html>')
+
+    return "".join(parts)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+"""CPU time of YelpScraper answering a request for the ld+json backed fields
+(name, address, city, state, zip, categories) from the page text:
+parsing the page into a tree and reading it (per field xpath and single pass modes)
+vs scanning the raw page for the ld+json blocks and the og:type meta tag (no tree).
+Page fetching is left out.
+
+    python benchmarks/yelp_json_fast_path.py [--pages 200] [--reviews 60]
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'Yelp'))
+
+from benchmarks.synthetic_pages import yelp_business_page
+from common import jsonlib
+from spiders.extract_data import PAGE_OK
+from spiders.yelp.extract_yelp_data import YelpScraper
+
+URL = "https://www.yelp.com/biz/premier-medical-associates-bushnell"
+FIELDS = ["business_name", "address", "city", "state", "zip", "categories"]
+
+# (name, single pass mode, whether a tree is built)
+PATHS = [("tree, xpath per field", False, True),
+         ("tree, single pass", True, True),
+         ("raw page fast path", True, False)]
+
+
+def extract(page, single_pass, builds_tree):
+    scraper = YelpScraper(url=URL, bot=None, single_pass=single_pass)
+    plan = scraper._extraction_plan(FIELDS)
+    tree = scraper._parse_page(page) if builds_tree else None
+    scraper._apply_page((PAGE_OK, page, tree))
+    return scraper._build_business_info(plan, 0)
+
+
+def measure(page, pages, single_pass, builds_tree):
+    time_start = time.process_time()
+    for _ in range(pages):
+        extract(page, single_pass, builds_tree)
+    return time.process_time() - time_start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=200, help="pages extracted per path")
+    parser.add_argument("--reviews", type=int, default=60, help="reviews per synthetic page (page size)")
+    args = parser.parse_args()
+
+    page = yelp_business_page(reviews=args.reviews)
+    plan = YelpScraper(url=URL, bot=None)._extraction_plan(FIELDS)
+    outputs = [extract(page, single_pass, builds_tree) for name, single_pass, builds_tree in PATHS]
+    print("page: %d bytes, json decoder: %s, plan needs a tree: %s, same output on every path: %s"
+          % (len(page), "orjson" if jsonlib.orjson is not None else "json", plan.needs_tree,
+             all(output == outputs[0] for output in outputs)))
+
+    timings = []
+    for name, single_pass, builds_tree in PATHS:
+        # warm up, then measure
+        measure(page, 10, single_pass, builds_tree)
+        timings.append(measure(page, args.pages, single_pass, builds_tree))
+        print("%-24s %8.1f us/page" % (name + ":", timings[-1] / args.pages * 1e6))
+
+    print("saving over single pass: %8.1f %%" % ((1 - timings[2] / timings[1]) * 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+"""CPU time of YelpScraper extracting every field of a parsed business page,
+one xpath query per field vs the single pass walk (YelpPageScan).
+Page fetching and html parsing (which costs the same with the parser of either mode)
+are left out.
+
+    python benchmarks/yelp_single_pass.py [--pages 200] [--reviews 60]
+"""
+
+import io
+import os
+import sys
+import time
+import argparse
+import contextlib
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir))
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, 'Yelp'))
+
+from benchmarks.synthetic_pages import yelp_business_page
+from spiders.extract_data import PAGE_OK
+from spiders.yelp.extract_yelp_data import YelpScraper
+
+URL = "https://www.yelp.com/biz/premier-medical-associates-bushnell"
+
+
+def parse(page, single_pass):
+    # each mode parses the page with its own parser
+    return YelpScraper(url=URL, bot=None, single_pass=single_pass)._parse_page(page)
+
+
+def extract(page, tree, single_pass):
+    scraper = YelpScraper(url=URL, bot=None, single_pass=single_pass)
+    scraper._apply_page((PAGE_OK, page, tree))
+    return scraper._build_business_info(scraper._extraction_plan(None), 0)
+
+
+def measure(page, trees, single_pass):
+    # the photos extractor prints every photo it keeps
+    with contextlib.redirect_stdout(io.StringIO()):
+        time_start = time.process_time()
+        for tree in trees:
+            extract(page, tree, single_pass)
+        return time.process_time() - time_start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=200, help="pages extracted per mode")
+    parser.add_argument("--reviews", type=int, default=60, help="reviews per synthetic page (page size)")
+    args = parser.parse_args()
+
+    page = yelp_business_page(reviews=args.reviews)
+    # a fresh tree per extraction, as in production (lxml caches the python proxies of elements)
+    trees = [parse(page, False) for _ in range(args.pages)]
+    plain_trees = [parse(page, True) for _ in range(args.pages)]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        same = extract(page, parse(page, False), False) == extract(page, parse(page, True), True)
+    print("page: %d bytes, %d elements, same output in both modes: %s"
+          % (len(page), sum(1 for _ in trees[0].iter()), same))
+
+    # warm up on trees of their own, then measure
+    measure(page, [parse(page, False) for _ in range(10)], False)
+    measure(page, [parse(page, True) for _ in range(10)], True)
+    per_field = measure(page, trees, False)
+    single_pass = measure(page, plain_trees, True)
+
+    print("xpath per field: %8.1f us/page" % (per_field / args.pages * 1e6))
+    print("single pass:     %8.1f us/page" % (single_pass / args.pages * 1e6))
+    print("saving:          %8.1f %%" % ((1 - single_pass / per_field) * 100))
+
+
+if __name__ == '__main__':
+    main()
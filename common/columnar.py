@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import os
+import uuid
+import json
+import datetime
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import pyarrow
+    import pyarrow.dataset
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from common.jsonlib import serializer
+
+# column types. containers (dicts, lists) go to "json" columns, as json text.
+# columns that only had None values so far are "null" columns
+NULL = "null"
+BOOL = "bool"
+INT = "int64"
+FLOAT = "float64"
+STRING = "string"
+JSON = "json"
+
+
+def available():
+    """Whether columnar datasets can be written here (pyarrow is installed)"""
+    return pyarrow is not None
+
+
+def _value_type(value):
+    if value is None:
+        return NULL
+    if isinstance(value, bool):
+        return BOOL
+    if isinstance(value, int):
+        return INT
+    if isinstance(value, float):
+        return FLOAT
+    if isinstance(value, str):
+        return STRING
+    return JSON
+
+
+def _widened_type(column_type, value_type):
+    # type of a column holding both types of values. string columns hold other values
+    # as json text, which is also what reading older (int, float, bool) files as strings gives
+    if column_type in (None, NULL) or column_type == value_type:
+        return value_type
+    if value_type == NULL:
+        return column_type
+    if {column_type, value_type} == {INT, FLOAT}:
+        return FLOAT
+    if column_type == JSON:
+        return JSON
+    return STRING
+
+
+def _convert(value, column_type):
+    if value is None:
+        return None
+    if column_type == JSON:
+        return serializer.dumps(value)
+    if column_type == STRING:
+        return value if isinstance(value, str) else serializer.dumps(value)
+    if column_type == FLOAT:
+        return float(value)
+    return value
+
+
+def _arrow_type(column_type):
+    return pyarrow.string() if column_type == JSON else pyarrow.type_for_alias(column_type)
+
+
+class ColumnarDataset(object):
+
+    """Append only dataset of records (dictionaries), stored as compressed Parquet files
+    partitioned hive style: <directory>/<key>=<value>/.../part-<time>-<id>.parquet.
+    Every append writes a file of its own, so batches never rewrite what earlier ones wrote
+    and readers never see half written files.
+
+    Columns are added as records bring new fields (their types are kept in _columns.json),
+    and widened when values of another type come: null to any, int to float, other mixes to string.
+    Files written before are read with the current types (dataset), records missing
+    a column reading as null.
+
+    Attributes:
+        directory (string): root of the dataset
+        partition_by (tuple): partition keys, outermost first
+        compression (string): Parquet compression codec
+    """
+
+    COLUMNS_FILE = "_columns.json"
+
+    def __init__(self, directory, partition_by=(), compression="zstd"):
+        if pyarrow is None:
+            raise RuntimeError("pyarrow is required for columnar datasets")
+
+        self.directory = directory
+        self.partition_by = tuple(partition_by)
+        self.compression = compression
+        self._lock = threading.Lock()
+
+    def columns(self):
+        """Column name -> column type, of every column written so far"""
+        try:
+            with open(os.path.join(self.directory, self.COLUMNS_FILE)) as columns_file:
+                return json.load(columns_file)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def append(self, records, partition=None):
+        """Writes records as a new file of the partition
+        Args:
+            records (list of dicts): records of the batch
+            partition (dict): value of every partition key
+        Returns:
+            path of the written file, None if there were no records
+        """
+        records = list(records)
+        if not records:
+            return None
+
+        partition = partition or {}
+        missing = [key for key in self.partition_by if key not in partition]
+        if missing:
+            raise ValueError("Missing partition values: " + ", ".join(missing))
+
+        partition_directory = os.path.join(self.directory, *["{}={}".format(key, partition[key])
+                                                             for key in self.partition_by])
+        os.makedirs(partition_directory, exist_ok=True)
+        columns = self._add_columns(records)
+        names = sorted(name for name in columns if any(name in record for record in records))
+        table = pyarrow.table({name: pyarrow.array([_convert(record.get(name), columns[name]) for record in records],
+                                                   type=_arrow_type(columns[name]))
+                               for name in names})
+
+        file_name = "part-{}-{}.parquet".format(datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S"), uuid.uuid4().hex[:8])
+        path = os.path.join(partition_directory, file_name)
+        # dot files are skipped by dataset readers until renamed
+        temp_path = os.path.join(partition_directory, "." + file_name)
+        pyarrow.parquet.write_table(table, temp_path, compression=self.compression)
+        os.replace(temp_path, path)
+
+        return path
+
+    def _add_columns(self, records):
+        """Adds the new fields of records to _columns.json, widening the known ones if needed
+        Returns:
+            column name -> column type, for every column
+        """
+        value_types = {}
+        for record in records:
+            for name, value in record.items():
+                if name in self.partition_by:
+                    raise ValueError("Field {} is a partition key".format(name))
+                value_types[name] = _widened_type(value_types.get(name), _value_type(value))
+
+        # other threads and processes may be adding columns too
+        with self._lock, self._columns_lock():
+            columns = self.columns()
+            changed = False
+            for name, value_type in value_types.items():
+                column_type = _widened_type(columns.get(name), value_type)
+                if column_type != columns.get(name):
+                    columns[name] = column_type
+                    changed = True
+            if changed:
+                temp_path = os.path.join(self.directory, "." + self.COLUMNS_FILE)
+                with open(temp_path, 'w') as columns_file:
+                    json.dump(columns, columns_file, sort_keys=True)
+                os.replace(temp_path, os.path.join(self.directory, self.COLUMNS_FILE))
+
+        return columns
+
+    def _columns_lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        return _FileLock(os.path.join(self.directory, ".columns.lock"))
+
+    def schema(self):
+        """Arrow schema of the whole dataset: every column, then the partition keys"""
+        fields = [pyarrow.field(name, _arrow_type(column_type)) for name, column_type in sorted(self.columns().items())]
+        fields.extend(pyarrow.field(key, pyarrow.string()) for key in self.partition_by)
+        return pyarrow.schema(fields)
+
+    def dataset(self):
+        """pyarrow.dataset.Dataset over every file, with the full schema (for filtered or partial reads)"""
+        partitioning = pyarrow.dataset.partitioning(
+            pyarrow.schema([pyarrow.field(key, pyarrow.string()) for key in self.partition_by]), flavor="hive")
+        return pyarrow.dataset.dataset(self.directory, format="parquet", partitioning=partitioning,
+                                       schema=self.schema())
+
+    def read(self, columns=None, filter=None):
+        """Records of the dataset as one pyarrow Table"""
+        return self.dataset().to_table(columns=columns, filter=filter)
+
+
+class _FileLock(object):
+
+    # exclusive lock between processes (no-op where fcntl is not available)
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class ColumnarExport(object):
+
+    """Records of several ColumnarDatasets (<directory>/<dataset name>) buffered in memory,
+    then appended as one file per dataset by flush: the columnar output of a crawl.
+    Datasets are partitioned by export_date.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._datasets = {}
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, record):
+        with self._lock:
+            self._records.setdefault(name, []).append(record)
+
+    def flush(self):
+        """Appends the buffered records to their datasets
+        Returns:
+            dataset name -> records written
+        """
+        with self._lock:
+            records, self._records = self._records, {}
+
+        written = {}
+        for name, dataset_records in records.items():
+            dataset = self._datasets.get(name)
+            if dataset is None:
+                dataset = ColumnarDataset(os.path.join(self.directory, name), partition_by=("export_date",))
+                self._datasets[name] = dataset
+            dataset.append(dataset_records, {"export_date": datetime.date.today().isoformat()})
+            written[name] = len(dataset_records)
+
+        return written
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import json
+import datetime
+from collections.abc import Mapping
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(text):
+    """json.loads, decoded by orjson when it is installed.
+    Documents orjson refuses (NaN, integers over 64 bits) are decoded by json, so the result
+    is the same with or without it
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+
+    return json.loads(text)
+
+
+def _default(value):
+    # types both encoders are given the same way: mappings and sets of the spiders, dates
+    if isinstance(value, Mapping):
+        return dict(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+
+    raise TypeError("Type is not JSON serializable: " + type(value).__name__)
+
+
+class JSONSerializer(object):
+
+    """Encodes the API responses and the output files. orjson does the encoding when it is
+    installed ("orjson" backend), json otherwise ("json" backend). Both produce UTF-8 with the
+    same separators and indentation. Values orjson can't encode (integers over 64 bits)
+    are encoded by json.
+
+    Attributes:
+        pretty (bool): indent with 2 spaces, one value per line (compact, no whitespace, if False)
+        sort_keys (bool): sort the keys of objects
+        backend (string): "orjson" or "json"
+    """
+
+    def __init__(self, pretty=False, sort_keys=True, backend=None):
+        if backend is None:
+            backend = "orjson" if orjson is not None else "json"
+        if backend == "orjson" and orjson is None:
+            raise ValueError("orjson backend requested but orjson is not installed")
+        if backend not in ("orjson", "json"):
+            raise ValueError("Unknown json backend {}".format(backend))
+
+        self.pretty = pretty
+        self.sort_keys = sort_keys
+        self.backend = backend
+
+        if orjson is not None:
+            self._orjson_options = orjson.OPT_NON_STR_KEYS
+            if pretty:
+                self._orjson_options |= orjson.OPT_INDENT_2
+            if sort_keys:
+                self._orjson_options |= orjson.OPT_SORT_KEYS
+
+    def dumpb(self, value):
+        """value encoded as UTF-8 json bytes"""
+        if self.backend == "orjson":
+            try:
+                return orjson.dumps(value, default=_default, option=self._orjson_options)
+            except orjson.JSONEncodeError:
+                pass
+
+        return self._json_dumps(value).encode("utf-8")
+
+    def dumps(self, value):
+        """value encoded as a json string"""
+        if self.backend == "orjson":
+            return self.dumpb(value).decode("utf-8")
+
+        return self._json_dumps(value)
+
+    def dump(self, value, output):
+        """Writes value to output, a file opened in binary mode"""
+        output.write(self.dumpb(value))
+
+    def _json_dumps(self, value):
+        if self.pretty:
+            return json.dumps(value, default=_default, ensure_ascii=False, sort_keys=self.sort_keys, indent=2)
+
+        return json.dumps(value, default=_default, ensure_ascii=False, sort_keys=self.sort_keys,
+                          separators=(",", ":"))
+
+
+# compact serializer with sorted keys, for callers that need no configuration of their own
+serializer = JSONSerializer()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured, IgnoreRequest
+from twisted.internet import reactor, task, threads
+
+from common.rate_limit import RateLimiter
+from common.proxy_pool import ProxyPool, BAN_STATUS_CODES
+
+
+class RateLimitMiddleware(object):
+
+    """Downloader middleware pacing the requests of a crawl with a RateLimiter (see common.rate_limit):
+    RATE_LIMITS requests per second (and burst) per host and proxy (the proxy meta of the request),
+    RATE_LIMIT_DEFAULT for other hosts. With RATE_LIMIT_PATH set, the buckets are shared with every
+    crawl and service worker pointed at the same file.
+    A request without a token waits in the middleware (the reactor keeps running) until it has one.
+    Tokens of shared buckets are taken on a thread of the reactor pool, so the reactor doesn't wait for
+    the SQLite file.
+    """
+
+    def __init__(self, limiter, stats=None):
+        self.limiter = limiter
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("RATE_LIMIT_ENABLED", True):
+            raise NotConfigured
+
+        return cls(RateLimiter(limits=settings.getdict("RATE_LIMITS"), default=settings.get("RATE_LIMIT_DEFAULT"),
+                               path=settings.get("RATE_LIMIT_PATH")),
+                   stats=crawler.stats)
+
+    def process_request(self, request, spider):
+        if self.limiter.shared:
+            reserved = threads.deferToThread(self.limiter.reserve, request.url, request.meta.get("proxy"))
+            return reserved.addCallback(self._delay)
+
+        return self._delay(self.limiter.reserve(request.url, request.meta.get("proxy")))
+
+    def _delay(self, wait):
+        if wait <= 0:
+            return None
+
+        if self.stats is not None:
+            self.stats.inc_value("rate_limit/requests_delayed")
+            self.stats.inc_value("rate_limit/seconds_waited", wait)
+        # scrapy waits for the returned deferred, then carries on with the request
+        return task.deferLater(reactor, wait, lambda: None)
+
+
+class ProxyPoolMiddleware(object):
+
+    """Downloader middleware sending every request through the healthiest proxy of PROXY_POOL
+    (see common.proxy_pool.ProxyPool), as the proxy meta HttpProxyMiddleware then applies, and telling
+    the pool how the request went. Proxies banned (403, 407, 429) or failing PROXY_FAILURE_THRESHOLD times
+    in a row are quarantined for PROXY_QUARANTINE_SECONDS.
+    Requests given a proxy by the spider keep it. Retried requests get a proxy again.
+    Requests that never reach the proxy (ignored by a later middleware, served from the cache, dropped,
+    or still running when the spider closes) only give their proxy back.
+    Has to come before HttpProxyMiddleware (750) and RateLimitMiddleware, which paces each proxy apart.
+    """
+
+    # meta key of the name of the proxy the pool chose for a request
+    META_KEY = "proxy_pool"
+
+    def __init__(self, pool, stats=None):
+        self.pool = pool
+        self.stats = stats
+        # request -> Proxy chosen for it, until its outcome is recorded
+        self._chosen = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getlist("PROXY_POOL"):
+            raise NotConfigured
+
+        middleware = cls(ProxyPool(settings.getlist("PROXY_POOL"),
+                                   quarantine_seconds=settings.getfloat("PROXY_QUARANTINE_SECONDS", 5 * 60),
+                                   failure_threshold=settings.getint("PROXY_FAILURE_THRESHOLD", 3)),
+                         stats=crawler.stats)
+        crawler.signals.connect(middleware.request_dropped, signal=signals.request_dropped)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def process_request(self, request, spider):
+        if request.meta.get("proxy") and not request.meta.get(self.META_KEY):
+            return None
+
+        # a request coming through again gives back the proxy chosen the last time
+        self._release(request)
+        proxy = self.pool.choose()
+        self._chosen[request] = proxy
+        request.meta["proxy"] = proxy.url
+        request.meta[self.META_KEY] = proxy.name
+        if self.stats is not None:
+            self.stats.inc_value("proxy_pool/requests/{}".format(proxy.name))
+        return None
+
+    def _release(self, request, status=None, error=None, latency=None):
+        # records the outcome of the request (none: the proxy is only given back), once
+        proxy = self._chosen.pop(request, None)
+        if proxy is not None:
+            self.pool.record(proxy, status=status, error=error, latency=latency)
+
+        return proxy
+
+    def process_response(self, request, response, spider):
+        if "cached" in response.flags:
+            # served by the http cache, the proxy was not used
+            self._release(request)
+            return response
+
+        proxy = self._release(request, status=response.status, latency=request.meta.get("download_latency"))
+        if proxy is not None and response.status in BAN_STATUS_CODES and self.stats is not None:
+            self.stats.inc_value("proxy_pool/bans/{}".format(proxy.name))
+        return response
+
+    def process_exception(self, request, exception, spider):
+        if isinstance(exception, IgnoreRequest):
+            # dropped by a later middleware before it was sent
+            self._release(request)
+            return None
+
+        proxy = self._release(request, error=exception)
+        if proxy is not None and self.stats is not None:
+            self.stats.inc_value("proxy_pool/failures/{}".format(proxy.name))
+        return None
+
+    def request_dropped(self, request, spider):
+        self._release(request)
+
+    def spider_closed(self, spider):
+        # downloads cancelled at shutdown
+        for request in list(self._chosen):
+            self._release(request)
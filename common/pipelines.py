@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import os
+import time
+
+from twisted.internet import defer, reactor, task, threads
+
+from common import columnar
+from common.jsonlib import JSONSerializer
+
+
+class BatchedOutputPipeline(object):
+
+    """Item pipeline writing the output files of a crawl in batches, on a thread of the reactor
+    pool, so spider callbacks never wait for the disk. Items are buffered and handed to the writer
+    when OUTPUT_BATCH_SIZE of them are waiting, when the oldest has waited OUTPUT_BATCH_SECONDS,
+    and when the spider closes (the crawl ends once everything is written).
+    Batches are written one at a time, in the order items came. A batch whose write failed is
+    written again OUTPUT_BATCH_SECONDS later (the next batches wait behind it), and only given up
+    after OUTPUT_BATCH_ATTEMPTS attempts.
+
+    Every item is written to its json file (compact unless JSON_OUTPUT_PRETTY) and, if
+    COLUMNAR_EXPORT_DIR is set and pyarrow installed, to columnar datasets: one file per
+    dataset and batch. The columnar records of a batch are added once its json files are written;
+    a failed columnar export is logged, not retried.
+
+    Spiders defining items_written(items) are told of every batch once it is written (to ack
+    the work queue tasks of its items, see common.work_queue.SpiderTasks).
+
+    Subclasses implement outputs(item).
+    """
+
+    def __init__(self, stats=None, batch_size=100, batch_seconds=5.0, pretty=False, columnar_directory=None,
+                 write_attempts=3):
+        self.stats = stats
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self.write_attempts = max(int(write_attempts), 1)
+        self.serializer = JSONSerializer(pretty=pretty)
+        self.columnar_export = None
+        if columnar_directory and columnar.available():
+            self.columnar_export = columnar.ColumnarExport(columnar_directory)
+        self.buffer = []
+        self.oldest = None
+        self.spider = None
+        self._writes = defer.succeed(None)
+        self._timer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(stats=crawler.stats,
+                   batch_size=settings.getint("OUTPUT_BATCH_SIZE", 100),
+                   batch_seconds=settings.getfloat("OUTPUT_BATCH_SECONDS", 5.0),
+                   pretty=settings.getbool("JSON_OUTPUT_PRETTY"),
+                   columnar_directory=settings.get("COLUMNAR_EXPORT_DIR"),
+                   write_attempts=settings.getint("OUTPUT_BATCH_ATTEMPTS", 3))
+
+    def outputs(self, item):
+        """Where item goes
+        Returns:
+            (path of its json file or None, document written to it,
+             name of its columnar dataset or None, its columnar records)
+        """
+        raise NotImplementedError
+
+    def open_spider(self, spider):
+        self.spider = spider
+        self._timer = task.LoopingCall(self._flush_if_due)
+        self._timer.start(max(self.batch_seconds / 2.0, 0.1), now=False)
+
+    def process_item(self, item, spider):
+        if not self.buffer:
+            self.oldest = time.time()
+        self.buffer.append(item)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+        return item
+
+    def close_spider(self, spider):
+        if self._timer is not None and self._timer.running:
+            self._timer.stop()
+        self.flush()
+
+        # scrapy waits for the returned deferred before closing the spider
+        done = defer.Deferred()
+
+        def written(result):
+            done.callback(None)
+            return result
+
+        self._writes.addBoth(written)
+        return done
+
+    def _flush_if_due(self):
+        if self.buffer and time.time() - self.oldest >= self.batch_seconds:
+            self.flush()
+
+    def flush(self):
+        """Hands the buffered items to the writer thread"""
+        batch, self.buffer = self.buffer, []
+        if not batch:
+            return
+
+        # chained after the batch being written, if any
+        self._writes.addCallback(lambda _: self._write(batch, 1))
+        self._writes.addCallbacks(self._batch_written, self._batch_failed)
+
+    def _write(self, batch, attempt):
+        written = threads.deferToThread(self._write_batch, batch)
+        if attempt < self.write_attempts:
+            written.addErrback(self._retry, batch, attempt)
+        return written
+
+    def _retry(self, failure, batch, attempt):
+        if self.stats is not None:
+            self.stats.inc_value("output/batches_retried")
+        if self.spider is not None:
+            self.spider.logger.warning("writing a batch of output failed (attempt %d of %d), retrying: %s",
+                                       attempt, self.write_attempts, failure.getErrorMessage())
+        return task.deferLater(reactor, self.batch_seconds, self._write, batch, attempt + 1)
+
+    def _write_batch(self, batch):
+        columnar_records = []
+        for item in batch:
+            path, document, dataset, records = self.outputs(item)
+            if path is not None:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as output:
+                    self.serializer.dump(document, output)
+            if dataset is not None and self.columnar_export is not None:
+                columnar_records.extend((dataset, record) for record in records)
+
+        if columnar_records:
+            for dataset, record in columnar_records:
+                self.columnar_export.add(dataset, record)
+            # the json files are written: retrying the batch would add its records twice
+            try:
+                self.columnar_export.flush()
+            except Exception as e:
+                if self.spider is not None:
+                    self.spider.logger.error("columnar export of a batch of output failed: %s", e)
+
+        return batch
+
+    def _batch_written(self, batch):
+        if self.stats is not None:
+            self.stats.inc_value("output/items_written", len(batch))
+            self.stats.inc_value("output/batches_written")
+        items_written = getattr(self.spider, "items_written", None)
+        if items_written is not None:
+            # an error here would stop the next batches from being written
+            try:
+                items_written(batch)
+            except Exception as e:
+                self.spider.logger.error("items_written of a batch of output failed: %s", e)
+
+    def _batch_failed(self, failure):
+        # out of attempts: logged, and the next batches are still written. its items are not told to the spider
+        # (items_written), so work queue tasks are not acked and their offices are crawled again
+        if self.stats is not None:
+            self.stats.inc_value("output/batches_failed")
+        if self.spider is not None:
+            self.spider.logger.error("writing a batch of output failed: %s", failure.getErrorMessage())
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import time
+import random
+import threading
+from urllib.parse import urlsplit
+
+# responses telling the proxy was recognised (blocked, throttled or refused by its provider)
+BAN_STATUS_CODES = frozenset([403, 407, 429])
+
+# weight of the last request in the success rate and latency averages
+SMOOTHING = 0.2
+
+
+def _ewma(average, value):
+    return value if average is None else average + SMOOTHING * (value - average)
+
+
+class Proxy(object):
+
+    """One proxy endpoint and its health, as seen by this process
+
+    Attributes:
+        url (string): http://[user:password@]host:port
+        name (string): host:port, the url without its credentials (logs, stats, rate limit buckets)
+        success_rate (float): moving average of the outcomes (1 success, 0 failure or ban)
+        latency (float): moving average of the seconds to a response, None until one came
+        in_flight (int): requests sent through it that have not finished
+        quarantined_until (float): time before which it is only used if every proxy is quarantined
+    """
+
+    def __init__(self, url):
+        self.url = url
+        parts = urlsplit(url)
+        self.name = parts.netloc.rsplit("@", 1)[-1]
+        self.success_rate = 1.0
+        self.latency = None
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.bans = 0
+        self.consecutive_failures = 0
+        self.quarantines = 0
+        self.quarantined_until = 0.0
+
+    @classmethod
+    def from_config(cls, value):
+        """Proxy of a configured endpoint: an url, or a {"host", "port", "apikey"} dict
+        (the api key being the user name, as Crawlera takes it)"""
+        if isinstance(value, dict):
+            credentials = "{}:@".format(value["apikey"]) if value.get("apikey") else ""
+            return cls("http://{}{}:{}".format(credentials, value["host"], value["port"]))
+
+        return cls(value if "://" in value else "http://" + value)
+
+    @property
+    def proxies(self):
+        # proxies argument of requests
+        return {"http": self.url, "https": self.url}
+
+    def score(self, default_latency):
+        # healthiest first: reliable, fast, and not already busy
+        return self.success_rate / ((self.latency or default_latency) * (1 + self.in_flight))
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "failures": self.failures,
+            "bans": self.bans,
+            "success_rate": round(self.success_rate, 3),
+            "latency": None if self.latency is None else round(self.latency, 3),
+            "in_flight": self.in_flight,
+            "quarantines": self.quarantines,
+            "quarantined_for": round(max(self.quarantined_until - time.time(), 0), 1)
+        }
+
+
+class ProxyPool(object):
+
+    """Proxies requests are spread over, each request going to the healthiest one: the best success rate
+    over latency, lowered by the requests already in flight through it (so load spreads over the pool
+    as it grows). A proxy is quarantined for quarantine_seconds after a ban (403, 407, 429) or
+    failure_threshold failures in a row (network errors, 5xx); it comes back with the success rate it
+    had, and earns its share again as it succeeds. If every proxy is quarantined, the one coming out
+    first is used.
+
+    choose() a proxy for a request, then record() how the request went.
+
+    Attributes:
+        proxies (list): Proxy endpoints
+        quarantine_seconds (float): cool-down of a bad proxy
+        failure_threshold (int): failures in a row quarantining a proxy
+    """
+
+    def __init__(self, proxies=(), quarantine_seconds=5 * 60, failure_threshold=3):
+        self.proxies = []
+        self.quarantine_seconds = quarantine_seconds
+        self.failure_threshold = failure_threshold
+        self._lock = threading.Lock()
+        self.configure(proxies=proxies)
+
+    def configure(self, proxies=None, quarantine_seconds=None, failure_threshold=None):
+        """Changes the settings. proxies (urls or dicts, see Proxy.from_config) replaces the endpoints"""
+        with self._lock:
+            if proxies is not None:
+                self.proxies = [proxy if isinstance(proxy, Proxy) else Proxy.from_config(proxy) for proxy in proxies]
+            if quarantine_seconds is not None:
+                self.quarantine_seconds = float(quarantine_seconds)
+            if failure_threshold is not None:
+                self.failure_threshold = int(failure_threshold)
+
+    def __len__(self):
+        return len(self.proxies)
+
+    def choose(self):
+        """Proxy the next request goes through, counted in flight until its outcome is recorded
+        Returns:
+            Proxy, None if the pool is empty
+        """
+        with self._lock:
+            if not self.proxies:
+                return None
+
+            now = time.time()
+            available = [proxy for proxy in self.proxies if proxy.quarantined_until <= now]
+            if not available:
+                available = [min(self.proxies, key=lambda proxy: proxy.quarantined_until)]
+
+            # proxies not timed yet are assumed as fast as the others
+            latencies = [proxy.latency for proxy in self.proxies if proxy.latency is not None]
+            default_latency = sum(latencies) / len(latencies) if latencies else 1.0
+            proxy = max(available, key=lambda proxy: (proxy.score(default_latency), random.random()))
+            proxy.in_flight += 1
+
+        return proxy
+
+    def record(self, proxy, status=None, error=None, latency=None):
+        """Outcome of a request sent through proxy. Neither status nor error: the request was abandoned
+        (cancelled), the proxy is only released
+        Args:
+            status (int): status of the response, None if there was none
+            error (Exception): why there was no response
+            latency (float): seconds until the response
+        """
+        with self._lock:
+            proxy.in_flight = max(proxy.in_flight - 1, 0)
+            if status is None and error is None:
+                return
+
+            proxy.requests += 1
+            if status in BAN_STATUS_CODES:
+                proxy.bans += 1
+                proxy.success_rate = _ewma(proxy.success_rate, 0.0)
+                self._quarantine(proxy)
+            elif error is not None or status >= 500:
+                proxy.failures += 1
+                proxy.consecutive_failures += 1
+                proxy.success_rate = _ewma(proxy.success_rate, 0.0)
+                if proxy.consecutive_failures >= self.failure_threshold:
+                    self._quarantine(proxy)
+            else:
+                # other answers, 404 included, came from the site through a working proxy
+                proxy.consecutive_failures = 0
+                proxy.success_rate = _ewma(proxy.success_rate, 1.0)
+                if latency is not None:
+                    proxy.latency = _ewma(proxy.latency, latency)
+
+    def _quarantine(self, proxy):
+        proxy.quarantines += 1
+        proxy.consecutive_failures = 0
+        proxy.quarantined_until = time.time() + self.quarantine_seconds
+
+    def stats(self):
+        with self._lock:
+            return dict((proxy.name, proxy.stats()) for proxy in self.proxies)
+
+
+# proxies of the scraper fetches of this process (crawler_service passes it to the scrapers)
+proxy_pool = ProxyPool()
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+from urllib.parse import urlsplit
+
+
+def _take(tokens, updated, now, rate, burst):
+    # refill for the time elapsed, then take a token. tokens go below zero when the bucket is empty:
+    # the token is reserved, and the caller waits for it to be refilled
+    tokens = min(float(burst), tokens + max(now - updated, 0.0) * rate) - 1
+    return tokens, (0.0 if tokens >= 0 else -tokens / rate)
+
+
+class MemoryTokenBuckets(object):
+
+    """Token buckets of this process, shared by its threads"""
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """Takes a token from the bucket of key (full when first used)
+        Returns:
+            seconds to wait before sending the request the token was taken for
+        """
+        with self._lock:
+            now = time.time()
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens, wait = _take(tokens, updated, now, rate, burst)
+            self._buckets[key] = (tokens, now)
+
+        return wait
+
+
+class SQLiteTokenBuckets(object):
+
+    """Token buckets shared by every thread and process using the SQLite file at path"""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+
+    def _connection(self):
+        # sqlite connections can't be shared between threads: one per thread
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            # buckets lost to a power cut just start full again
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+
+        return connection
+
+    def take(self, key, rate, burst):
+        connection = self._connection()
+        with connection:
+            # the write lock is taken before reading, so no two requests get the same token
+            connection.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            bucket = connection.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = bucket if bucket is not None else (burst, now)
+            tokens, wait = _take(tokens, updated, now, rate, burst)
+            connection.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                               (key, tokens, now))
+
+        return wait
+
+
+class RateLimiter(object):
+
+    """Paces requests to the sites crawled with a token bucket per (host, proxy): rate requests per
+    second on average, up to burst at once after a quiet period. Buckets are kept in a SQLite file
+    when a path is configured, so every thread and process of the node (service workers, crawls)
+    draws from the same buckets, and in memory otherwise. Every proxy has buckets of its own: a site
+    is sent rate requests per second through each proxy.
+
+    Hosts are looked up in limits, then their parent domains (www.yelp.com, then yelp.com).
+    Other hosts get the default limit, or are not limited if there is none.
+
+    Attributes:
+        limits (dict): host -> (rate, burst)
+        default (tuple): (rate, burst) of the other hosts, None to leave them alone
+        buckets: MemoryTokenBuckets or SQLiteTokenBuckets
+    """
+
+    def __init__(self, limits=None, default=None, path=None):
+        self.limits = {}
+        self.default = None
+        self.buckets = MemoryTokenBuckets()
+        self.requests_limited = 0
+        self.requests_delayed = 0
+        self.seconds_waited = 0.0
+        self._lock = threading.Lock()
+        self.configure(limits=limits, default=default, path=path)
+
+    @staticmethod
+    def _limit(value):
+        # (rate, burst), or a rate alone (burst of 1)
+        if value is None:
+            return None
+        if isinstance(value, (int, float)):
+            return float(value), 1
+        rate, burst = value
+        return float(rate), max(int(burst), 1)
+
+    def configure(self, limits=None, default=None, path=None):
+        if limits is not None:
+            self.limits = {host.lower(): self._limit(limit) for host, limit in limits.items()}
+        if default is not None:
+            self.default = self._limit(default)
+        if path is not None:
+            self.buckets = SQLiteTokenBuckets(path)
+
+    @property
+    def shared(self):
+        # buckets in a SQLite file: taking a token is a write transaction, that may wait for other processes
+        return isinstance(self.buckets, SQLiteTokenBuckets)
+
+    def limit(self, host):
+        """(rate, burst) of host, None if it is not limited"""
+        labels = host.lower().split(":")[0].split(".")
+        for start in range(max(len(labels) - 1, 1)):
+            limit = self.limits.get(".".join(labels[start:]))
+            if limit is not None:
+                return limit
+
+        return self.default
+
+    def reserve(self, url, proxy=None):
+        """Takes a token for a request to url (through proxy, its url or host:port)
+        Returns:
+            seconds to wait before sending it
+        """
+        host = urlsplit(url).netloc.lower()
+        limit = self.limit(host)
+        if limit is None or limit[0] <= 0:
+            return 0.0
+
+        if proxy and "://" in proxy:
+            # the proxy host:port, with or without its credentials, scheme and path
+            proxy = urlsplit(proxy).netloc.rsplit("@", 1)[-1]
+        wait = self.buckets.take("{} {}".format(host, proxy or ""), *limit)
+        with self._lock:
+            self.requests_limited += 1
+            if wait > 0:
+                self.requests_delayed += 1
+                self.seconds_waited += wait
+
+        return wait
+
+    def wait(self, url, proxy=None):
+        """Blocks until a request to url (through proxy) may be sent"""
+        wait = self.reserve(url, proxy)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def wait_async(self, url, proxy=None):
+        """asyncio version of wait. Tokens of shared buckets are taken on a thread of the default executor,
+        so the event loop doesn't wait for the SQLite file"""
+        if self.shared:
+            wait = await asyncio.get_running_loop().run_in_executor(None, self.reserve, url, proxy)
+        else:
+            wait = self.reserve(url, proxy)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def stats(self):
+        return {
+            "shared": self.shared,
+            "requests_limited": self.requests_limited,
+            "requests_delayed": self.requests_delayed,
+            "seconds_waited": round(self.seconds_waited, 2)
+        }
+
+
+# limiter of the scraper fetches of this process (see extract_data.HTTPTransport)
+rate_limiter = RateLimiter()
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import os
+import csv
+import hashlib
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+from common.jsonlib import loads
+
+# columns of the research offices roster
+EXTERNAL_ID = "ID DO NOT CHANGE OR MODIFY"
+YELP_URL = "Yelp URL"
+HEALTHGRADES_URL = "Healthgrades URL"
+
+XLSX_EXTENSIONS = (".xlsx", ".xlsm")
+CSV_EXTENSIONS = (".csv",)
+JSONL_EXTENSIONS = (".jsonl", ".ndjson")
+
+
+def _external_id(value, row):
+    # ids are ints, floats (64.0) or text depending on who saved the file
+    if isinstance(value, int):
+        return value
+    try:
+        if isinstance(value, float):
+            return int(value)
+        text = str(value).strip()
+        try:
+            return int(text)
+        except ValueError:
+            return int(float(text))
+    except (TypeError, ValueError):
+        raise ValueError("Roster row {}: invalid external id {!r}".format(row, value))
+
+
+def parse_shard(value):
+    """Shard of a "i/N" option: the i-th of N shards, 0 <= i < N
+    Returns:
+        (i, N), None if value is empty
+    Raises:
+        ValueError: value is not of that form
+    """
+    if value is None or not str(value).strip():
+        return None
+    try:
+        index, count = (int(part) for part in str(value).split("/"))
+    except ValueError:
+        raise ValueError("Invalid shard {!r}: expected i/N, e.g. 0/4".format(value))
+    if count < 1 or not 0 <= index < count:
+        raise ValueError("Invalid shard {!r}: expected 0 <= i < N".format(value))
+
+    return index, count
+
+
+def shard_of(external_id, count):
+    """Shard (0 to count - 1) an office belongs to, from a hash of its external id: every node
+    and every run gives the same answer, so N nodes split a roster with no coordination"""
+    digest = hashlib.blake2b(str(external_id).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+def _text(value):
+    # empty cells are None in xlsx files and missing keys in jsonl ones
+    return "" if value is None else str(value)
+
+
+class Roster(object):
+
+    """The research offices roster: one office per row, columns looked up by their header.
+    Rows are read lazily, one at a time, from the first sheet of an .xlsx file (read-only mode),
+    a .csv file (header on the first line) or a .jsonl file (one object per line, keys are the
+    columns), so large rosters start being crawled right away and in flat memory.
+    Rows are numbered from 1, the header being row 0.
+
+    Attributes:
+        path (string): roster file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        extension = os.path.splitext(path)[1].lower()
+        if extension not in XLSX_EXTENSIONS + CSV_EXTENSIONS + JSONL_EXTENSIONS:
+            raise ValueError("Unsupported roster format: " + path)
+        self.extension = extension
+
+    def rows(self, columns):
+        """Values of columns in every row
+        Args:
+            columns (list of strings): headers of the columns read
+        Returns:
+            iterator over (row number, tuple of the values of columns), empty rows skipped
+        """
+        if self.extension in JSONL_EXTENSIONS:
+            return self._jsonl_rows(columns)
+        if self.extension in CSV_EXTENSIONS:
+            return self._table_rows(self._csv_rows(), columns)
+
+        return self._table_rows(self._xlsx_rows(), columns)
+
+    def offices(self, url_column, shard=None):
+        """Offices of the roster that have a url in url_column
+        Args:
+            url_column (string): header of the url column
+            shard (tuple): (i, N) to only read the offices of the i-th of N shards (see parse_shard)
+        Returns:
+            iterator over {"row": row number, "external_id": int, "url": string}
+        """
+        for row, (external_id, url) in self.rows([EXTERNAL_ID, url_column]):
+            url = _text(url)
+            if not url:
+                continue
+            external_id = _external_id(external_id, row)
+            if shard is not None and shard_of(external_id, shard[1]) != shard[0]:
+                continue
+            yield {"row": row, "external_id": external_id, "url": url}
+
+    def count(self):
+        """Number of rows, header excluded, told without parsing them: the sheet dimension of xlsx files,
+        the lines of csv and jsonl files. An upper bound of the offices read (offices without url and
+        empty sheet rows are counted, csv values spanning lines are counted once per line)
+        Returns:
+            int, None if the file does not tell (xlsx files saved without their dimension)
+        """
+        if self.extension in XLSX_EXTENSIONS:
+            if openpyxl is None:
+                raise RuntimeError("openpyxl is required to read .xlsx rosters")
+            workbook = openpyxl.load_workbook(self.path, read_only=True)
+            try:
+                max_row = workbook.worksheets[0].max_row
+            finally:
+                workbook.close()
+            return None if max_row is None else max(max_row - 1, 0)
+
+        with open(self.path, 'rb') as roster_file:
+            lines = sum(1 for line in roster_file if line.strip())
+        return lines if self.extension in JSONL_EXTENSIONS else max(lines - 1, 0)
+
+    def _table_rows(self, rows, columns):
+        # rows of xlsx and csv files: positions of the columns are looked up in the header
+        try:
+            header = [_text(name).strip() for name in next(rows)]
+        except StopIteration:
+            return
+        missing = [column for column in columns if column not in header]
+        if missing:
+            raise ValueError("Roster {} has no column {}".format(self.path, ", ".join(missing)))
+
+        positions = [header.index(column) for column in columns]
+        for row, values in enumerate(rows, 1):
+            if not any(value is not None and value != "" for value in values):
+                continue
+            yield row, tuple(values[position] if position < len(values) else None for position in positions)
+
+    def _xlsx_rows(self):
+        if openpyxl is None:
+            raise RuntimeError("openpyxl is required to read .xlsx rosters")
+
+        workbook = openpyxl.load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            for values in workbook.worksheets[0].iter_rows(values_only=True):
+                yield values
+        finally:
+            workbook.close()
+
+    def _csv_rows(self):
+        with open(self.path, newline='', encoding='utf-8-sig') as roster_file:
+            for values in csv.reader(roster_file):
+                yield values
+
+    def _jsonl_rows(self, columns):
+        with open(self.path, 'rb') as roster_file:
+            for row, line in enumerate(roster_file, 1):
+                if not line.strip():
+                    continue
+                values = loads(line)
+                yield row, tuple(values.get(column) for column in columns)
+
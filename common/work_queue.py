@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+
+# task states. ready and leased tasks are "open": they are leased once visible
+READY = "ready"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+# offices inserted per transaction when filling the queue
+PUT_CHUNK_SIZE = 1000
+
+
+def worker_name():
+    """Name of this process in the leases it takes: host and pid"""
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+class WorkQueue(object):
+
+    """Durable queue of crawl tasks, one per (site, office), in a local SQLite file that any number
+    of worker threads and processes share. Tasks outlive the process that queued them: the roster
+    is put in once, then workers lease tasks one at a time and ack or nack them.
+
+    A leased task is invisible to other workers for visibility_timeout seconds. A worker that dies
+    (or hangs) with a task never acks it, so the lease expires and the task is leased again by
+    whoever asks next. Tasks are given up (failed) after max_attempts leases, nacked or expired,
+    so a task that crashes its workers can't go around forever.
+
+    "site" is whoever consumes the task: the site of a /batches batch, or the name of a spider.
+
+    Attributes:
+        path (string): SQLite file
+        visibility_timeout (float): seconds a lease lasts
+        max_attempts (int): leases of a task before it is failed
+    """
+
+    def __init__(self, path, visibility_timeout=10 * 60, max_attempts=5):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.worker = worker_name()
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connection() as connection:
+            # visible_at: when a ready task may be leased (later than queued for nacks with a delay),
+            # when the lease of a leased task expires
+            connection.execute("CREATE TABLE IF NOT EXISTS tasks "
+                               "(id INTEGER PRIMARY KEY, site TEXT NOT NULL, external_id INTEGER NOT NULL, "
+                               "url TEXT NOT NULL, row INTEGER, status TEXT NOT NULL, visible_at REAL NOT NULL, "
+                               "attempts INTEGER NOT NULL DEFAULT 0, lease TEXT, worker TEXT, error TEXT, "
+                               "updated REAL, UNIQUE (site, external_id))")
+            # open tasks in lease order: the next one to lease is the first entry of the site
+            connection.execute("CREATE INDEX IF NOT EXISTS tasks_open ON tasks (site, visible_at, id) "
+                               "WHERE status IN ('ready', 'leased')")
+
+    def _connection(self):
+        # sqlite connections can't be shared between threads: one per thread
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+
+        return connection
+
+    def put(self, site, offices):
+        """Queues a task per office. Offices queued already (same site and external id), whatever
+        their state, are left as they are, so every worker may put the same roster
+        Args:
+            site (string): consumer of the tasks
+            offices (iterable of dicts): {"row", "external_id", "url"}, as Roster.offices returns them
+        Returns:
+            number of tasks added
+        """
+        connection = self._connection()
+        added = 0
+        chunk = []
+        for office in offices:
+            chunk.append(office)
+            if len(chunk) >= PUT_CHUNK_SIZE:
+                added += self._put_chunk(connection, site, chunk)
+                chunk = []
+        if chunk:
+            added += self._put_chunk(connection, site, chunk)
+
+        return added
+
+    @staticmethod
+    def _put_chunk(connection, site, offices):
+        now = time.time()
+        with connection:
+            changes = connection.total_changes
+            connection.executemany("INSERT OR IGNORE INTO tasks (site, external_id, url, row, status, visible_at, "
+                                   "updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                   [(site, office["external_id"], office["url"], office.get("row"), READY, now, now)
+                                    for office in offices])
+            return connection.total_changes - changes
+
+    def lease(self, site, holder=None):
+        """Leases the next visible task of site: the oldest ready one, or one whose lease expired
+        Args:
+            holder (string): prefix of the lease id, to give back the tasks of a holder (see release)
+        Returns:
+            the task {"id", "site", "row", "external_id", "url", "attempts", "lease"} (a batch row),
+            None if no task can be leased now
+        """
+        connection = self._connection()
+        with connection:
+            # the write lock is taken before reading, so two workers never lease the same task
+            connection.execute("BEGIN IMMEDIATE")
+            while True:
+                now = time.time()
+                task = connection.execute("SELECT id, external_id, url, row, status, attempts FROM tasks "
+                                          "WHERE site = ? AND status IN ('ready', 'leased') AND visible_at <= ? "
+                                          "ORDER BY visible_at, id LIMIT 1", (site, now)).fetchone()
+                if task is None:
+                    return None
+
+                task_id, external_id, url, row, status, attempts = task
+                if status == LEASED and attempts >= self.max_attempts:
+                    # its last lease expired: the workers that took it died or hung every time
+                    connection.execute("UPDATE tasks SET status = ?, lease = NULL, error = ?, updated = ? WHERE id = ?",
+                                       (FAILED, "lease expired {} times".format(attempts), now, task_id))
+                    continue
+
+                lease = uuid.uuid4().hex if holder is None else "{}.{}".format(holder, uuid.uuid4().hex)
+                connection.execute("UPDATE tasks SET status = ?, visible_at = ?, attempts = ?, lease = ?, worker = ?, "
+                                   "updated = ? WHERE id = ?",
+                                   (LEASED, now + self.visibility_timeout, attempts + 1, lease, self.worker, now,
+                                    task_id))
+                return {"id": task_id, "site": site, "row": row, "external_id": external_id, "url": url,
+                        "attempts": attempts + 1, "lease": lease}
+
+    def tasks(self, site):
+        """Tasks of site leased one at a time, as they are asked for, until none can be leased
+        Returns:
+            LeasedTasks iterator. Closing it gives back the tasks it handed out that are still leased
+        """
+        return LeasedTasks(self, site)
+
+    def release(self, site, holder):
+        """Gives back the tasks of site still leased by holder (never processed): they are ready again
+        right away, and the lease does not count as an attempt
+        Returns:
+            number of tasks given back
+        """
+        now = time.time()
+        with self._connection() as connection:
+            return connection.execute("UPDATE tasks SET status = ?, visible_at = ?, attempts = attempts - 1, "
+                                      "lease = NULL, updated = ? WHERE site = ? AND status = ? AND lease LIKE ?",
+                                      (READY, now, now, site, LEASED, holder + ".%")).rowcount
+
+    def ack(self, task):
+        """Marks a leased task done
+        Returns:
+            False if the task was leased again by someone else in the meantime (its lease had expired)
+        """
+        with self._connection() as connection:
+            return connection.execute("UPDATE tasks SET status = ?, lease = NULL, error = NULL, updated = ? "
+                                      "WHERE id = ? AND lease = ?",
+                                      (DONE, time.time(), task["id"], task["lease"])).rowcount == 1
+
+    def nack(self, task, error=None, delay=0):
+        """Gives a leased task back: it is leased again after delay seconds,
+        or failed if that was its last attempt
+        Returns:
+            False if the task was leased again by someone else in the meantime (its lease had expired)
+        """
+        now = time.time()
+        with self._connection() as connection:
+            return connection.execute("UPDATE tasks SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, "
+                                      "visible_at = ?, lease = NULL, error = ?, updated = ? WHERE id = ? AND lease = ?",
+                                      (self.max_attempts, FAILED, READY, now + delay,
+                                       None if error is None else str(error), now, task["id"],
+                                       task["lease"])).rowcount == 1
+
+    def available(self, site):
+        """Number of tasks of site that can be leased now"""
+        return self._connection().execute("SELECT COUNT(*) FROM tasks WHERE site = ? AND status IN ('ready', 'leased') "
+                                          "AND visible_at <= ?", (site, time.time())).fetchone()[0]
+
+    def counts(self, site):
+        """Number of tasks of site in each state"""
+        counts = dict.fromkeys((READY, LEASED, DONE, FAILED), 0)
+        counts.update(self._connection().execute("SELECT status, COUNT(*) FROM tasks WHERE site = ? GROUP BY status",
+                                                 (site,)))
+        return counts
+
+    def clear(self, site, status=None):
+        """Deletes the tasks of site (in that state only, if status is given), so their offices can be put again
+        Returns:
+            number of tasks deleted
+        """
+        with self._connection() as connection:
+            if status is None:
+                return connection.execute("DELETE FROM tasks WHERE site = ?", (site,)).rowcount
+            return connection.execute("DELETE FROM tasks WHERE site = ? AND status = ?", (site, status)).rowcount
+
+
+class LeasedTasks(object):
+
+    """Iterator over the tasks of a site, leased one at a time as they are asked for (see WorkQueue.tasks).
+    Tasks read but never processed (rows of a batch that stopped early) stay leased until close gives
+    them back: close it once the tasks read are acked or nacked"""
+
+    def __init__(self, queue, site):
+        self.queue = queue
+        self.site = site
+        self.holder = uuid.uuid4().hex
+        self._exhausted = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        task = None if self._exhausted else self.queue.lease(self.site, self.holder)
+        if task is None:
+            self._exhausted = True
+            raise StopIteration
+        return task
+
+    def close(self):
+        self._exhausted = True
+        return self.queue.release(self.site, self.holder)
+
+
+class SpiderTasks(object):
+
+    """Tasks of a WorkQueue crawled by a Scrapy spider. A task is acked once the item pipeline
+    wrote every item of its office (items_per_task of them, told through written), so offices
+    whose output never reached the disk are crawled again. Items are matched to their task by
+    their external_system_unique_id.
+
+    Attributes:
+        queue (WorkQueue): queue the tasks are leased from
+        site (string): tasks leased, usually the name of the spider
+    """
+
+    def __init__(self, queue, site, items_per_task=1, retry_delay=0):
+        self.queue = queue
+        self.site = site
+        self.items_per_task = items_per_task
+        # seconds before a failed office is leased again
+        self.retry_delay = retry_delay
+        # external id -> [task, items not written yet]
+        self.pending = {}
+
+    def lease(self):
+        """Offices leased one at a time, as the crawl asks for them"""
+        for task in self.queue.tasks(self.site):
+            self.pending[task["external_id"]] = [task, self.items_per_task]
+            yield task
+
+    def written(self, items):
+        for item in items:
+            pending = self.pending.get(item.get("external_system_unique_id"))
+            if pending is None:
+                continue
+            pending[1] -= 1
+            if pending[1] <= 0:
+                del self.pending[pending[0]["external_id"]]
+                self.queue.ack(pending[0])
+
+    def failed(self, external_id, error):
+        pending = self.pending.pop(external_id, None)
+        if pending is not None:
+            self.queue.nack(pending[0], error, delay=self.retry_delay)
+
+    def close(self):
+        """Gives back the tasks whose items were not all written (the crawl was stopped, or they failed)"""
+        for task, items in list(self.pending.values()):
+            self.queue.nack(task, "crawl ended with {} of its items not written".format(items), delay=self.retry_delay)
+        self.pending.clear()
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import re
+import time
+import threading
+
+from lxml import etree
+
+
+class XPathSelector(object):
+
+    """Named XPath expression, compiled once per thread (lxml serializes concurrent
+    evaluations of one compiled expression) and timed on every evaluation.
+    Results are plain strings and elements (no smart strings keeping the tree alive).
+
+    Attributes:
+        name (string): name the selector is registered under
+        expression (string): XPath expression
+        calls (int): evaluations so far
+        seconds (float): total time spent evaluating it
+    """
+
+    def __init__(self, name, expression):
+        self.name = name
+        self.expression = expression
+        self.calls = 0
+        self.seconds = 0.0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # compile right away, so a broken expression fails at import time
+        self._compiled()
+
+    def _compiled(self):
+        compiled = getattr(self._local, "compiled", None)
+        if compiled is None:
+            compiled = etree.XPath(self.expression, smart_strings=False)
+            self._local.compiled = compiled
+
+        return compiled
+
+    def __call__(self, node, **variables):
+        compiled = self._compiled()
+        time_start = time.perf_counter()
+        try:
+            return compiled(node, **variables)
+        finally:
+            elapsed = time.perf_counter() - time_start
+            with self._lock:
+                self.calls += 1
+                self.seconds += elapsed
+
+
+class XPathRegistry(object):
+
+    """Process-wide registry of the named selectors used by the scrapers and the spiders"""
+
+    def __init__(self):
+        self._selectors = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, expression):
+        with self._lock:
+            selector = self._selectors.get(name)
+            if selector is not None:
+                if selector.expression != expression:
+                    raise ValueError("XPath selector {} is already registered with another expression".format(name))
+                return selector
+
+            selector = XPathSelector(name, expression)
+            self._selectors[name] = selector
+
+        return selector
+
+    def __getitem__(self, name):
+        return self._selectors[name]
+
+    def stats(self):
+        """Evaluations and time spent per selector, hottest first"""
+        selectors = sorted(self._selectors.values(), key=lambda selector: selector.seconds, reverse=True)
+        return [{
+            "name": selector.name,
+            "calls": selector.calls,
+            "seconds": round(selector.seconds, 6),
+            "mean_microseconds": round(selector.seconds / selector.calls * 1e6, 1) if selector.calls else None
+        } for selector in selectors]
+
+
+# selectors shared by every scraper and spider of this process
+registry = XPathRegistry()
+
+
+def select(name, node, **variables):
+    """Evaluates the registered selector name on node (an lxml document or element)"""
+    return registry[name](node, **variables)
+
+
+def extract(value):
+    """Text of a selector result, elements serialized as html (as scrapy's extract does)"""
+    if isinstance(value, str):
+        return value
+
+    return etree.tostring(value, method="html", encoding="unicode", with_tail=False)
+
+
+def extract_first(values, default=None):
+    return extract(values[0]) if values else default
+
+
+def re_all(pattern, values):
+    """Matches of pattern in every result, flattened (as scrapy's SelectorList.re does)"""
+    matches = []
+    for value in values:
+        matches.extend(re.findall(pattern, extract(value)))
+
+    return matches
+
+
+##########################################
+############### YELP (YelpScraper)
+##########################################
+
+register = registry.register
+
+register("yelp.og_type", '//meta[@property="og:type"]/@content')
+register("yelp.ld_json", "//script[@type='application/ld+json']/text()")
+register("yelp.hours_rows", "//table[@class='table table-simple hours-table']/tbody/tr")
+register("yelp.hours_row_day", "./th/text()")
+register("yelp.hours_row_cells", "./td")
+# what lxml.html's text_content() returns, for trees of any element class
+register("yelp.text_content", "string()")
+register("yelp.phone", "//span[@class='biz-phone']/text()")
+register("yelp.website", "//span[contains(@class, 'biz-website')]//a/text()")
+register("yelp.biz_id", "//meta[@name='yelp-biz-id']/@content")
+register("yelp.showcase_photos", "//div[@class='showcase-photos']/div")
+register("yelp.photo_caption", ".//div[@class='photo-box-overlay_caption']/text()")
+register("yelp.img_src", ".//img/@src")
+
+##########################################
+############### YELP REVIEWS (YelpSpider)
+##########################################
+
+register("yelp_reviews.reviews", '//div[@class="review-list"]/ul/li')
+register("yelp_reviews.photo_grids", ".//ul[@class='photo-box-grid']")
+register("yelp_reviews.photo_boxes", ".//div[@class='photo-box']/div")
+register("yelp_reviews.photo_offscreen", ".//span[@class='offscreen']/text()")
+register("yelp_reviews.reviewer_name", './/div[contains(@class, "review--with-sidebar")]//li[@class="user-name"]/a/text()')
+register("yelp_reviews.stars_title", './/div[@class="review-content"]//div[contains(@class, "i-stars")]/@title')
+register("yelp_reviews.rating_date", './/div[@class="review-content"]//span[@class="rating-qualifier"]/text()')
+register("yelp_reviews.content", './/div[@class="review-content"]/p/text()')
+
+##########################################
+############### HEALTHGRADES (HealthgradesSpider)
+##########################################
+
+register("healthgrades.name", '//h1[@itemprop="name"]/text()')
+register("healthgrades.hero_name", '//div[@class="summary-hero-address"]/h1/text()')
+register("healthgrades.gender", '//div[@class="provider-gender"]/span[1]/text()')
+register("healthgrades.age", '//div[@class="provider-age"]/span/text()')
+register("healthgrades.speciality", '//div[@class="provider-speciality"]/span[1]/text()')
+register("healthgrades.specialty", '//p[@class="specialty"]/text()')
+register("healthgrades.about_me", '//li[@class="about-me-listitem"]/text()')
+register("healthgrades.school_name", '//div[@class="education-completed"]/text()')
+register("healthgrades.school_since", '//div[@class="timeline-date-mobile"]/text()')
+register("healthgrades.phone_link", '//ul[@class="sr-only"]//a[@class="hg-track"]/@href')
+register("healthgrades.phone_tel", '//a[@class="tel"]/text()')
+register("healthgrades.phone_number", '//div[@class="phone-number"]/a[@class="hg-track"]/text()')
+register("healthgrades.street_address_p", '//p[@itemprop="streetAddress"]/text()')
+register("healthgrades.street_address_span", '//span[@itemprop="streetAddress"]/text()')
+register("healthgrades.city", '//span[@itemprop="addressLocality"]/text()')
+register("healthgrades.state", '//span[@itemprop="addressRegion"]/text()')
+register("healthgrades.zip", '//span[@itemprop="postalCode"]/text()')
+register("healthgrades.bio", '//span[@class="generated-bio"]/text()')
+register("healthgrades.about_us", '//div[@class="about-us learnAboutSection"]/ul/li/p/text()')
+register("healthgrades.awards_summary", '//div[contains(@class, "summary-awards")]/p[@class="graph-text"]/text()')
+register("healthgrades.insurances", '//ul[contains(@class, "insurance-list")]/li/text()')
+register("healthgrades.provider_links", '//div[@class="provider-wrap__view-profile"]/a/@href')
+register("healthgrades.overall_rating", '//div[@class="overall-rating"]/p/strong/text()')
+register("healthgrades.rating_labels", '//span[@class="rating-labels"]/span/text()')
+register("healthgrades.procedures", '//ul[@class="services-list col3List"]/li/text()')
+register("healthgrades.languages", '//div[contains(@class, "language-services")]/ul/li/text()')
+register("healthgrades.hours", '//div[@class="disclaimer-tooltip"]/ul/li')
+register("healthgrades.text", './text()')
+register("healthgrades.awards_category", '//div[@class="awards-text"]/h2/text()')
+register("healthgrades.awards_list", '//ul[@class="hg3-awards"]/li/meta/@content')
+register("healthgrades.overall_ratio", '//div[@class="columns medium main-graph-radial-data"]/@data-outer-percent')
+register("healthgrades.clinical_overlays", '//div[@class="clinical-quality-overlay hg3-overlay"]')
+register("healthgrades.clinical_category", './/div[@class="overlay-header"]/h2/text()')
+register("healthgrades.clinical_grid_containers", './/div[@class="clinical-overlay-grid-container"]')
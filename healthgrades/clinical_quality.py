@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+from common.xpaths import select
+
+GRID_CLASS = "hg3-clinical-quality-grid"
+ROW_CLASS = "clpseable"
+ACTUAL_CLASS = "row inner js-clpse hidden actual-num"
+PREDICTED_CLASS = "row inner js-clpse hidden predicted-num"
+NUMBER_CLASS = "tb-col number"
+
+
+def _texts(element):
+    # text nodes directly under element, as "element/text()" returns them
+    texts = [element.text] if element.text is not None else []
+    texts.extend(child.tail for child in element if child.tail is not None)
+    return texts
+
+
+def _numbers(number_row):
+    # "number_row/div[@class="tb-col number"]/text()"
+    numbers = []
+    for number in number_row:
+        if number.tag == "div" and number.get("class") == NUMBER_CLASS:
+            numbers.extend(_texts(number))
+    return numbers
+
+
+def _first(values):
+    return values[0] if values else None
+
+
+def cell(values, index):
+    """Value index of a column (actual, predicted) of a row, None if the row has no such cell"""
+    return values[index] if index < len(values) else None
+
+
+class ClinicalQualityRow(object):
+
+    """One rating of a clinical quality grid (a "clpseable" div), read in a single walk over it.
+    Lists hold what the per row xpath selectors returned, in document order.
+
+    Attributes:
+        titles (list): text of the h6 title
+        descriptions (list): every text of the based-rating paragraph
+        actual (list): actual-num cells, hospital (or first) value then national
+        predicted (list): predicted-num cells, same columns
+        questions (list): explanation headline text
+        answers (list): text of the first paragraph of the explanation summary
+    """
+
+    def __init__(self, row):
+        self.titles = []
+        self.descriptions = []
+        self.actual = []
+        self.predicted = []
+        self.questions = []
+        self.answers = []
+
+        # lxml filters the tags while walking, only candidates reach python
+        for element in row.iter("h6", "p", "div"):
+            element_class = element.get("class")
+            if element_class is None:
+                continue
+            tag = element.tag
+            if tag == "h6":
+                if element_class == "title":
+                    self.titles.extend(_texts(element))
+            elif tag == "p":
+                if element_class == "based-rating":
+                    # as "//text()": texts of the paragraph and its descendants, comments left out
+                    self.descriptions.extend(element.itertext())
+            elif element_class == ACTUAL_CLASS:
+                self.actual.extend(_numbers(element))
+            elif element_class == PREDICTED_CLASS:
+                self.predicted.extend(_numbers(element))
+            elif element_class == "explanation":
+                self._add_explanation(element)
+
+    def _add_explanation(self, explanation):
+        for child in explanation:
+            if child.tag == "h3" and child.get("class") == "headline":
+                self.questions.extend(_texts(child))
+            elif child.tag == "div" and child.get("class") == "summary":
+                paragraph = next((p for p in child if p.tag == "p"), None)
+                if paragraph is not None:
+                    self.answers.extend(_texts(paragraph))
+
+    @property
+    def title(self):
+        return _first(self.titles)
+
+    @property
+    def description(self):
+        return ''.join(self.descriptions)
+
+    @property
+    def question(self):
+        return _first(self.questions)
+
+    @property
+    def answer(self):
+        return _first(self.answers)
+
+
+class ClinicalQualityGrids(object):
+
+    """Rows of the mortality and complication grids of a clinical quality overlay, every grid
+    read once into ClinicalQualityRows (row/column arrays). In every grid container, the mortality
+    grid is the first hg3-clinical-quality-grid and the complication grid the second div.
+
+    Attributes:
+        mortalities (list): ClinicalQualityRows of the mortality grids
+        complications (list): ClinicalQualityRows of the complication grids
+    """
+
+    def __init__(self, overlay):
+        self.mortalities = []
+        self.complications = []
+
+        for container in select("healthgrades.clinical_grid_containers", overlay):
+            grids = [child for child in container if child.tag == "div"]
+            mortality_grid = next((grid for grid in grids if grid.get("class") == GRID_CLASS), None)
+            if mortality_grid is not None:
+                self.mortalities.extend(self._rows(mortality_grid))
+            if len(grids) > 1:
+                self.complications.extend(self._rows(grids[1]))
+
+    @staticmethod
+    def _rows(grid):
+        return [ClinicalQualityRow(row) for row in grid
+                if row.tag == "div" and ROW_CLASS in (row.get("class") or "")]
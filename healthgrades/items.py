@@ -9,6 +9,34 @@ import scrapy
 
 
 class HealthgradesItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+    # business of a provider, written to spiders/output/business-<external_system_unique_id>.json
+    external_system_unique_id = scrapy.Field()
+    Business_Title = scrapy.Field()
+    Gender = scrapy.Field()
+    Birthday = scrapy.Field()
+    Age = scrapy.Field()
+    Business_Categories = scrapy.Field()
+    Office_Providers = scrapy.Field()
+    # profile links of the office providers that could not be fetched or parsed
+    Office_Providers_Failed = scrapy.Field()
+    Website = scrapy.Field()
+    Procedures = scrapy.Field()
+    Languages = scrapy.Field()
+    Specialities = scrapy.Field()
+    Education = scrapy.Field()
+    Awards = scrapy.Field()
+    Business_Contacts = scrapy.Field()
+    Address = scrapy.Field()
+    Reviews = scrapy.Field()
+    Clinical_Quality_Ratings = scrapy.Field()
+    Business_Hours = scrapy.Field()
+    Memo = scrapy.Field()
+    Insurances = scrapy.Field()
+
+
+class HealthgradesReviewsItem(scrapy.Item):
+    # reviews of a provider, written to spiders/Review/output/reviews-<external_system_unique_id>.json
+    external_system_unique_id = scrapy.Field()
+    reviews = scrapy.Field()
+    total_reviews = scrapy.Field()
+    total_average_rating = scrapy.Field()
@@ -5,7 +5,27 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://doc.scrapy.org/en/latest/topics/item-pipeline.html
 
+import os
 
-class HealthgradesPipeline(object):
-    def process_item(self, item, spider):
-        return item
+from common.pipelines import BatchedOutputPipeline
+from healthgrades.items import HealthgradesReviewsItem
+
+spiders_dir_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'spiders')
+
+
+class HealthgradesPipeline(BatchedOutputPipeline):
+
+    """Writes the business and reviews items of HealthgradesSpider, in batches (see BatchedOutputPipeline)"""
+
+    def outputs(self, item):
+        external_id = item['external_system_unique_id']
+        if isinstance(item, HealthgradesReviewsItem):
+            return (os.path.join(spiders_dir_path, 'Review', 'output', 'reviews-' + str(external_id) + '.json'),
+                    dict(item), "reviews",
+                    [dict(review, external_system_unique_id=external_id) for review in item['reviews']])
+
+        # the business files don't repeat the id of their name
+        business = dict(item)
+        del business['external_system_unique_id']
+        return (os.path.join(spiders_dir_path, 'output', 'business-' + str(external_id) + '.json'), business,
+                "businesses", [dict(item)])
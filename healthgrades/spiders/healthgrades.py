@@ -1,41 +1,53 @@
 # -*- coding: utf-8 -*-#
 from __future__ import absolute_import, division, unicode_literals
 
-import json
-
 import scrapy
 import re
-import requests
-import xlrd
 from urllib.parse import urljoin
-from lxml import html
-
-import os
-
-base_dir_path = os.path.dirname(os.path.realpath(__file__))
-
-
-class HealthgradesItem(scrapy.Item):
-    Business_Title = scrapy.Field()
-    Gender = scrapy.Field()
-    Birthday = scrapy.Field()
-    Age = scrapy.Field()
-    Business_Categories = scrapy.Field()
-    Office_Providers = scrapy.Field()
-    Website = scrapy.Field()
-    Procedures = scrapy.Field()
-    Languages = scrapy.Field()
-    Specialities = scrapy.Field()
-    Education = scrapy.Field()
-    Awards = scrapy.Field()
-    Business_Contacts = scrapy.Field()
-    Address = scrapy.Field()
-    Reviews = scrapy.Field()
-    Clinical_Quality_Ratings = scrapy.Field()
-    Business_Hours = scrapy.Field()
-    Memo = scrapy.Field()
-    Insurances = scrapy.Field()
-    pass
+
+from common.xpaths import select, re_all, registry as xpath_registry
+from common.roster import Roster, HEALTHGRADES_URL, parse_shard
+from common.work_queue import WorkQueue, SpiderTasks
+from healthgrades.items import HealthgradesItem, HealthgradesReviewsItem
+from healthgrades.clinical_quality import ClinicalQualityGrids, cell
+
+
+class OfficeProviders(object):
+
+    """
+    Office providers of a business item, gathered from their profile pages (fetched concurrently,
+    in any order). The item is complete once every profile came in: providers keep the order of
+    the business page, and the links of the profiles that failed (download or parsing) are listed
+    in Office_Providers_Failed instead.
+    """
+
+    def __init__(self, item, links):
+        self.item = item
+        self.links = links
+        self.providers = [None] * len(links)
+        self.pending = len(links)
+        self.item['Office_Providers'] = []
+
+    def complete(self):
+        return self.pending == 0
+
+    def add(self, index, provider):
+        """
+
+        :param index: index of the profile link
+        :param provider: provider of the profile, None if it failed
+        :return: whether the item is complete
+        """
+        self.providers[index] = provider
+        self.pending -= 1
+        if self.pending:
+            return False
+
+        self.item['Office_Providers'] = [provider for provider in self.providers if provider is not None]
+        failed = [link for link, provider in zip(self.links, self.providers) if provider is None]
+        if failed:
+            self.item['Office_Providers_Failed'] = failed
+        return True
 
 
 class HealthgradesSpider(scrapy.Spider):
@@ -50,6 +62,26 @@ class HealthgradesSpider(scrapy.Spider):
     header = {
         'User-Agent': 'Slackbot-LinkExpanding 1.0 (+https://api.slack.com/robots)'
     }
+    # "i/N" (scrapy crawl healthgrades_crawler -a shard=i/N) to only crawl the i-th of N shards of the roster
+    shard = None
+    # "1" (-a queue=1) to crawl the offices leased from the work queue (WORK_QUEUE_PATH) instead of the roster
+    # directly: any number of crawls can then share the roster, and offices of a crawl that died are crawled again
+    queue = None
+
+    def __init__(self, *args, **kwargs):
+        super(HealthgradesSpider, self).__init__(*args, **kwargs)
+        # (i, N), a malformed value stops the crawl before it starts
+        self.shard = parse_shard(self.shard)
+        self.queue = self.queue not in (None, '', '0')
+        # SpiderTasks of the work queue, set when the crawl starts
+        self.tasks = None
+
+    def closed(self, reason):
+        if self.tasks is not None:
+            self.tasks.close()
+        # hottest xpath selectors of the crawl
+        for selector_stats in xpath_registry.stats()[:10]:
+            self.logger.info("xpath %(name)s: %(calls)s calls, %(seconds)s s", selector_stats)
 
     def start_requests(self):
         """
@@ -57,14 +89,38 @@ class HealthgradesSpider(scrapy.Spider):
         :return:
         """
 
-        file = xlrd.open_workbook(base_dir_path + "/Research Offices.xlsx")
-        sheet = file.sheet_by_index(0)
-        for cell in range(1, sheet.nrows):
-            external_id = int(sheet.row_values(cell)[0])
-            url = str(sheet.row_values(cell)[10])
-            if url:
-                yield scrapy.Request(url=url, callback=self.parse_product, dont_filter=True, headers=self.header,
-                                     meta={'ext_id': external_id})
+        # offices are read lazily from the roster (ROSTER_PATH), requested as they are read
+        roster = Roster(self.settings.get("ROSTER_PATH"))
+        offices = roster.offices(HEALTHGRADES_URL, shard=self.shard)
+        if self.queue:
+            # the roster is queued (offices queued by an earlier crawl are left as they are), then offices are leased
+            # as they are requested. an office is acked once its business and reviews items are written
+            work_queue = WorkQueue(self.settings.get("WORK_QUEUE_PATH"),
+                                   visibility_timeout=self.settings.getfloat("WORK_QUEUE_VISIBILITY_TIMEOUT", 600),
+                                   max_attempts=self.settings.getint("WORK_QUEUE_MAX_ATTEMPTS", 5))
+            work_queue.put(self.name, offices)
+            self.tasks = SpiderTasks(work_queue, self.name, items_per_task=2,
+                                     retry_delay=self.settings.getfloat("WORK_QUEUE_RETRY_DELAY", 60))
+            offices = self.tasks.lease()
+
+        for office in offices:
+            yield scrapy.Request(url=office['url'], callback=self.parse_product, errback=self.office_failed,
+                                 dont_filter=True, headers=self.header, meta={'ext_id': office['external_id']})
+
+    def office_failed(self, failure):
+        """
+
+        :param failure: failure of a business page request
+        """
+        request = failure.request
+        self.logger.warning('Business page %s failed: %s', request.url, failure.getErrorMessage())
+        if self.tasks is not None:
+            self.tasks.failed(request.meta['ext_id'], failure.getErrorMessage())
+
+    def items_written(self, items):
+        # called by the item pipeline once items are on disk
+        if self.tasks is not None:
+            self.tasks.written(items)
 
     def parse_product(self, response):
         """
@@ -72,10 +128,10 @@ class HealthgradesSpider(scrapy.Spider):
         :param response:
         :return:
         """
-        # Meta data import calling
-        self.get_meta_data(response)
+        # Meta data import calling, the item is yielded once its office providers are in
+        yield from self.get_office_providers(response, self.get_meta_data(response))
         # Review data import calling
-        self.get_reviews(response)
+        yield self.get_reviews(response)
 
     def get_reviews(self, response):
         """
@@ -176,12 +232,73 @@ class HealthgradesSpider(scrapy.Spider):
             "total_average_rating": avg_rating[0] if avg_rating else None,
         }
 
-        # filename = base_dir_path + '/Review/output/' + 'reviews-' + str(self.review_count) + '.json'
-        filename = base_dir_path + '/Review/output/' + 'reviews-' + str(response.meta['ext_id']) + '.json'
-        with open(filename, 'w+') as output:
-            json.dump(result, output, indent=4, sort_keys=True)
         self.review_count += 1
-        return response
+        # written by HealthgradesPipeline
+        return HealthgradesReviewsItem(result)
+
+    def get_office_providers(self, response, item):
+        """
+        Requests the profiles of the office providers of the business, all at once
+
+        :param response: business page
+        :param item: business item, its Office_Providers are filled in by the profile callbacks
+        :return: profile requests, or the item if the business lists no provider
+        """
+        links = [urljoin(response.url, link) for link in select("healthgrades.provider_links", response.selector.root)]
+        providers = OfficeProviders(item, links)
+        if not links:
+            yield item
+            return
+
+        # ahead of the business pages, so items are not held waiting for their providers
+        for index, link in enumerate(links):
+            yield scrapy.Request(url=link, callback=self.parse_provider, errback=self.provider_failed,
+                                 dont_filter=True, headers=self.header, priority=1,
+                                 meta={'office_providers': providers, 'provider_index': index})
+
+    def parse_provider(self, response):
+        """
+
+        :param response: profile page of an office provider
+        :return: the business item, if this was its last provider
+        """
+        providers = response.meta['office_providers']
+        index = response.meta['provider_index']
+        data = response.selector.root
+        try:
+            doctor_name = select("healthgrades.name", data)
+            specialization = select("healthgrades.bio", data)
+            average_rating = select("healthgrades.overall_rating", data)
+            total_reviews = select("healthgrades.rating_labels", data)
+            total = None
+            if total_reviews:
+                total = re.search('(\d+)', total_reviews[0], re.DOTALL)
+
+            provider = {
+                'Business Title': doctor_name[0],
+                'Business Categories': specialization[0],
+                'Profile Link': providers.links[index],
+                'Average Rating': average_rating[0] if average_rating else None,
+                'Total Reviews': total.group(1) if total else None,
+            }
+        except IndexError:
+            self.logger.warning('Error while parsing overview content of %s', providers.links[index])
+            provider = None
+
+        if providers.add(index, provider):
+            yield providers.item
+
+    def provider_failed(self, failure):
+        """
+
+        :param failure: failure of a profile request
+        :return: the business item, if this was its last provider
+        """
+        request = failure.request
+        self.logger.warning('Office provider profile %s failed: %s', request.url, failure.getErrorMessage())
+        providers = request.meta['office_providers']
+        if providers.add(request.meta['provider_index'], None):
+            yield providers.item
 
     def get_meta_data(self, response):
         """
@@ -189,32 +306,31 @@ class HealthgradesSpider(scrapy.Spider):
         :param response:
         :return:
         """
-        # item = HealthgradesItem()
-        item = {}
-        # item['external_system_unique_id'] = response.meta['ext_id']
-
+        item = HealthgradesItem()
+        item['external_system_unique_id'] = response.meta['ext_id']
+        page = response.selector.root
 
-        business_title = response.xpath('//h1[@itemprop="name"]/text()').extract()
+        business_title = select("healthgrades.name", page)
         if not business_title:
-            business_title = response.xpath('//div[@class="summary-hero-address"]/h1/text()').extract()
+            business_title = select("healthgrades.hero_name", page)
         # item['Business_Title'] = business_title[0] if business_title else None
         bus_title = business_title[0] if business_title else None
 
-        gender = response.xpath('//div[@class="provider-gender"]/span[1]/text()').extract()
+        gender = select("healthgrades.gender", page)
         # item['Gender'] = gender[0] if gender else None
         gen = gender[0] if gender else None
 
-        age = response.xpath('//div[@class="provider-age"]/span/text()').re('\d+')
+        age = re_all('\d+', select("healthgrades.age", page))
         # item['Age'] = age[0] if age else None
         p_age = age[0] if age else None
 
-        business_categories = response.xpath('//div[@class="provider-speciality"]/span[1]/text()').extract()
+        business_categories = select("healthgrades.speciality", page)
         if not business_categories:
-            business_categories = response.xpath('//p[@class="specialty"]/text()').extract()
+            business_categories = select("healthgrades.specialty", page)
         # item['Business_Categories'] = business_categories[0] if business_categories else None
         bus_cat = business_categories[0] if business_categories else None
 
-        category_name = response.xpath('//li[@class="about-me-listitem"]/text()').extract()
+        category_name = select("healthgrades.about_me", page)
         category_name = category_name[0] if category_name else None
         category = {
             'Name': category_name,
@@ -229,8 +345,8 @@ class HealthgradesSpider(scrapy.Spider):
             'Expertise Skills': None
         }
 
-        school_name = response.xpath('//div[@class="education-completed"]/text()').extract()
-        school_since = response.xpath('//div[@class="timeline-date-mobile"]/text()').extract()
+        school_name = select("healthgrades.school_name", page)
+        school_since = select("healthgrades.school_since", page)
         # item['Education'] = {
         #     'School Name': school_name[0] if school_name else None,
         #     'Department': None,
@@ -245,11 +361,11 @@ class HealthgradesSpider(scrapy.Spider):
         }
 
         # office_phone = response.xpath('//a[@id="phone-summary-click"]/text()').extract()
-        office_phone = response.xpath('//ul[@class="sr-only"]//a[@class="hg-track"]/@href').extract()
+        office_phone = select("healthgrades.phone_link", page)
         if not office_phone:
-            office_phone = response.xpath('//a[@class="tel"]/text()').extract()
+            office_phone = select("healthgrades.phone_tel", page)
         if not office_phone:
-            office_phone = response.xpath('//div[@class="phone-number"]/a[@class="hg-track"]/text()').extract()
+            office_phone = select("healthgrades.phone_number", page)
         # item['Business_Contacts'] = {
         #     'Office Phone': office_phone[0].replace('tel:', '') if office_phone else None,
         #     'Mobile Phone': None,
@@ -263,12 +379,12 @@ class HealthgradesSpider(scrapy.Spider):
             'Fax': None
         }
 
-        address = response.xpath('//p[@itemprop="streetAddress"]/text()').extract()
+        address = select("healthgrades.street_address_p", page)
         if not address:
-            address = response.xpath('//span[@itemprop="streetAddress"]/text()').extract()
-        city = response.xpath('//span[@itemprop="addressLocality"]/text()').extract()
-        state = response.xpath('//span[@itemprop="addressRegion"]/text()').extract()
-        zip = response.xpath('//span[@itemprop="postalCode"]/text()').extract()
+            address = select("healthgrades.street_address_span", page)
+        city = select("healthgrades.city", page)
+        state = select("healthgrades.state", page)
+        zip = select("healthgrades.zip", page)
         # item['Address'] = {
         #     'Address': address[0] if address else None,
         #     'City': city[0] if city else None,
@@ -285,15 +401,15 @@ class HealthgradesSpider(scrapy.Spider):
             'Lat/Lng': None,
             'Locatioon Alias/URL': None
         }
-        memo = response.xpath('//span[@class="generated-bio"]/text()').extract()
+        memo = select("healthgrades.bio", page)
         if not memo:
-            memo = response.xpath('//div[@class="about-us learnAboutSection"]/ul/li/p/text()').extract()
+            memo = select("healthgrades.about_us", page)
         if not memo:
-            memo = response.xpath('//div[contains(@class, "summary-awards")]/p[@class="graph-text"]/text()').extract()
+            memo = select("healthgrades.awards_summary", page)
         # item['Memo'] = memo[0] if memo else None
         mem = memo[0] if memo else None
 
-        insurance_items = response.xpath('//ul[contains(@class, "insurance-list")]/li/text()').extract()
+        insurance_items = select("healthgrades.insurances", page)
         # item['Insurances'] = {
         #     'Brand': None,
         #     'Insurance Items': insurance_items
@@ -303,62 +419,18 @@ class HealthgradesSpider(scrapy.Spider):
             'Insurance Items': insurance_items
         }
 
-        # Office providere
-        overview_links = response.xpath('//div[@class="provider-wrap__view-profile"]/a/@href').extract()
-        overview_list = []
-        for link in overview_links:
-            try:
-                data = requests.get(urljoin(response.url, link))
-                data = html.fromstring(data.text)
-
-                doctor_name = data.xpath('//h1[@itemprop="name"]/text()')
-                specialization = data.xpath('//span[@class="generated-bio"]/text()')
-                # phone = data.xpath('//a[@id="phone-summary-click"]/text()')
-                # business_name = data.xpath('//div[@class="standard-address"]/h3/text()')
-                # address = data.xpath('//p[@itemprop="streetAddress"]/text()')
-                # city = data.xpath('//span[@itemprop="addressLocality"]/text()')
-                # state = data.xpath('//span[@itemprop="addressRegion"]/text()')
-                # zip = data.xpath('//span[@itemprop="postalCode"]/text()')
-                average_rating = data.xpath('//div[@class="overall-rating"]/p/strong/text()')
-                total_reviews = data.xpath('//span[@class="rating-labels"]/span/text()')
-                total = None
-                if total_reviews:
-                    total = re.search('(\d+)', total_reviews[0], re.DOTALL)
-
-                overview_list.append(
-                    {
-                        'Business Title': doctor_name[0],
-                        'Business Categories': specialization[0],
-                        'Profile Link': urljoin(response.url, link),
-                        'Average Rating': average_rating[0] if average_rating else None,
-                        'Total Reviews': total.group(1) if total else None,
-                        # 'Phone number': phone[0],
-                        # 'Business name': business_name[0],
-                        # 'Address': address[0],
-                        # 'City': city[0],
-                        # 'State': state[0],
-                        # 'Zip': zip[0]
-                    }
-                )
-
-            except IndexError:
-                print('Error while parsing overview content')
-
-        # item['Office_Providers'] = overview_list
-        office_prov = overview_list
-
-        procedures = response.xpath('//ul[@class="services-list col3List"]/li/text()').extract()
+        procedures = select("healthgrades.procedures", page)
         # item['Procedures'] = procedures
         proced = procedures
 
-        languages = response.xpath('//div[contains(@class, "language-services")]/ul/li/text()').extract()
+        languages = select("healthgrades.languages", page)
         # item['Languages'] = languages
         lang = languages
 
-        business_hours = response.xpath('//div[@class="disclaimer-tooltip"]/ul/li')
+        business_hours = select("healthgrades.hours", page)
         hour_list = []
         for hour in business_hours:
-            hours = hour.xpath('./text()').extract()
+            hours = select("healthgrades.text", hour)
             hour_list.append(' '.join(hours))
         # item['Business_Hours'] = {
         #     'Monday': hour_list[0] if hour_list else None,
@@ -379,8 +451,8 @@ class HealthgradesSpider(scrapy.Spider):
             'Sunday': hour_list[6] if hour_list else None
         }
 
-        awards = response.xpath('//div[@class="awards-text"]/h2/text()').extract()
-        awards_list = response.xpath('//ul[@class="hg3-awards"]/li/meta/@content').extract()
+        awards = select("healthgrades.awards_category", page)
+        awards_list = select("healthgrades.awards_list", page)
         # item['Awards'] = {
         #     'Category': awards[0] if awards else None,
         #     'Awards list by cate award': awards_list
@@ -390,78 +462,49 @@ class HealthgradesSpider(scrapy.Spider):
             'Awards list by cate award': awards_list
         }
 
-        overall_ratio = response.xpath(
-            '//div[@class="columns medium main-graph-radial-data"]/@data-outer-percent').extract()
+        overall_ratio = select("healthgrades.overall_ratio", page)
         clincial_list = []
-        clincials = response.xpath('//div[@class="clinical-quality-overlay hg3-overlay"]')
+        clincials = select("healthgrades.clinical_overlays", page)
         for cli in clincials:
-            cli_category = cli.xpath('.//div[@class="overlay-header"]/h2/text()').extract()
+            cli_category = select("healthgrades.clinical_category", cli)
             cli_category = cli_category[0].replace('Clinical Quality: ', '') if cli_category else None
+            # every grid is read once, rows into column arrays
+            grids = ClinicalQualityGrids(cli)
             mortality_list = []
-            # mortalities = response.xpath('//div[@class="hg3-clinical-quality-grid"]'
-            #                              '/h4[contains(text(), "Mortality Based Ratings")]')
-            mortalities = cli.xpath(
-                './/div[@class="clinical-overlay-grid-container"]/div[@class="hg3-clinical-quality-grid"][1]'
-                '/div[contains(@class, "clpseable")]')
-            for mor in mortalities:
+            for mor in grids.mortalities:
                 mortality_list.append({
-                    'Mortality': mor.xpath('.//h6[@class="title"]/text()').extract_first(),
-                    'Description': ''.join(mor.xpath('.//p[@class="based-rating"]//text()').extract()),
+                    'Mortality': mor.title,
+                    'Description': mor.description,
                     'Actual Mortality': {
-                        'Mortality1': mor.xpath(
-                            './/div[@class="row inner js-clpse hidden actual-num"]/div[@class="tb-col number"]'
-                            '/text()').extract()[0],
-                        'Mortality2': mor.xpath(
-                            './/div[@class="row inner js-clpse hidden actual-num"]/div[@class="tb-col number"]'
-                            '/text()').extract()[1]
+                        'Mortality1': cell(mor.actual, 0),
+                        'Mortality2': cell(mor.actual, 1)
                     },
                     'Predicted Mortality': {
-                        'Mortality1': mor.xpath(
-                            './/div[@class="row inner js-clpse hidden predicted-num"]/div[@class="tb-col number"]'
-                            '/text()').extract()[0],
-                        'Mortality2': mor.xpath(
-                            './/div[@class="row inner js-clpse hidden predicted-num"]/div[@class="tb-col number"]'
-                            '/text()').extract()[1]
+                        'Mortality1': cell(mor.predicted, 0),
+                        'Mortality2': cell(mor.predicted, 1)
                     },
                     'Question pool': {
-                        'Question': mor.xpath(
-                            './/div[@class="explanation"]/h3[@class="headline"]/text()').extract_first(),
-                        'Answer': mor.xpath(
-                            './/div[@class="explanation"]/div[@class="summary"]/p[1]/text()').extract_first()
+                        'Question': mor.question,
+                        'Answer': mor.answer
                     }
                 })
 
             complication_list = []
-
-            # complications = response.xpath('//div[@class="hg3-clinical-quality-grid"]'
-            #                                '/h4[contains(text(), "Complication Based Ratings")]')
-            complications = cli.xpath('.//div[@class="clinical-overlay-grid-container"]/div[2]'
-                                      '/div[contains(@class, "clpseable")]')
-            for com in complications:
+            for com in grids.complications:
                 complication_list.append({
-                    'Complication': com.xpath('.//h6[@class="title"]/text()').extract_first(),
-                    'Description': ''.join(mor.xpath('.//p[@class="based-rating"]//text()').extract()),
+                    'Complication': com.title,
+                    'Description': com.description,
                     'Actual': {
-                        'Hospital': com.xpath(
-                            './/div[@class="row inner js-clpse hidden actual-num"]/div[@class="tb-col number"]'
-                            '/text()').extract()[0],
-                        'National': com.xpath(
-                            './/div[@class="row inner js-clpse hidden actual-num"]/div[@class="tb-col number"]'
-                            '/text()').extract()[1]
+                        'Hospital': cell(com.actual, 0),
+                        'National': cell(com.actual, 1)
                     },
                     'Predicted': {
-                        'Hospital': com.xpath(
-                            './/div[@class="row inner js-clpse hidden predicted-num"]/div[@class="tb-col number"]'
-                            '/text()').extract()[0],
-                        'National': com.xpath(
-                            './/div[@class="row inner js-clpse hidden predicted-num"]/div[@class="tb-col number"]'
-                            '/text()').extract()[1]
+                        'Hospital': cell(com.predicted, 0),
+                        'National': cell(com.predicted, 1)
                     },
                     'Question pool': {
-                        'Question': com.xpath(
-                            './/div[@class="explanation"]/h3[@class="headline"]/text()').extract_first(),
-                        'Answer': com.xpath(
-                            './/div[@class="explanation"]/div[@class="summary"]/p[1]/text()').extract_first()
+                        'Question': com.question,
+                        'Answer': com.answer
                     }
                 })
 
@@ -489,17 +532,12 @@ class HealthgradesSpider(scrapy.Spider):
         item['Address']=addr
         item['Memo']=mem
         item['Insurances']=insure
-        item['Office_Providers']=office_prov
         item['Procedures']=proced
         item['Languages']=lang
         item['Business_Hours']=bus_hr
         item['Awards']=award
         item['Clinical_Quality_Ratings']=clinic_q_rate
 
-
-    # filename = base_dir_path + '/output/' + 'business-' + str(self.meta_count) + '.json'
-        filename = base_dir_path + '/output/' + 'business-' + str(response.meta['ext_id']) + '.json'
-        with open(filename, 'w+') as output:
-            json.dump(item, output, indent=4, sort_keys=True)
         self.meta_count += 1
-        return response
+        # written by HealthgradesPipeline
+        return item
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import os
+import sys
+import functools
+import socket
+import struct
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir)
+# repository root (common/, benchmarks/) and the Yelp service (spiders.*), as the service and benchmarks set them up
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, 'Yelp'))
+
+# answer of a StandIn route that drops the connection without a response
+RESET = "reset"
+
+HTML = {"Content-Type": "text/html; charset=utf-8"}
+
+
+def yelp_scraper(url, **kwargs):
+    """YelpScraper sharing nothing with other tests: own transports, cache (disabled unless given),
+    retries without waits"""
+    from common.rate_limit import RateLimiter
+    from spiders.async_fetch import AsyncHTTPTransport
+    from spiders.extract_data import HTTPTransport, PageStreamStats
+    from spiders.http_cache import HTTPCache
+    from spiders.retry_policy import RetryPolicy
+    from spiders.singleflight import SingleFlight, AsyncSingleFlight
+    from spiders.yelp.extract_yelp_data import YelpScraper
+
+    arguments = dict(url=url, bot=None,
+                     transport=HTTPTransport(rate_limiter=RateLimiter()),
+                     async_transport=AsyncHTTPTransport(rate_limiter=RateLimiter()),
+                     retry_policy=RetryPolicy(max_attempts=3, base_delay=0.01, max_delay=0.01),
+                     http_cache=HTTPCache(),
+                     page_fetches=SingleFlight(),
+                     async_page_fetches=AsyncSingleFlight(),
+                     page_streams=PageStreamStats())
+    arguments.update(kwargs)
+    return YelpScraper(**arguments)
+
+
+class _Server(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # resets and clients going away are part of the tests
+        pass
+
+
+class StandIn(object):
+
+    """Local HTTP server standing in for a site. Each route answers with its list of responses
+    in turn, the last one repeated: (status, body, headers) tuples, or RESET.
+
+    Attributes:
+        url (string): http://127.0.0.1:port
+        requests (list): (path, headers) of every request received
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = _Server(('127.0.0.1', 0), self._handler())
+        self.url = 'http://127.0.0.1:%d' % self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def route(self, path, *responses):
+        self.routes[path] = list(responses)
+        return self.url + path
+
+    def hits(self, path):
+        return sum(1 for request_path, _ in self.requests if request_path == path)
+
+    def _next_response(self, path, headers):
+        with self._lock:
+            self.requests.append((path, headers))
+            responses = self.routes.get(path) or [(404, b'', {})]
+            return responses.pop(0) if len(responses) > 1 else responses[0]
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                response = stand_in._next_response(self.path, dict(self.headers))
+                if response == RESET:
+                    # RST instead of FIN: the client sees a connection reset
+                    self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+                    self.connection.close()
+                    self.close_connection = True
+                    return
+
+                status, body, headers = response
+                body = body.encode('utf-8') if isinstance(body, str) else body
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def finish(self):
+                try:
+                    BaseHTTPRequestHandler.finish(self)
+                except (OSError, ValueError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+@pytest.fixture
+def stand_in():
+    server = StandIn()
+    yield server
+    server.close()
+
+
+@pytest.fixture(scope="session")
+def in_reactor():
+    """Calls a function in the reactor thread and returns its result, once its Deferred fired if it returns one.
+    The twisted reactor runs in a background thread until the end of the tests"""
+    from twisted.internet import reactor, threads
+
+    thread = threading.Thread(target=reactor.run, kwargs={"installSignalHandlers": False}, daemon=True)
+    thread.start()
+    yield functools.partial(threads.blockingCallFromThread, reactor)
+    reactor.callFromThread(reactor.stop)
+    thread.join(5)
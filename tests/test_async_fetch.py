@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import asyncio
+
+import pytest
+import requests
+
+from conftest import RESET, HTML, yelp_scraper
+from benchmarks.synthetic_pages import yelp_business_page
+from common.rate_limit import RateLimiter
+from spiders.async_fetch import AsyncHTTPTransport
+
+PAGE = yelp_business_page(reviews=5)
+
+
+def business_info_async(url):
+    async def fetch():
+        instance = yelp_scraper(url)
+        try:
+            return await instance.business_info_async()
+        finally:
+            await instance.async_transport.close()
+
+    return asyncio.run(fetch())
+
+
+def without_load_time(info):
+    info.pop("loaded_in_seconds", None)
+    return info
+
+
+@pytest.mark.parametrize("responses", [
+    [(200, PAGE, HTML)],
+    [(404, "not found", HTML)],
+    [(429, "slow down", HTML), (200, PAGE, HTML)],
+], ids=["ok", "not_found", "throttled_then_ok"])
+def test_business_info_async_returns_business_info(stand_in, responses):
+    url = stand_in.route("/biz/sync", *responses)
+    expected = without_load_time(yelp_scraper(url).business_info())
+    url = stand_in.route("/biz/async", *responses)
+    assert without_load_time(business_info_async(url)) == expected
+    assert stand_in.hits("/biz/async") == stand_in.hits("/biz/sync") == len(responses)
+
+
+def test_business_info_async_reads_the_page(stand_in):
+    info = business_info_async(stand_in.route("/biz/x", (200, PAGE, HTML)))
+    assert info["business_name"] == "Premier Medical Associates"
+
+
+def test_connection_reset_is_retried_then_raised(stand_in):
+    url = stand_in.route("/biz/reset", RESET)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        yelp_scraper(url).business_info()
+    url = stand_in.route("/biz/async_reset", RESET)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        business_info_async(url)
+    # every attempt of the retry policy (aiohttp may resend a request on a dropped connection itself)
+    assert stand_in.hits("/biz/async_reset") >= 3
+
+
+def test_connection_reset_then_ok(stand_in):
+    url = stand_in.route("/biz/flaky", RESET, (200, PAGE, HTML))
+    assert without_load_time(business_info_async(url))["business_name"] == "Premier Medical Associates"
+    assert stand_in.hits("/biz/flaky") == 2
+
+
+def test_requests_counted_across_loops(stand_in):
+    transport = AsyncHTTPTransport(rate_limiter=RateLimiter())
+    url = stand_in.route("/count", (200, "ok", HTML))
+
+    async def fetch(count):
+        try:
+            responses = await asyncio.gather(*[transport.get(url) for _ in range(count)])
+        finally:
+            await transport.close()
+        return [response.status_code for response in responses]
+
+    assert asyncio.run(fetch(5)) == [200] * 5
+    assert asyncio.run(fetch(3)) == [200] * 3
+    assert transport.stats()["requests"] == 8
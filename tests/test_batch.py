@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import time
+import threading
+from collections import Counter
+
+from spiders.batch import BatchRunner, BatchJob, BatchJobManager
+
+
+class Scrape(object):
+
+    """scrape_row recording how many rows run at once, in all and per host"""
+
+    def __init__(self, seconds=0.05):
+        self.seconds = seconds
+        self.running = Counter()
+        self.most = Counter()
+        self.most_in_all = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, row):
+        host = row["url"].split("/")[2]
+        with self._lock:
+            self.running[host] += 1
+            self.most[host] = max(self.most[host], self.running[host])
+            self.most_in_all = max(self.most_in_all, sum(self.running.values()))
+        time.sleep(self.seconds)
+        with self._lock:
+            self.running[host] -= 1
+        return row["id"]
+
+
+def rows(hosts):
+    return [{"id": i, "url": "http://%s/biz/%d" % (host, i)} for i, host in enumerate(hosts)]
+
+
+def test_rows_of_other_hosts_go_past_a_busy_host():
+    scrape = Scrape()
+    runner = BatchRunner(scrape, workers=8, per_host=4)
+    # the a.test rows over its limit are held back (up to a row per worker) while b.test rows are read
+    batch = rows(["a.test"] * 8 + ["b.test"] * 4)
+    results = list(runner.run(batch))
+
+    assert sorted(result for row, result, error in results) == list(range(12))
+    assert scrape.most == Counter({"a.test": 4, "b.test": 4})
+    # b.test rows ran alongside the first a.test ones, instead of waiting behind the a.test backlog
+    assert scrape.most_in_all == 8
+    assert sum(1 for row, result, error in results[:8] if row["url"].startswith("http://b.test")) == 4
+    assert runner.stats()["rows_done"] == 12
+
+
+def test_single_host_keeps_per_host_limit():
+    scrape = Scrape(seconds=0.01)
+    runner = BatchRunner(scrape, workers=8, per_host=3)
+    assert len(list(runner.run(rows(["a.test"] * 20)))) == 20
+    assert scrape.most == Counter({"a.test": 3})
+
+
+def test_cancel_yields_every_row_read():
+    read = []
+
+    def source():
+        for row in rows(["a.test"] * 10 + ["b.test"] * 40):
+            read.append(row["id"])
+            yield row
+
+    runner = BatchRunner(Scrape(seconds=0.02), workers=4, per_host=2)
+    yielded = []
+    for row, result, error in runner.run(source()):
+        yielded.append(row["id"])
+        runner.cancel()
+
+    assert runner.cancelled
+    assert len(read) < 50
+    assert sorted(yielded) == sorted(read)
+
+
+def test_failed_rows_release_their_host():
+    def scrape(row):
+        if row["id"] % 2:
+            raise ValueError("broken row")
+        return row["id"]
+
+    runner = BatchRunner(scrape, workers=2, per_host=1)
+    results = list(runner.run(rows(["a.test"] * 6)))
+    assert len(results) == 6
+    assert sum(1 for row, result, error in results if error is not None) == 3
+
+
+def test_job_counts_rows_as_it_reads_them():
+    reads = []
+
+    def rows_factory():
+        reads.append(1)
+        return iter(rows(["a.test"] * 5))
+
+    job = BatchJob(BatchRunner(Scrape(seconds=0), workers=2), rows_factory)
+    assert job.progress()["rows_total"] is None
+    job.run()
+    progress = job.progress()
+    assert (progress["status"], progress["rows_read"], progress["rows_total"], progress["rows_done"]) == \
+        (BatchJob.FINISHED, 5, 5, 5)
+    # the roster is read once
+    assert reads == [1]
+
+
+def test_finished_jobs_are_forgotten():
+    manager = BatchJobManager(max_jobs=1, finished_ttl=60, max_finished=2)
+    jobs = [manager.submit(BatchJob(BatchRunner(Scrape(seconds=0)), lambda: rows(["a.test"]))) for _ in range(4)]
+    for job in jobs:
+        job.future.result()
+    # the latest max_finished jobs are kept
+    assert [manager.get(job.job_id) for job in jobs] == [None, None] + jobs[2:]
+
+    manager.finished_ttl = 0
+    assert manager.get(jobs[3].job_id) is None
+
+
+def test_job_estimates_its_eta_until_every_row_is_read():
+    progress = []
+
+    def on_row(row, result, error):
+        progress.append(job.progress())
+
+    job = BatchJob(BatchRunner(Scrape(seconds=0.01), workers=1), lambda: iter(rows(["a.test"] * 10)),
+                   on_row=on_row, count_rows=lambda: 12)
+    job.run()
+
+    # the estimate was above the rows actually read
+    assert (progress[0]["rows_total"], progress[0]["rows_total_estimated"]) == (12, True)
+    assert progress[0]["eta_seconds"] is not None
+    assert (job.rows_total, job.rows_total_estimated) == (10, False)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import os
+import json
+import threading
+
+from spiders.checkpoint import BatchCheckpoint
+
+
+def batch_row(external_id):
+    return {"row": external_id, "external_id": external_id, "url": "http://www.yelp.test/biz/%d" % external_id}
+
+
+def save_output(directory, external_id, body="{}"):
+    path = str(directory / ("business-%d.json" % external_id))
+    with open(path, "w") as output:
+        output.write(body)
+    return path
+
+
+def test_rows_done_are_skipped_on_rerun(tmp_path):
+    manifest = str(tmp_path / "checkpoints" / "site.jsonl")
+    checkpoint = BatchCheckpoint(manifest, max_age=60)
+    done, failed = save_output(tmp_path, 1), save_output(tmp_path, 2)
+    assert not checkpoint.is_fresh(batch_row(1), done)
+    checkpoint.record_done(batch_row(1), done)
+    checkpoint.record_failed(batch_row(2))
+
+    rerun = BatchCheckpoint(manifest, max_age=60)
+    assert rerun.is_fresh(batch_row(1), done)
+    assert not rerun.is_fresh(batch_row(2), failed)
+    # max_age 0 scrapes every row again
+    assert not BatchCheckpoint(manifest, max_age=0).is_fresh(batch_row(1), done)
+
+
+def test_changed_missing_or_old_outputs_are_not_fresh(tmp_path):
+    manifest = str(tmp_path / "site.jsonl")
+    checkpoint = BatchCheckpoint(manifest, max_age=60)
+    changed, missing, old = (save_output(tmp_path, external_id) for external_id in (1, 2, 3))
+    for external_id, path in ((1, changed), (2, missing), (3, old)):
+        checkpoint.record_done(batch_row(external_id), path)
+
+    save_output(tmp_path, 1, '{"name": "edited"}')
+    os.remove(missing)
+    checkpoint._entries[3]["timestamp"] -= 61
+    assert [checkpoint.is_fresh(batch_row(external_id), path)
+            for external_id, path in ((1, changed), (2, missing), (3, old))] == [False, False, False]
+
+
+def test_manifest_is_compacted_without_losing_lines_of_other_batches(tmp_path):
+    manifest = str(tmp_path / "site.jsonl")
+    output = save_output(tmp_path, 0)
+    writer = BatchCheckpoint(manifest, max_age=60)
+    writer.record_done(batch_row(0), output)
+    writer.record_done(batch_row(0), output)
+
+    def append():
+        for external_id in range(1, 501):
+            writer.record_done(batch_row(external_id), output)
+
+    thread = threading.Thread(target=append)
+    thread.start()
+    # batches sharing the manifest open it (and compact it) while the writer appends
+    while thread.is_alive():
+        BatchCheckpoint(manifest, max_age=60)
+    thread.join()
+
+    assert len(BatchCheckpoint(manifest, max_age=60)._entries) == 501
+    with open(manifest) as lines:
+        assert [json.loads(line)["external_id"] for line in lines] == list(range(501))
+    assert sorted(os.listdir(str(tmp_path))) == ["business-0.json", "site.jsonl", "site.jsonl.lock"]
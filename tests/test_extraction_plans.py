@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+from conftest import yelp_scraper
+from spiders import extract_data
+
+URL = "http://site.test/biz/x"
+
+
+def test_plans_are_shared_by_orderings_and_duplicates():
+    scraper = yelp_scraper(URL)
+    plan = scraper._extraction_plan(["business_name", "city", "zip"])
+    assert scraper._extraction_plan(["zip", "business_name", "city", "zip"]) is plan
+    assert yelp_scraper(URL)._extraction_plan(["city", "zip", "business_name"]) is plan
+    assert sorted(info for info, extractor in plan.extractors) == ["business_name", "city", "zip"]
+
+
+def test_unknown_data_types_are_left_out():
+    scraper = yelp_scraper(URL)
+    plan = scraper._extraction_plan(["business_name", "no_such_field"])
+    assert scraper._extraction_plan(["business_name", "another_unknown"]) is plan
+    assert [info for info, extractor in plan.extractors] == ["business_name"]
+    assert scraper._extraction_plan(["no_such_field"]).extractors == []
+
+
+def test_plans_kept_are_bounded(monkeypatch):
+    monkeypatch.setattr(extract_data, "EXTRACTION_PLANS_SIZE", 4)
+    scraper = yelp_scraper(URL)
+    data_types = sorted(scraper.ALL_DATA_TYPES)
+    for info in data_types[:10]:
+        scraper._extraction_plan([info])
+    assert len(extract_data._extraction_plans) <= 4
+    # the most recently used ones are kept
+    assert (type(scraper), frozenset([data_types[9]])) in extract_data._extraction_plans
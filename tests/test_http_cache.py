@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import shutil
+
+from common.rate_limit import RateLimiter
+from spiders.extract_data import HTTPTransport
+from spiders.http_cache import HTTPCache
+
+PAGE = (200, "<html>page</html>", {"Content-Type": "text/html; charset=utf-8", "ETag": '"v1"'})
+NOT_MODIFIED = (304, b"", {"ETag": '"v1"'})
+DESKTOP = {"User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:24.0) Gecko/20140319 Firefox/24.0"}
+GOOGLE = {"User-Agent": "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)"}
+
+
+class EvictingTransport(object):
+
+    """Transport whose requests see the cached bodies evicted by another process meanwhile"""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.transport = HTTPTransport(rate_limiter=RateLimiter())
+
+    def get(self, url, **kwargs):
+        shutil.rmtree(self.cache.directory + "/bodies", ignore_errors=True)
+        return self.transport.get(url, **kwargs)
+
+
+def conditional(headers):
+    return "If-None-Match" in headers or "If-Modified-Since" in headers
+
+
+def test_stale_entry_is_revalidated(stand_in, tmp_path):
+    cache = HTTPCache(directory=str(tmp_path), ttl=0)
+    transport = HTTPTransport(rate_limiter=RateLimiter())
+    url = stand_in.route("/page", PAGE, NOT_MODIFIED)
+
+    assert cache.get(transport, url, headers=DESKTOP).text == "<html>page</html>"
+    r = cache.get(transport, url, headers=DESKTOP)
+    assert (r.status_code, r.text) == (200, "<html>page</html>")
+    assert conditional(stand_in.requests[-1][1])
+    assert cache.stats()["revalidated"] == 1
+
+
+def test_entry_without_body_is_fetched_unconditionally(stand_in, tmp_path):
+    cache = HTTPCache(directory=str(tmp_path), ttl=0)
+    transport = HTTPTransport(rate_limiter=RateLimiter())
+    url = stand_in.route("/page", PAGE, NOT_MODIFIED)
+
+    cache.get(transport, url, headers=DESKTOP)
+    shutil.rmtree(str(tmp_path / "bodies"))
+    stand_in.route("/page", PAGE)
+    r = cache.get(transport, url, headers=DESKTOP)
+    assert (r.status_code, r.text) == (200, "<html>page</html>")
+    assert not conditional(stand_in.requests[-1][1])
+
+
+def test_not_modified_without_body_is_fetched_again(stand_in, tmp_path):
+    cache = HTTPCache(directory=str(tmp_path), ttl=0)
+    url = stand_in.route("/page", PAGE, NOT_MODIFIED, PAGE)
+
+    cache.get(HTTPTransport(rate_limiter=RateLimiter()), url, headers=DESKTOP)
+    # the body goes while the revalidation is on its way
+    r = cache.get(EvictingTransport(cache), url, headers=DESKTOP)
+    assert (r.status_code, r.text) == (200, "<html>page</html>")
+    assert [conditional(headers) for _, headers in stand_in.requests] == [False, True, False]
+
+
+def test_entries_are_kept_per_user_agent(stand_in, tmp_path):
+    cache = HTTPCache(directory=str(tmp_path))
+    transport = HTTPTransport(rate_limiter=RateLimiter())
+    url = stand_in.route("/page", PAGE)
+
+    for _ in range(2):
+        cache.get(transport, url, headers=DESKTOP)
+        cache.get(transport, url, headers=GOOGLE)
+    assert stand_in.hits("/page") == 2
+    assert stand_in.requests[1][1]["User-Agent"] == GOOGLE["User-Agent"]
+    assert cache.stats()["hits"] == 2
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import random
+
+from scrapy import Request
+from scrapy.http import HtmlResponse
+from twisted.python.failure import Failure
+
+from healthgrades.items import HealthgradesItem
+from healthgrades.spiders.healthgrades import HealthgradesSpider
+
+URL = "https://www.healthgrades.com/group-directory/office"
+LINK = '<div class="provider-wrap__view-profile"><a href="/physician/%d">profile</a></div>'
+PROFILE = '<html><h1 itemprop="name">Dr %d</h1><span class="generated-bio">Bio</span></html>'
+
+
+def html_response(url, body, request=None):
+    return HtmlResponse(url=url, body=body.encode("utf-8"), encoding="utf-8", request=request or Request(url))
+
+
+def profile_requests(spider, count):
+    page = html_response(URL, "<html>%s</html>" % "".join(LINK % index for index in range(count)))
+    item = HealthgradesItem(external_system_unique_id=1)
+    return item, list(spider.get_office_providers(page, item))
+
+
+def test_item_is_yielded_once_every_provider_is_in():
+    spider = HealthgradesSpider()
+    item, requests = profile_requests(spider, 6)
+    assert [request.url for request in requests] == ["https://www.healthgrades.com/physician/%d" % index
+                                                    for index in range(6)]
+
+    # profiles come back in any order: one download fails, one page can't be parsed
+    random.Random(3).shuffle(requests)
+    yielded = []
+    for request in requests:
+        index = request.meta["provider_index"]
+        if index == 2:
+            failure = Failure(IOError("connection lost"))
+            failure.request = request
+            yielded.append(list(spider.provider_failed(failure)))
+        else:
+            body = "<html></html>" if index == 4 else PROFILE % index
+            yielded.append(list(spider.parse_provider(html_response(request.url, body, request))))
+
+    assert yielded[:-1] == [[]] * 5
+    assert yielded[-1] == [item]
+    # in the order of the business page, failed profiles listed apart
+    assert [provider["Business Title"] for provider in item["Office_Providers"]] == ["Dr 0", "Dr 1", "Dr 3", "Dr 5"]
+    assert item["Office_Providers_Failed"] == ["https://www.healthgrades.com/physician/2",
+                                               "https://www.healthgrades.com/physician/4"]
+
+
+def test_item_without_providers_is_yielded_right_away():
+    item, yielded = profile_requests(HealthgradesSpider(), 0)
+    assert yielded == [item]
+    assert item["Office_Providers"] == []
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import re
+
+from conftest import HTML, yelp_scraper
+from benchmarks.synthetic_pages import yelp_business_page
+
+LD_JSON = re.compile(r'<script type="application/ld\+json">.*?</script>', re.S)
+
+FIELDS = ["business_name", "address", "city", "zip"]
+
+
+def page_with_ld_json_in_body():
+    # the ld+json blocks at the end of the <body>, well past the first chunks streamed
+    page = yelp_business_page(reviews=60)
+    blocks = LD_JSON.findall(page)
+    page = LD_JSON.sub("", page)
+    return page.replace("</body>", "".join(blocks) + "</body>")
+
+
+def test_streamed_page_reads_ld_json_in_body(stand_in):
+    url = stand_in.route("/biz/x", (200, page_with_ld_json_in_body(), HTML))
+    expected = yelp_scraper(url).business_info(FIELDS)
+    assert expected["business_name"] == "Premier Medical Associates"
+
+    streamed = yelp_scraper(url, stream_pages=True)
+    assert streamed.business_info(FIELDS) == expected
+    assert streamed.page_streams.stats()["stopped_early"] == 0
+
+
+def test_streamed_page_stops_after_hours(stand_in):
+    url = stand_in.route("/biz/x", (200, page_with_ld_json_in_body(), HTML))
+    fields = ["monday_open_time", "monday_close_time"]
+    expected = yelp_scraper(url).business_info(fields)
+
+    streamed = yelp_scraper(url, stream_pages=True)
+    assert streamed.business_info(fields) == expected
+    assert streamed.page_streams.stats()["stopped_early"] == 1
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import os
+import time
+import logging
+from collections import Counter
+
+from common.pipelines import BatchedOutputPipeline
+
+
+class Spider(object):
+
+    """Spider told of the batches written"""
+
+    logger = logging.getLogger("test_pipelines")
+
+    def __init__(self):
+        self.batches = []
+
+    def items_written(self, items):
+        self.batches.append([item["id"] for item in items])
+
+
+class Stats(object):
+
+    def __init__(self):
+        self.values = Counter()
+
+    def inc_value(self, key, count=1):
+        self.values[key] += count
+
+
+class Pipeline(BatchedOutputPipeline):
+
+    """Writes <directory>/<id>.json, failing the first writes of the ids in failing"""
+
+    def __init__(self, directory, failing=(), **kwargs):
+        BatchedOutputPipeline.__init__(self, stats=Stats(), **kwargs)
+        self.directory = directory
+        self.failing = Counter(failing)
+
+    def outputs(self, item):
+        if self.failing[item["id"]]:
+            self.failing[item["id"]] -= 1
+            raise IOError("disk full")
+        return os.path.join(self.directory, "%d.json" % item["id"]), item, None, ()
+
+
+def wait_for(condition, seconds=5):
+    deadline = time.time() + seconds
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def crawl(in_reactor, pipeline, ids, close=True):
+    spider = Spider()
+    in_reactor(pipeline.open_spider, spider)
+    for item_id in ids:
+        in_reactor(pipeline.process_item, {"id": item_id}, spider)
+    if close:
+        in_reactor(pipeline.close_spider, spider)
+    return spider
+
+
+def test_batches_are_written_once_full(in_reactor, tmp_path):
+    pipeline = Pipeline(str(tmp_path), batch_size=3, batch_seconds=60)
+    spider = crawl(in_reactor, pipeline, range(7), close=False)
+    assert wait_for(lambda: len(spider.batches) == 2)
+    assert spider.batches == [[0, 1, 2], [3, 4, 5]]
+    assert pipeline.buffer == [{"id": 6}]
+
+    # the rest when the spider closes
+    in_reactor(pipeline.close_spider, spider)
+    assert spider.batches[2:] == [[6]]
+    assert sorted(os.listdir(str(tmp_path))) == ["%d.json" % item_id for item_id in range(7)]
+
+
+def test_batches_are_written_once_their_oldest_item_waited(in_reactor, tmp_path):
+    pipeline = Pipeline(str(tmp_path), batch_size=100, batch_seconds=0.2)
+    spider = crawl(in_reactor, pipeline, [1, 2], close=False)
+    assert spider.batches == []
+    assert wait_for(lambda: spider.batches == [[1, 2]])
+    in_reactor(pipeline.close_spider, spider)
+
+
+def test_failed_writes_are_retried_in_order(in_reactor, tmp_path):
+    pipeline = Pipeline(str(tmp_path), failing=[1], batch_size=2, batch_seconds=0.1)
+    spider = crawl(in_reactor, pipeline, range(5))
+    assert spider.batches == [[0, 1], [2, 3], [4]]
+    assert len(os.listdir(str(tmp_path))) == 5
+    assert pipeline.stats.values["output/batches_retried"] == 1
+    assert pipeline.stats.values["output/batches_failed"] == 0
+
+
+def test_batches_are_given_up_after_their_attempts(in_reactor, tmp_path):
+    pipeline = Pipeline(str(tmp_path), failing=[1, 1], batch_size=2, batch_seconds=0.1, write_attempts=2)
+    spider = crawl(in_reactor, pipeline, range(4))
+    # the failed batch is not told to the spider (its tasks are not acked), the next one is written
+    assert spider.batches == [[2, 3]]
+    assert pipeline.stats.values["output/batches_failed"] == 1
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import asyncio
+
+import pytest
+from scrapy import Request
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import Response
+
+from conftest import HTML, StandIn, yelp_scraper
+from benchmarks.synthetic_pages import yelp_business_page
+from common.middlewares import ProxyPoolMiddleware
+from common.proxy_pool import ProxyPool
+from spiders.extract_data import PAGE_OK
+
+URL = "http://www.site.test/page"
+PAGE = yelp_business_page(reviews=5)
+
+
+@pytest.fixture
+def proxies():
+    # stand-ins for two proxies: they get the absolute url of the page as path
+    servers = [StandIn(), StandIn()]
+    yield servers
+    for server in servers:
+        server.close()
+
+
+def banning_pool(proxies, url):
+    # the first proxy is banned, the second one serves the page. the first one is chosen first
+    banned, healthy = proxies
+    banned.route(url, (403, "blocked", HTML))
+    healthy.route(url, (200, PAGE, HTML))
+    pool = ProxyPool([banned.url, healthy.url])
+    pool.proxies[1].success_rate = 0.5
+    return pool
+
+
+def fetch_page(instance, url, use_async=False):
+    if not use_async:
+        return instance._fetch_page(url)
+
+    async def fetch():
+        try:
+            return await instance._fetch_page_async(url)
+        finally:
+            await instance.async_transport.close()
+
+    return asyncio.run(fetch())
+
+
+@pytest.mark.parametrize("use_async", [False, True], ids=["sync", "async"])
+def test_banned_pages_are_fetched_again_through_another_proxy(proxies, use_async):
+    url = "http://www.yelp.test/biz/banned"
+    pool = banning_pool(proxies, url)
+    status, contents, tree = fetch_page(yelp_scraper(url, proxy_pool=pool), url, use_async)
+    assert status == PAGE_OK and contents
+    assert proxies[0].hits(url) == proxies[1].hits(url) == 1
+    assert pool.proxies[0].bans == 1 and pool.proxies[0].quarantined_until
+
+
+def test_banned_direct_pages_are_fetched_again_through_the_pool(stand_in, proxies):
+    url = stand_in.route("/biz/banned", (403, "blocked", HTML))
+    pool = banning_pool(proxies, url)
+    status, contents, tree = fetch_page(yelp_scraper(url, proxy_pool=pool, proxy_direct_attempts=4), url)
+    assert status == PAGE_OK and contents
+    assert stand_in.hits("/biz/banned") == 1
+    assert proxies[0].hits(url) == proxies[1].hits(url) == 1
+
+
+def middleware():
+    return ProxyPoolMiddleware(ProxyPool(["http://proxy.test:8010"]))
+
+
+def test_ignored_requests_give_their_proxy_back():
+    proxies = middleware()
+    proxy = proxies.pool.proxies[0]
+    request = Request(URL)
+    proxies.process_request(request, None)
+    assert proxy.in_flight == 1
+
+    proxies.process_exception(request, IgnoreRequest(), None)
+    assert proxy.in_flight == 0
+    assert proxy.failures == 0
+
+    # recorded once
+    proxies.process_exception(request, IgnoreRequest(), None)
+    assert proxy.in_flight == 0
+
+
+def test_requests_through_again_give_their_last_proxy_back():
+    proxies = middleware()
+    proxy = proxies.pool.proxies[0]
+    request = Request(URL)
+    proxies.process_request(request, None)
+    proxies.process_request(request, None)
+    assert proxy.in_flight == 1
+
+    proxies.process_response(request, Response(URL, status=200), None)
+    assert proxy.in_flight == 0
+    assert proxy.requests == 1
+
+
+def test_requests_left_when_the_spider_closes_give_their_proxy_back():
+    proxies = middleware()
+    proxy = proxies.pool.proxies[0]
+    dropped, running = Request(URL), Request(URL + "?page=2")
+    proxies.process_request(dropped, None)
+    proxies.process_request(running, None)
+    assert proxy.in_flight == 2
+
+    proxies.request_dropped(dropped, None)
+    assert proxy.in_flight == 1
+    proxies.spider_closed(None)
+    assert proxy.in_flight == 0
+    assert proxy.requests == 0
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import time
+import asyncio
+import threading
+
+from common.rate_limit import RateLimiter
+
+URL = "http://www.site.test/page"
+
+
+def record_threads(limiter):
+    """Threads the tokens of limiter are taken on, from now on"""
+    threads = []
+    take = limiter.buckets.take
+
+    def recording_take(key, rate, burst):
+        threads.append(threading.current_thread())
+        return take(key, rate, burst)
+
+    limiter.buckets.take = recording_take
+    return threads
+
+
+def test_parent_domain_limits():
+    limiter = RateLimiter(limits={"site.test": (2.0, 4)})
+    assert limiter.limit("www.site.test") == (2.0, 4)
+    assert limiter.limit("localhost") is None
+    assert [limiter.reserve(URL) for _ in range(4)] == [0.0] * 4
+    assert limiter.reserve(URL) > 0
+
+
+def test_proxies_have_buckets_of_their_own():
+    limiter = RateLimiter(limits={"site.test": 1})
+    assert limiter.reserve(URL, "http://key:@proxy.test:8010") == 0.0
+    assert limiter.reserve(URL, "proxy2.test:8010") == 0.0
+    # same proxy, with or without its credentials
+    assert limiter.reserve(URL, "proxy.test:8010") > 0
+
+
+def test_shared_buckets_are_taken_off_the_event_loop(tmp_path):
+    limiter = RateLimiter(limits={"site.test": (20.0, 1)}, path=str(tmp_path / "rate_limits.sqlite"))
+    assert limiter.shared
+    threads = record_threads(limiter)
+
+    async def main():
+        loop_thread = threading.current_thread()
+        time_start = time.time()
+        await asyncio.gather(*[limiter.wait_async(URL) for _ in range(5)])
+        return loop_thread, time.time() - time_start
+
+    loop_thread, elapsed = asyncio.run(main())
+    assert len(threads) == 5
+    assert loop_thread not in threads
+    # 1 token at once, then 20 per second
+    assert 0.15 < elapsed < 0.5
+
+
+def test_memory_buckets_are_taken_on_the_event_loop():
+    limiter = RateLimiter(limits={"site.test": (20.0, 1)})
+    assert not limiter.shared
+    threads = record_threads(limiter)
+
+    async def main():
+        await limiter.wait_async(URL)
+        return threading.current_thread()
+
+    assert threads == [asyncio.run(main())]
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import time
+
+from spiders.result_cache import ResultCache, MemoryResultCache, SQLiteResultCache
+
+SITE = "www.yelp.com"
+URL = "https://www.yelp.com/biz/office?b=2&a=1"
+RESULT = {"name": "Office"}
+
+
+def caches(tmp_path, ttl=60):
+    # two processes: an in-process tier each, one shared file
+    path = str(tmp_path / "results.sqlite")
+    return [ResultCache(MemoryResultCache(ttl=ttl), SQLiteResultCache(path, ttl)) for _ in range(2)]
+
+
+def test_shared_results_are_promoted_to_memory(tmp_path):
+    first, second = caches(tmp_path)
+    first.set(SITE, URL, RESULT)
+    assert second.get(SITE, URL) == (RESULT, ResultCache.SHARED)
+    assert second.get(SITE, URL) == (RESULT, ResultCache.MEMORY)
+    assert second.stats()["shared_hits"] == second.stats()["memory_hits"] == 1
+
+
+def test_equivalent_urls_share_results(tmp_path):
+    cache, _ = caches(tmp_path)
+    cache.set(SITE, URL, RESULT, info_type_list=["name", "phone"])
+    assert cache.get(SITE, "HTTPS://WWW.Yelp.com/biz/office/?a=1&b=2#reviews",
+                     info_type_list=["phone", "name"])[0] == RESULT
+    assert cache.get(SITE, URL, info_type_list=["name"]) == (None, None)
+
+
+def test_results_expire(tmp_path):
+    first, second = caches(tmp_path, ttl=0.2)
+    first.set(SITE, URL, RESULT)
+    time.sleep(0.25)
+    assert first.get(SITE, URL) == (None, None)
+    assert second.get(SITE, URL) == (None, None)
+
+
+def test_invalidating_an_url_drops_it_from_both_tiers(tmp_path):
+    first, second = caches(tmp_path)
+    other = "https://www.yelp.com/biz/other"
+    first.set(SITE, URL, RESULT)
+    first.set(SITE, URL, RESULT, info_type_list=["name"])
+    first.set(SITE, other, RESULT)
+    first.invalidate("https://www.yelp.com/biz/office/?a=1&b=2")
+
+    for cache in (first, second):
+        assert cache.get(SITE, URL) == (None, None)
+        assert cache.get(SITE, URL, info_type_list=["name"]) == (None, None)
+        assert cache.get(SITE, other)[0] == RESULT
+
+
+def test_shared_tier_prunes_expired_and_oldest_rows(tmp_path):
+    shared = SQLiteResultCache(str(tmp_path / "results.sqlite"), ttl=60, max_rows=3, prune_every=2)
+    shared.set("expired", URL, RESULT)
+    shared._connection().execute("UPDATE results SET stored_at = stored_at - 61")
+    shared._connection().commit()
+    for index in range(5):
+        shared.set("key %d" % index, URL, RESULT)
+
+    # pruned on the 6th store: the expired row, then the oldest rows beyond 3
+    keys = [row[0] for row in shared._connection().execute("SELECT key FROM results ORDER BY stored_at")]
+    assert keys == ["key 2", "key 3", "key 4"]
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import pytest
+import requests
+
+from spiders.retry_policy import (RetryPolicy, RetryBudget, CircuitBreaker, CircuitBreakers, CircuitOpenError,
+                                  SUCCESS, RETRY, FATAL)
+
+URL = "http://site.test/page"
+
+
+class Response(object):
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def policy(failure_threshold=3):
+    return RetryPolicy(max_attempts=3, base_delay=0, max_delay=0,
+                       breakers=CircuitBreakers(failure_threshold=failure_threshold, reset_timeout=60))
+
+
+def fetch(retry_policy, status, budget=None):
+    # one request answered status at every attempt, as the fetch loops run it
+    retries = retry_policy.begin(URL, budget)
+    while True:
+        retries.check_circuit()
+        outcome = retries.record(response=Response(status))
+        if outcome != RETRY or retries.next_delay() is None:
+            return outcome
+
+
+def test_bans_open_the_circuit():
+    retry_policy = policy()
+    assert [fetch(retry_policy, 403) for _ in range(3)] == [FATAL] * 3
+    with pytest.raises(CircuitOpenError):
+        fetch(retry_policy, 403)
+
+
+def test_final_outcomes_do_not_close_the_circuit():
+    retry_policy = policy()
+    fetch(retry_policy, 503)
+    fetch(retry_policy, 503)
+    assert fetch(retry_policy, 404) == FATAL
+    retries = retry_policy.begin(URL)
+    retries.record(error=ValueError("not the network's"))
+    assert retry_policy.breakers.for_host("site.test").failures == 2
+
+    # the third failure in a row opens the circuit: the retry is refused
+    with pytest.raises(CircuitOpenError):
+        fetch(retry_policy, 503)
+
+
+def test_success_closes_the_circuit():
+    retry_policy = policy()
+    fetch(retry_policy, 503)
+    assert fetch(retry_policy, 200) == SUCCESS
+    assert retry_policy.breakers.for_host("site.test").failures == 0
+
+
+def test_not_found_lets_another_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    retry_policy = RetryPolicy(max_attempts=1, breakers=CircuitBreakers())
+    retry_policy.breakers._breakers["site.test"] = breaker
+    fetch(retry_policy, 503)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # half open: the trial gets a 404, the next request is still let through
+    assert fetch(retry_policy, 404) == FATAL
+    assert fetch(retry_policy, 200) == SUCCESS
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_request_counts_once_in_the_budget():
+    budget = RetryBudget(ratio=0.5, min_retries=0)
+    retry_policy = RetryPolicy(max_attempts=10, base_delay=0, max_delay=0,
+                               breakers=CircuitBreakers(failure_threshold=1000))
+    for _ in range(4):
+        fetch(retry_policy, 503, budget)
+    # 4 requests: 2 retries in all, however many attempts they made
+    assert (budget.requests, budget.retries) == (4, 2)
+
+
+def test_network_errors_are_retried():
+    retries = policy().begin(URL)
+    assert retries.record(error=requests.exceptions.ConnectionError()) == RETRY
+
+
+def test_bans_are_retried_by_requests_that_change_proxy():
+    retries = policy().begin(URL, retry_bans=True)
+    assert retries.record(response=Response(403)) == RETRY
+    assert retries.banned
+    assert retries.next_delay() is not None
+    assert policy().begin(URL).record(response=Response(403)) == FATAL
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import json
+
+import openpyxl
+import pytest
+
+from common.roster import Roster, EXTERNAL_ID, YELP_URL, parse_shard
+
+HEADER = [EXTERNAL_ID, "Office", YELP_URL]
+
+
+def offices(count):
+    return [[100 + i, "Office %d" % i, "http://www.yelp.test/biz/%d" % i if i % 3 else ""] for i in range(count)]
+
+
+def write_roster(directory, extension, rows):
+    path = str(directory / ("roster" + extension))
+    if extension == ".xlsx":
+        workbook = openpyxl.Workbook()
+        workbook.active.append(HEADER)
+        for row in rows:
+            workbook.active.append(row)
+        workbook.save(path)
+    elif extension == ".csv":
+        with open(path, "w") as roster_file:
+            roster_file.write("\n".join(",".join(str(value) for value in row) for row in [HEADER] + rows) + "\n")
+    else:
+        with open(path, "w") as roster_file:
+            roster_file.write("".join(json.dumps(dict(zip(HEADER, row))) + "\n" for row in rows))
+
+    return path
+
+
+@pytest.mark.parametrize("extension", [".xlsx", ".csv", ".jsonl"])
+def test_count_is_told_without_reading_the_rows(tmp_path, extension):
+    roster = Roster(write_roster(tmp_path, extension, offices(30)))
+    assert roster.count() == 30
+    # offices without url are counted too: the count is an upper bound of the offices read
+    assert len(list(roster.offices(YELP_URL))) == 20
+
+
+def test_shards_split_the_roster_into_disjoint_complete_parts(tmp_path):
+    roster = Roster(write_roster(tmp_path, ".csv", offices(300)))
+    every_office = [office["external_id"] for office in roster.offices(YELP_URL)]
+    shards = [[office["external_id"] for office in roster.offices(YELP_URL, shard=parse_shard("%d/4" % index))]
+              for index in range(4)]
+
+    assert sorted(sum(shards, [])) == sorted(every_office)
+    assert all(shards)
+    # the same split on every node and run
+    assert [office["external_id"] for office in Roster(roster.path).offices(YELP_URL, shard=(2, 4))] == shards[2]
+
+
+@pytest.mark.parametrize("value", ["3/2", "2/2", "a/b", "0/0", "-1/3", "1", "1/2/3"])
+def test_bad_shards_are_rejected(value):
+    with pytest.raises(ValueError):
+        parse_shard(value)
+
+
+def test_empty_shard_is_the_whole_roster():
+    assert parse_shard("") is None
+    assert parse_shard(" 1/3 ") == (1, 3)
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import asyncio
+
+import pytest
+
+from spiders.singleflight import AsyncSingleFlight
+
+
+class Fetch(object):
+
+    def __init__(self, result="page", error=None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.release = None
+
+    async def __call__(self):
+        self.calls += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_followers_get_the_leader_result():
+    async def main():
+        flight, fetch = AsyncSingleFlight(), Fetch()
+        fetch.release = asyncio.Event()
+        callers = [asyncio.ensure_future(flight.do("key", fetch)) for _ in range(3)]
+        await asyncio.sleep(0)
+        fetch.release.set()
+        return await asyncio.gather(*callers), fetch.calls, flight.stats()
+
+    results, calls, stats = run(main())
+    assert results == ["page"] * 3
+    assert calls == 1
+    assert stats == {"leaders": 1, "followers": 2, "in_flight": 0}
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    async def main():
+        flight, fetch = AsyncSingleFlight(), Fetch()
+        fetch.release = asyncio.Event()
+        leader = asyncio.ensure_future(flight.do("key", fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do("key", fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        fetch.release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower, fetch.calls
+
+    assert run(main()) == ("page", 1)
+
+
+def test_errors_reach_every_caller():
+    async def main():
+        flight, fetch = AsyncSingleFlight(), Fetch(error=ValueError("broken page"))
+        fetch.release = asyncio.Event()
+        callers = [asyncio.ensure_future(flight.do("key", fetch)) for _ in range(2)]
+        await asyncio.sleep(0)
+        fetch.release.set()
+        return await asyncio.gather(*callers, return_exceptions=True), flight.stats()
+
+    results, stats = run(main())
+    assert [str(result) for result in results] == ["broken page"] * 2
+    assert stats["in_flight"] == 0
+
+
+def test_next_call_runs_again():
+    async def main():
+        flight, fetch = AsyncSingleFlight(), Fetch()
+        fetch.release = asyncio.Event()
+        fetch.release.set()
+        await flight.do("key", fetch)
+        await flight.do("key", fetch)
+        return fetch.calls
+
+    assert run(main()) == 2
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import time
+
+from common.work_queue import WorkQueue, READY, LEASED, DONE, FAILED
+from spiders.batch import BatchRunner
+
+SITE = "www.yelp.com"
+
+
+def offices(count):
+    return [{"row": i + 1, "external_id": 100 + i, "url": "http://www.yelp.test/biz/%d" % i} for i in range(count)]
+
+
+def work_queue(tmp_path, **kwargs):
+    queue = WorkQueue(str(tmp_path / "tasks.sqlite"), **kwargs)
+    queue.put(SITE, offices(3))
+    return queue
+
+
+def test_expired_leases_are_leased_again(tmp_path):
+    queue = work_queue(tmp_path, visibility_timeout=0.1)
+    first = queue.lease(SITE)
+    assert [queue.lease(SITE)["external_id"] for _ in range(2)] == [101, 102]
+    assert queue.lease(SITE) is None
+
+    time.sleep(0.15)
+    again = queue.lease(SITE)
+    assert (again["external_id"], again["attempts"]) == (first["external_id"], 2)
+    # the worker that let the lease expire can't ack it any more
+    assert not queue.ack(first)
+    assert queue.ack(again)
+
+
+def test_tasks_fail_after_max_attempts(tmp_path):
+    queue = work_queue(tmp_path, visibility_timeout=0.1, max_attempts=2)
+    # nacked every time
+    queue.put("nacked", offices(1))
+    for attempt in (1, 2):
+        task = queue.lease("nacked")
+        assert task["attempts"] == attempt
+        assert queue.nack(task, "broken")
+    assert queue.lease("nacked") is None
+    assert queue.counts("nacked")[FAILED] == 1
+
+    # leases expiring every time
+    for _ in range(2):
+        assert all(queue.lease(SITE) for _ in range(3))
+        time.sleep(0.15)
+    assert queue.lease(SITE) is None
+    assert queue.counts(SITE) == {READY: 0, LEASED: 0, DONE: 0, FAILED: 3}
+
+
+def test_stale_leases_are_refused(tmp_path):
+    queue = work_queue(tmp_path)
+    task = queue.lease(SITE)
+    assert queue.ack(task)
+    assert not queue.ack(task)
+    assert not queue.nack(task)
+    assert not queue.ack(dict(task, lease="not the lease"))
+    assert queue.counts(SITE)[DONE] == 1
+
+
+def test_tasks_read_but_never_processed_are_given_back(tmp_path):
+    queue = work_queue(tmp_path, visibility_timeout=60)
+    queue.put(SITE, offices(10))
+    processed = []
+
+    def scrape(task):
+        time.sleep(0.02)
+        assert queue.ack(task)
+        processed.append(task["external_id"])
+
+    # a single host: rows read after the running one are held back (up to a row per worker)
+    runner = BatchRunner(scrape, workers=2, per_host=1)
+    results = runner.run(queue.tasks(SITE))
+    next(results)
+    results.close()
+
+    counts = queue.counts(SITE)
+    assert runner.rows_read == 3
+    assert counts[DONE] == len(processed) and counts[LEASED] == 0
+    assert counts[READY] == 10 - len(processed)
+    # given back without counting an attempt
+    assert all(task["attempts"] == 1 for task in queue.tasks(SITE))
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+# !/usr/bin/python
+
+import re
+
+import pytest
+from lxml import html
+
+from benchmarks.synthetic_pages import yelp_business_page
+from common.xpaths import XPathRegistry, registry, select, extract, re_all
+
+PAGE = html.fromstring(yelp_business_page(reviews=5))
+
+
+@pytest.mark.parametrize("name", ["yelp.og_type", "yelp.ld_json", "yelp.phone", "yelp.hours_rows", "yelp.img_src"])
+def test_registered_selectors_match_tree_xpath(name):
+    expected = PAGE.xpath(registry[name].expression)
+    assert expected
+    assert select(name, PAGE) == expected
+    # plain strings, not lxml smart strings keeping the tree alive
+    assert not any(hasattr(value, "getparent") for value in select(name, PAGE) if isinstance(value, str))
+
+
+def test_relative_selectors_and_helpers():
+    rows = select("yelp.hours_rows", PAGE)
+    assert [select("yelp.hours_row_day", row) for row in rows] == [row.xpath("./th/text()") for row in rows]
+    assert extract(select("yelp.hours_row_cells", rows[0])[0]).startswith("<td")
+    phone = PAGE.xpath("//span[@class='biz-phone']/text()")
+    assert re_all(r"\d+", select("yelp.phone", PAGE)) == [number for value in phone for number in re.findall(r"\d+", value)]
+
+
+def test_selectors_are_timed_and_names_unique():
+    selectors = XPathRegistry()
+    selector = selectors.register("og_type", '//meta[@property="og:type"]/@content')
+    selector(PAGE)
+    selector(PAGE)
+    assert selectors.stats()[0]["name"] == "og_type" and selectors.stats()[0]["calls"] == 2
+    assert selectors.register("og_type", '//meta[@property="og:type"]/@content') is selector
+    with pytest.raises(ValueError):
+        selectors.register("og_type", "//title/text()")